@@ -0,0 +1,419 @@
+"""Numeric work behind the dashboard charts
+
+pandas is imported by the functions that build frames, not here: it costs
+more at start-up than everything else the first page needs.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+
+from storage import SKILLS, TREND_EPOCH
+
+def lttb_indices(y, budget):
+    """Positions of the points Largest-Triangle-Three-Buckets keeps out of y
+
+    The first and last points are always kept; everything in between is split
+    into budget - 2 buckets and each bucket contributes the point that forms
+    the largest triangle with the previously kept point and the average of the
+    next bucket. That keeps more of the shape than plain striding, but it is
+    still one point per bucket: a bucket holding both a spike and a dip keeps
+    only one of them, and the zoom shows the rest at full resolution.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if budget >= n or budget < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float)
+
+    # Bucket edges over the interior points 1 .. n-2
+    edges = np.linspace(1, n - 1, budget - 1).astype(int)
+    kept = np.empty(budget, dtype=int)
+    kept[0] = 0
+    kept[-1] = n - 1
+    previous = 0
+    for bucket in range(budget - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        # Twice the triangle area for every candidate in the bucket at once
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        kept[bucket + 1] = previous
+    return kept
+
+def downsample_frame(df, budget, column='Score'):
+    """Rows of df chosen by LTTB on one column, in their original order"""
+    if len(df) <= budget:
+        return df
+    return df.iloc[lttb_indices(df[column].to_numpy(), budget)]
+
+# Trends and forecasts. Times are day numbers as produced by entry_day() in
+# storage.py; every function works on whole arrays, never per test.
+TARGET_BAND = 7.0
+ROLLING_WINDOW = 5
+EWMA_SPAN = 10
+# Two-sided 95% normal quantile for the confidence bands
+CONFIDENCE_Z = 1.96
+# Exponents stay well inside float range within one block of the EWMA
+EWMA_BLOCK = 512
+
+def rolling_mean(y, window=ROLLING_WINDOW):
+    """Trailing mean of the last window points at every position (fewer at the start)"""
+    y = np.asarray(y, dtype=float)
+    sums = np.concatenate(([0.0], np.cumsum(y)))
+    end = np.arange(1, len(y) + 1)
+    start = np.maximum(end - window, 0)
+    return (sums[end] - sums[start]) / (end - start)
+
+def ewma(y, span=EWMA_SPAN):
+    """Exponentially weighted moving average, matching pandas' ewm(span=...).mean()
+
+    Each point is a ratio of two decayed sums; inside a block those are
+    cumulative sums of y scaled by growing powers, and the sums carry over
+    from one block to the next.
+    """
+    y = np.asarray(y, dtype=float)
+    decay = 1 - 2 / (span + 1)
+    out = np.empty_like(y)
+    numerator = denominator = 0.0
+    for start in range(0, len(y), EWMA_BLOCK):
+        block = y[start:start + EWMA_BLOCK]
+        powers = decay ** np.arange(len(block))
+        grow = 1 / powers
+        num = powers * (numerator * decay + np.cumsum(block * grow))
+        den = powers * (denominator * decay + np.cumsum(grow))
+        out[start:start + len(block)] = num / den
+        numerator, denominator = num[-1], den[-1]
+    return out
+
+def fit_moments(n, st, sy, stt, sty, syy):
+    """Least-squares line from running sums, or None with too few distinct tests
+
+    Returns the slope (bands per day), the intercept, the residual standard
+    deviation and the centring terms forecast() needs for its bounds.
+    """
+    if n < 3:
+        return None
+    t_mean = st / n
+    y_mean = sy / n
+    sxx = stt - st * t_mean
+    sxy = sty - st * y_mean
+    syy_centred = syy - sy * y_mean
+    # All tests on (nearly) the same minute: no time axis to fit against
+    if sxx <= 1e-6 * n:
+        return None
+    slope = sxy / sxx
+    sse = max(syy_centred - slope * sxy, 0.0)
+    return {
+        'n': n,
+        'slope': slope,
+        'intercept': y_mean - slope * t_mean,
+        'sigma': float(np.sqrt(sse / (n - 2))),
+        't_mean': t_mean,
+        'sxx': sxx
+    }
+
+def fit_line(t, y, weights=None):
+    """Weighted least-squares line through arrays of days and scores"""
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    w = np.ones_like(t) if weights is None else np.asarray(weights, dtype=float)
+    # Shift to the mean day first; the sums stay well conditioned
+    origin = t.mean() if len(t) else 0.0
+    d = t - origin
+    fit = fit_moments(w.sum(), (w * d).sum(), (w * y).sum(),
+                      (w * d * d).sum(), (w * d * y).sum(), (w * y * y).sum())
+    if fit is not None:
+        fit['intercept'] -= fit['slope'] * origin
+        fit['t_mean'] += origin
+    return fit
+
+def huber_fit(t, y, k=1.345, iterations=20):
+    """Line fitted by iteratively reweighted least squares with Huber weights
+
+    Points more than k robust deviations off the line are down-weighted, so a
+    single bad mock test cannot swing the trend.
+    """
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    weights = np.ones_like(y)
+    fit = fit_line(t, y)
+    for _ in range(iterations):
+        if fit is None:
+            return None
+        residuals = y - (fit['intercept'] + fit['slope'] * t)
+        scale = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
+        if scale <= 0:
+            break
+        scaled = np.abs(residuals) / (k * scale)
+        new_weights = np.where(scaled <= 1, 1.0, 1 / np.maximum(scaled, 1))
+        if np.allclose(new_weights, weights, atol=1e-4):
+            break
+        weights = new_weights
+        fit = fit_line(t, y, weights)
+    return fit
+
+def forecast(fit, today, target=TARGET_BAND, z=CONFIDENCE_Z):
+    """When the fitted line reaches target, as day numbers
+
+    'status' is 'reached' when the line is already at target today, 'flat'
+    when it is not rising, and 'projected' otherwise. 'earliest' and 'latest'
+    are where the upper and lower confidence bounds cross target; 'latest' is
+    None while the slope is too uncertain for the lower bound ever to get there.
+    """
+    if fit is None:
+        return None
+    level_today = fit['intercept'] + fit['slope'] * today
+    if level_today >= target:
+        return {'status': 'reached', 'day': today, 'earliest': today, 'latest': today}
+    if fit['slope'] <= 0:
+        return {'status': 'flat', 'day': None, 'earliest': None, 'latest': None}
+    day = (target - fit['intercept']) / fit['slope']
+    # Band crossings solve (gap - slope * u)^2 = q * (1/n + u^2 / sxx) in u = t - t_mean
+    q = (z * fit['sigma']) ** 2
+    gap = target - (fit['intercept'] + fit['slope'] * fit['t_mean'])
+    a = fit['slope'] ** 2 - q / fit['sxx']
+    b = -2 * fit['slope'] * gap
+    c = gap ** 2 - q / fit['n']
+    earliest = latest = None
+    if a > 0:
+        root = np.sqrt(max(b * b - 4 * a * c, 0.0))
+        earliest = fit['t_mean'] + (-b - root) / (2 * a)
+        latest = fit['t_mean'] + (-b + root) / (2 * a)
+    return {
+        'status': 'projected',
+        'day': day,
+        'earliest': max(earliest, today) if earliest is not None else None,
+        'latest': latest
+    }
+
+def progress_frame(minutes, scores, archived=0, period='week'):
+    """Chart frame of a skill's (minutes, scores) columns (oldest first), or None when empty
+
+    The first archived rows are period means from the archive tier (see
+    storage.history_columns): they are labelled by period rather than as
+    tests and flagged in the Archived column.
+    """
+    if not len(scores):
+        return None
+    import pandas as pd
+
+    moments = np.asarray(minutes, dtype=np.int64).astype('datetime64[m]')
+    dates = np.datetime_as_string(moments, unit='D')
+    period_label = 'Week of' if period == 'week' else 'Day'
+    df = pd.DataFrame({
+        'Test': [f"{period_label} {day}" for day in dates[:archived]] +
+                [f"Test {i+1}" for i in range(len(scores) - archived)],
+        'Date': dates,
+        'Day': (moments - np.datetime64(TREND_EPOCH, 'm')).astype(float) / 1440,
+        'Score': scores,
+        'Rolling avg': rolling_mean(scores),
+        'Trend': ewma(scores),
+        'Archived': np.arange(len(scores)) < archived,
+    })
+    # Indexed up front so renders can use the cached frame without copying
+    return df.set_index('Test')
+
+# Overall band. The four skills are joined as of every minute any of them
+# was tested: each row holds the latest score of each skill at that minute,
+# so the band is what an exam sat right then would have reported.
+def ielts_round(mean):
+    """Overall band from the mean of the four skills, rounded the IELTS way
+
+    The mean goes to the nearest half band, and one halfway between two goes
+    up: .25 becomes .5 and .75 the next whole band, so 6.375 gives 6.5 and
+    6.125 gives 6.0.
+    """
+    return np.floor(np.asarray(mean, dtype=float) * 2 + 0.5) / 2
+
+def align_skills(columns, after=None):
+    """(minutes, bands) of the as-of join of every skill's (minutes, scores)
+
+    Rows start at the first minute all four skills have a test; with after,
+    only minutes later than it are joined.
+    """
+    timeline = np.unique(np.concatenate([
+        minutes if after is None else minutes[minutes > after] for minutes, _ in columns
+    ]).astype(np.int64))
+    # Latest test at or before each minute; -1 where a skill has none yet
+    positions = np.column_stack([
+        np.searchsorted(minutes, timeline, side='right') - 1 for minutes, _ in columns
+    ]) if len(timeline) else np.empty((0, len(columns)), dtype=np.int64)
+    complete = (positions >= 0).all(axis=1)
+    positions = positions[complete]
+    bands = np.column_stack([
+        np.asarray(scores, dtype=float)[positions[:, i]] for i, (_, scores) in enumerate(columns)
+    ]) if len(positions) else np.empty((0, len(columns)))
+    return timeline[complete], bands
+
+class OverallBands:
+    """Time-aligned overall band, built from the four skills' columns in SKILLS order
+
+    update() joins only the minutes after the last one seen when the new
+    columns just add tests at the end, which is what adding today's score
+    does. A removal or a back-dated test realigns the whole history.
+    """
+
+    def __init__(self, columns, minutes, bands):
+        self.columns = columns
+        self.minutes = minutes
+        self.bands = bands
+        self.overall = ielts_round(bands.mean(axis=1)) if len(bands) else np.empty(0)
+
+    @classmethod
+    def build(cls, columns):
+        columns = [(np.asarray(m, dtype=np.int64), np.asarray(s, dtype=float)) for m, s in columns]
+        return cls(columns, *align_skills(columns))
+
+    def _last_minute(self):
+        ends = [minutes[-1] for minutes, _ in self.columns if len(minutes)]
+        return max(ends) if ends else None
+
+    def _extends(self, columns, after):
+        for (old_minutes, old_scores), (minutes, scores) in zip(self.columns, columns):
+            size = len(old_minutes)
+            if len(minutes) < size:
+                return False
+            if not (np.array_equal(minutes[:size], old_minutes) and np.array_equal(scores[:size], old_scores)):
+                return False
+            if len(minutes) > size and after is not None and minutes[size] <= after:
+                return False
+        return True
+
+    def update(self, columns):
+        """OverallBands of newer columns; this one is left as it is for whoever holds it"""
+        columns = [(np.asarray(m, dtype=np.int64), np.asarray(s, dtype=float)) for m, s in columns]
+        after = self._last_minute()
+        if not self._extends(columns, after):
+            return OverallBands.build(columns)
+        minutes, bands = align_skills(columns, after)
+        if not len(minutes):
+            return OverallBands(columns, self.minutes, self.bands)
+        return OverallBands(columns, np.concatenate([self.minutes, minutes]),
+                            np.concatenate([self.bands, bands]))
+
+    def __len__(self):
+        return len(self.minutes)
+
+def overall_frame(overall):
+    """Chart frame of an OverallBands: overall band and each skill's band, indexed by time"""
+    import pandas as pd
+
+    df = pd.DataFrame(overall.bands, columns=[skill.title() for skill in SKILLS])
+    df.insert(0, 'Overall', overall.overall)
+    df.index = pd.DatetimeIndex(overall.minutes.astype('datetime64[m]'), name='Time')
+    return df
+
+# Cohort view. Everything below works on the per-student rollups from
+# storage.cohort_rollups(), so its cost grows with students, not tests.
+def cohort_frame(rollups, today):
+    """One row per student: exam date, days left, latest band per skill, readiness and trend"""
+    import pandas as pd
+
+    rows = []
+    for rollup in rollups:
+        target = date.fromisoformat(rollup['target_date'])
+        skills = rollup['skills']
+        tests = sum(skills[skill]['count'] for skill in SKILLS)
+        fits = [fit_moments(**skills[skill]['moments']) for skill in SKILLS]
+        slopes = [fit['slope'] for fit in fits if fit]
+        row = {
+            'Student': rollup['user'],
+            'Exam date': target,
+            'Days left': (target - today).days,
+            'Tests': tests,
+            'Average': round(sum(skills[skill]['total'] for skill in SKILLS) / tests, 1) if tests else None,
+            # Same rule as the Exam Readiness card: latest test at the target band
+            'Ready': sum(1 for skill in SKILLS if skills[skill]['latest'] >= TARGET_BAND),
+            'Bands/month': round(30 * sum(slopes) / len(slopes), 2) if slopes else None,
+        }
+        for skill in SKILLS:
+            row[skill.title()] = skills[skill]['latest'] if skills[skill]['count'] else None
+        rows.append(row)
+    columns = ['Student', 'Exam date', 'Days left', 'Tests', 'Average', 'Ready', 'Bands/month',
+               *(skill.title() for skill in SKILLS)]
+    return pd.DataFrame(rows, columns=columns)
+
+def at_risk(frame):
+    """Students with an exam ahead and a skill below target, nearest exam first"""
+    risky = frame[(frame['Ready'] < len(SKILLS)) & (frame['Days left'] >= 0)]
+    return risky.sort_values(['Days left', 'Ready', 'Average'])
+
+def band_distribution(frame):
+    """Students per latest band (rows) and skill (columns)"""
+    import pandas as pd
+
+    skills = [skill.title() for skill in SKILLS]
+    counts = {skill: frame[skill].value_counts() for skill in skills}
+    return pd.DataFrame(counts, columns=skills).fillna(0).astype(int).sort_index()
+
+def cohort_trend(rollups):
+    """Mean band of each week's tests across all students, one column per skill"""
+    import pandas as pd
+
+    columns = {}
+    for skill in SKILLS:
+        weeks = {}
+        for rollup in rollups:
+            for week, (count, total) in rollup['skills'][skill]['weeks'].items():
+                bucket = weeks.setdefault(week, [0, 0.0])
+                bucket[0] += count
+                bucket[1] += total
+        columns[skill.title()] = pd.Series({week: total / count for week, (count, total) in weeks.items()},
+                                           dtype=float)
+    frame = pd.DataFrame(columns)
+    frame.index = pd.to_datetime(frame.index)
+    return frame.sort_index()
+
+# Question types. These read the weekly rollups kept by items.ItemStore
+# ({type: {Monday: [correct, total]}}), so their cost grows with weeks, not items.
+RECENT_WEEKS = 4
+
+def item_accuracy_frame(weeks, window=RECENT_WEEKS):
+    """Percent correct per question type (columns) over the trailing window of weeks (rows)
+
+    Counts are pooled over the window before dividing, so a week with two
+    questions of a type cannot swing its line on its own.
+    """
+    import pandas as pd
+
+    rights = pd.DataFrame({name: {week: bucket[0] for week, bucket in buckets.items()}
+                           for name, buckets in weeks.items()})
+    totals = pd.DataFrame({name: {week: bucket[1] for week, bucket in buckets.items()}
+                           for name, buckets in weeks.items()})
+    if totals.empty:
+        return totals
+    index = pd.date_range(min(totals.index), max(totals.index), freq='7D', name='Week')
+    rights = rights.set_axis(pd.to_datetime(rights.index)).reindex(index, fill_value=0).fillna(0)
+    totals = totals.set_axis(pd.to_datetime(totals.index)).reindex(index, fill_value=0).fillna(0)
+    pooled = totals.rolling(window, min_periods=1).sum()
+    return (100 * rights.rolling(window, min_periods=1).sum() / pooled.where(pooled > 0)).round(1)
+
+def question_type_table(weeks, today, recent_weeks=RECENT_WEEKS):
+    """One row per question type: questions answered, accuracy overall and lately, weakest first"""
+    import pandas as pd
+
+    since = (today - timedelta(days=today.weekday() + 7 * (recent_weeks - 1))).isoformat()
+    recent_column = f"Last {recent_weeks} weeks %"
+    rows = []
+    for name, buckets in weeks.items():
+        right = sum(bucket[0] for bucket in buckets.values())
+        total = sum(bucket[1] for bucket in buckets.values())
+        recent = [bucket for week, bucket in buckets.items() if week >= since]
+        recent_total = sum(bucket[1] for bucket in recent)
+        rows.append({
+            'Question type': name,
+            'Questions': total,
+            'Accuracy %': round(100 * right / total, 1),
+            recent_column: round(100 * sum(bucket[0] for bucket in recent) / recent_total, 1)
+            if recent_total else None,
+        })
+    frame = pd.DataFrame(rows, columns=['Question type', 'Questions', 'Accuracy %', recent_column])
+    return frame.sort_values('Accuracy %', ignore_index=True)
@@ -0,0 +1,427 @@
+"""Local JSON API over the score store, for index.html and other clients
+
+    $ python api.py --port 8765
+    $ IELTS_API_PORT=8765 streamlit run streamlit_app.py
+
+Both serve index.html at / and the API under /api on 127.0.0.1, so the
+standalone page and the Streamlit app read and write the same store. Every
+endpoint takes ?user=... like the app.
+
+    GET    /api/state                    scores of every skill and the exam date
+    GET    /api/scores/<skill>           one skill's entries, oldest first
+    POST   /api/scores/<skill>           {"date", "time", "score"[, "id"]} adds an entry
+    DELETE /api/scores/<skill>/<id>      removes one
+    DELETE /api/scores                   removes every score, keeping the exam date
+    GET    /api/target-date              {"value": "YYYY-MM-DD"}
+    PUT    /api/target-date              {"value": "YYYY-MM-DD"} sets it
+    GET    /api/changes?since=N&epoch=E  the change records after version N
+
+Changes are numbered per user by this server (a ChangeLog) from whatever
+reaches the store, including saves made by Streamlit sessions in other
+processes. The numbers restart with each server, so they come with an epoch:
+a client whose epoch or version is no longer covered gets the full state
+instead of a delta. GETs carry an ETag and answer If-None-Match with 304.
+Adds with an id already stored change nothing and removes of missing ids
+answer 404, so clients can replay a queue of offline mutations safely.
+
+Changes need a JSON body (Content-Type: application/json) and are refused
+with 403 unless addressed to 127.0.0.1 or localhost on the server's port,
+from that origin or with no Origin at all. A page opened from disk or
+served elsewhere can read the scores but should be opened from the server
+to change them.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from items import ItemStore
+from metrics import registry
+from storage import DEFAULT_USER, SKILLS, clean_user_id, datetime_minute, open_store
+from transfer import TIME_PATTERN
+
+DEFAULT_PORT = 8765
+# Change records kept per user; clients further behind get the full state
+CHANGE_LOG_LIMIT = 5000
+MAX_BODY_BYTES = 64 * 1024
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "index.html")
+# Pages opened from disk send Origin: null
+LOCAL_ORIGIN = re.compile(r'^(?:null|https?://(?:localhost|127\.0\.0\.1|\[::1\])(?::\d+)?)$')
+# POST, PUT and DELETE are only taken addressed to one of these names on the
+# server's own port, and from a page it served (or a client sending no
+# Origin), so other sites and DNS rebinding cannot change scores
+MUTATING_METHODS = ('POST', 'PUT', 'DELETE')
+SERVER_HOSTS = ('127.0.0.1', 'localhost')
+
+registry.describe('ielts_api_requests_total', "Local API requests by method and status")
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def parse_entry(body):
+    """A store entry from a posted {date, time, score[, id]}; ApiError if it is not one"""
+    if not isinstance(body, dict):
+        raise ApiError(400, "expected a JSON object")
+    try:
+        entry_date = datetime.strptime(str(body.get('date', '')), '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise ApiError(400, "date must be YYYY-MM-DD") from None
+    entry_time = str(body.get('time') or '00:00')
+    if not re.match(TIME_PATTERN, entry_time):
+        raise ApiError(400, "time must be HH:MM")
+    score = body.get('score')
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 9 or score * 2 % 1:
+        raise ApiError(400, "score must be a band from 0 to 9 in 0.5 steps")
+    entry_id = str(body.get('id') or f"{entry_date}_{entry_time}_{uuid.uuid4().hex[:12]}")
+    return {'id': entry_id, 'date': entry_date, 'time': entry_time, 'score': float(score),
+            'datetime': f"{entry_date} {entry_time}"}
+
+class ChangeLog:
+    """Numbered change records of one user's store, for delta responses
+
+    sync() compares each skill's data_version with the one last seen and diffs
+    the ids of skills that moved, so it records changes from any writer.
+    Requests for a user run under its lock, which also keeps a SQLite
+    connection to one thread at a time.
+    """
+
+    def __init__(self, store, limit=CHANGE_LOG_LIMIT):
+        self.store = store
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.records = deque(maxlen=limit)
+        self.lock = threading.RLock()
+        # Log version of the last change to each skill and to the exam date
+        self.skill_versions = dict.fromkeys(SKILLS, 0)
+        self.target_version = 0
+        view = store.snapshot()
+        self._seen = {skill: (view.data_version(skill), {entry['id'] for entry in view.entries(skill)})
+                      for skill in SKILLS}
+        self._target_date = view.target_date
+
+    def _append(self, record):
+        self.version += 1
+        self.records.append(dict(record, version=self.version))
+
+    def sync(self):
+        """Number whatever changed in the store since the last sync; lock held"""
+        self.store.refresh()
+        view = self.store.snapshot()
+        for skill in SKILLS:
+            data_version = view.data_version(skill)
+            seen_version, seen_ids = self._seen[skill]
+            if data_version == seen_version:
+                continue
+            ids = set()
+            for entry in view.entries(skill):
+                ids.add(entry['id'])
+                if entry['id'] not in seen_ids:
+                    self._append({'op': 'add', 'skill': skill, 'entry': entry})
+            for entry_id in seen_ids - ids:
+                self._append({'op': 'remove', 'skill': skill, 'id': entry_id})
+            if ids != seen_ids:
+                self.skill_versions[skill] = self.version
+            self._seen[skill] = (data_version, ids)
+        if view.target_date != self._target_date:
+            self._target_date = view.target_date
+            self._append({'op': 'target_date', 'value': view.target_date.strftime('%Y-%m-%d')})
+            self.target_version = self.version
+        return view
+
+    def since(self, version):
+        """Records after version, or None if they are no longer all kept"""
+        oldest = self.records[0]['version'] - 1 if self.records else self.version
+        if not oldest <= version <= self.version:
+            return None
+        return [record for record in self.records if record['version'] > version]
+
+    def etag(self, version):
+        return f'"{self.epoch}.{version}"'
+
+def state_payload(log, view):
+    return {
+        'epoch': log.epoch,
+        'version': log.version,
+        'full': True,
+        'target_date': view.target_date.strftime('%Y-%m-%d'),
+        'scores': {skill: list(view.entries(skill)) for skill in SKILLS}
+    }
+
+def _names_server(netloc, port, scheme='http'):
+    """Whether a Host header or an origin's host[:port] is this server by a local name"""
+    try:
+        url = urlsplit(f"{scheme}://{netloc}")
+        given = url.port or (443 if scheme == 'https' else 80)
+    except ValueError:
+        return False
+    return url.hostname in SERVER_HOSTS and given == port
+
+def _matches(header, etag):
+    """Whether an If-None-Match header names etag"""
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def do_OPTIONS(self):
+        # CORS preflight from a page on another local origin; its reads are
+        # answered, its changes refused (see MUTATING_METHODS)
+        self.send_response(204)
+        self._cors_headers()
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        self.send_header('Access-Control-Max-Age', '600')
+        self.end_headers()
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part]
+        try:
+            if method == 'GET' and parts in ([], ['index.html']):
+                self._send_page()
+                status = 200
+            elif parts[:1] != ['api']:
+                raise ApiError(404, "not found")
+            else:
+                if method in MUTATING_METHODS:
+                    self._check_local()
+                log = self.server.change_log(clean_user_id(params.get('user', DEFAULT_USER)))
+                with log.lock:
+                    status = self._route(method, parts[1:], params, log)
+        except ApiError as e:
+            status = e.status
+            self._send_json(status, {'error': str(e)})
+        except Exception:
+            logging.exception("API request %s %s failed", method, self.path)
+            status = 500
+            self._send_json(status, {'error': "internal error"})
+        registry.inc('ielts_api_requests_total', method=method, status=str(status))
+
+    def _route(self, method, parts, params, log):
+        """Answer one API request with the user's log locked; returns the status sent"""
+        view = log.sync()
+        resource = parts[0] if parts else ''
+        if resource == 'state' and method == 'GET':
+            return self._send_cached(log.etag(log.version), lambda: state_payload(log, view))
+        if resource == 'changes' and method == 'GET':
+            return self._send_cached(log.etag(log.version), lambda: self._changes(log, view, params))
+        if resource == 'target-date':
+            if method == 'GET':
+                return self._send_cached(log.etag(log.target_version),
+                                         lambda: {'value': view.target_date.strftime('%Y-%m-%d')})
+            if method == 'PUT':
+                value = self._read_body().get('value')
+                try:
+                    value = datetime.strptime(str(value), '%Y-%m-%d').strftime('%Y-%m-%d')
+                except ValueError:
+                    raise ApiError(400, "value must be YYYY-MM-DD") from None
+                log.store.save({'op': 'target_date', 'value': value})
+                log.sync()
+                return self._send_json(200, {'value': value, 'version': log.version})
+        if resource == 'scores':
+            return self._scores(method, parts[1:], log, view)
+        raise ApiError(404 if method == 'GET' else 405, "no such endpoint")
+
+    def _changes(self, log, view, params):
+        records = None
+        if params.get('epoch') == log.epoch:
+            try:
+                records = log.since(int(params.get('since', '')))
+            except ValueError:
+                raise ApiError(400, "since must be a version number") from None
+        if records is None:
+            return state_payload(log, view)
+        return {'epoch': log.epoch, 'version': log.version, 'full': False, 'changes': records}
+
+    def _scores(self, method, parts, log, view):
+        store = log.store
+        if not parts:
+            if method != 'DELETE':
+                raise ApiError(405, "use /api/scores/<skill>")
+            store.clear()
+            ItemStore(store.user).clear()
+            log.sync()
+            return self._send_json(200, {'version': log.version})
+        skill = parts[0]
+        if skill not in SKILLS:
+            raise ApiError(404, f"unknown skill: {skill}")
+        if len(parts) == 1 and method == 'GET':
+            return self._send_cached(log.etag(log.skill_versions[skill]), lambda: {
+                'skill': skill, 'version': log.skill_versions[skill], 'entries': list(view.entries(skill))
+            })
+        if len(parts) == 1 and method == 'POST':
+            entry = parse_entry(self._read_body())
+            # Tests this old are already counted in the archive tier (storage.RETENTION_DAYS)
+            until = view.archived(skill).until
+            if until is not None and datetime_minute(entry['datetime']) <= until:
+                raise ApiError(409, "this date is already rolled into the archived history")
+            if not view.existing_ids(skill, [entry['id']]):
+                store.save({'op': 'add', 'skill': skill, 'entry': entry})
+            log.sync()
+            return self._send_json(201, {'entry': entry, 'version': log.version})
+        if len(parts) == 2 and method == 'DELETE':
+            if not view.existing_ids(skill, [parts[1]]):
+                raise ApiError(404, "no such entry")
+            store.save({'op': 'remove', 'skill': skill, 'id': parts[1]})
+            ItemStore(store.user).remove_entries([parts[1]])
+            log.sync()
+            return self._send_json(200, {'version': log.version})
+        raise ApiError(405, "method not allowed")
+
+    def _check_local(self):
+        port = self.server.server_address[1]
+        if not _names_server(self.headers.get('Host', ''), port):
+            raise ApiError(403, "requests must be addressed to 127.0.0.1 or localhost")
+        origin = self.headers.get('Origin')
+        if origin is not None:
+            url = urlsplit(origin)
+            if url.scheme not in ('http', 'https') or not _names_server(url.netloc, port, url.scheme):
+                raise ApiError(403, f"changes are not accepted from origin {origin}")
+
+    def _read_body(self):
+        if self.headers.get_content_type() != 'application/json':
+            raise ApiError(415, "request body must be application/json")
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        # rfile.read(-1) would wait for the client to close the connection
+        if length < 0:
+            raise ApiError(400, "Content-Length must be a byte count")
+        if length > MAX_BODY_BYTES:
+            raise ApiError(413, "request body too large")
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise ApiError(400, "request body is not JSON") from None
+
+    def _send_cached(self, etag, payload):
+        """200 with payload() and its ETag, or 304 if the client already has it"""
+        if _matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self._cors_headers()
+            self.end_headers()
+            return 304
+        return self._send_json(200, payload(), etag)
+
+    def _send_json(self, status, payload, etag=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        # Cached by the browser, but always revalidated with If-None-Match
+        self.send_header('Cache-Control', 'no-cache')
+        if etag:
+            self.send_header('ETag', etag)
+        self._cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def _send_page(self):
+        with open(INDEX_FILE, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _cors_headers(self):
+        origin = self.headers.get('Origin')
+        if origin and LOCAL_ORIGIN.match(origin):
+            self.send_header('Access-Control-Allow-Origin', origin)
+            self.send_header('Access-Control-Expose-Headers', 'ETag')
+        self.send_header('Vary', 'Origin')
+
+    def log_message(self, format, *args):
+        pass
+
+class ApiServer(ThreadingHTTPServer):
+    """The API on one port; stores come from open_user(user), loaded"""
+
+    daemon_threads = True
+
+    def __init__(self, address, open_user):
+        super().__init__(address, _ApiHandler)
+        self.open_user = open_user
+        self._logs = {}
+        self._logs_lock = threading.Lock()
+
+    def change_log(self, user):
+        with self._logs_lock:
+            log = self._logs.get(user)
+            if log is None:
+                log = self._logs[user] = ChangeLog(self.open_user(user))
+            return log
+
+def open_loaded(engine=None, write_behind=None):
+    """open_user for stores this server opens itself, one per user"""
+    def open_user(user):
+        store = open_store(engine, user, write_behind)
+        store.load()
+        return store
+    return open_user
+
+def start_server(port, open_user=None, host='127.0.0.1'):
+    """Serve the API on a background thread; returns the server"""
+    server = ApiServer((host, port), open_user or open_loaded())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def setup_from_env(open_user=None):
+    """Start the API if IELTS_API_PORT asks for it; returns the server or None"""
+    port = os.environ.get("IELTS_API_PORT")
+    if not port:
+        return None
+    try:
+        return start_server(int(port), open_user)
+    except OSError:
+        # Another process of this deployment already serves the port
+        logging.exception("Could not start the API on port %s", port)
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve index.html and the score API on localhost")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--host', default='127.0.0.1', help="keep it local: the API has no authentication")
+    parser.add_argument('--engine', choices=['json', 'sqlite'], help="storage engine (default: IELTS_STORAGE)")
+    args = parser.parse_args(argv)
+    server = ApiServer((args.host, args.port), open_loaded(args.engine))
+    print(f"Serving http://{args.host}:{args.port}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        # Write-behind stores flush at exit (storage._flush_on_exit)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
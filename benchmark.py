@@ -0,0 +1,360 @@
+"""Benchmarks for the load, save, rerun and chart paths on synthetic histories
+
+Each size gets a fresh store in a temporary directory, spread evenly over the
+four skills, and every operation is timed the way the app performs it:
+
+    $ python benchmark.py --sizes 1000 10000 --save-baseline baseline.json
+    $ python benchmark.py --sizes 1000 10000 --compare baseline.json
+
+Start-up is timed in fresh interpreters, since that is where import and
+first-load costs show: how long until the app's modules are imported and the
+store is loaded, and how long until the first page is complete. Their peak is
+the child process's resident memory rather than traced allocations.
+
+With --compare the run exits non-zero when an operation's median latency is
+worse than the baseline by more than --threshold (a fraction, 0.25 = 25%).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from analytics import item_accuracy_frame, progress_frame, question_type_table
+from items import ITEM_CHUNK_ROWS, QUESTION_TYPES, QUESTIONS_PER_TEST, ItemStore, default_section
+from storage import SKILLS, SqliteStore, open_store, try_file_lock
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+PERCENTILES = [50, 95, 99]
+
+def synthetic_entries(count, seed=0):
+    """count entries per skill, an hour apart and ending now, drifting upwards"""
+    rng = random.Random(seed)
+    start = datetime.now().replace(second=0, microsecond=0) - timedelta(hours=count)
+    entries = []
+    for i in range(count):
+        moment = start + timedelta(hours=i)
+        day = moment.strftime('%Y-%m-%d')
+        time_of_day = moment.strftime('%H:%M')
+        score = min(9.0, max(0.0, round((4.5 + 3 * i / count + rng.gauss(0, 0.6)) * 2) / 2))
+        entries.append({
+            'id': f"{day}_{time_of_day}_{i:012x}",
+            'date': day,
+            'time': time_of_day,
+            'score': score,
+            'datetime': f"{day} {time_of_day}"
+        })
+    return entries
+
+def generate_store(engine, size):
+    """Write a store holding size entries across the four skills in the current directory"""
+    per_skill = max(1, size // len(SKILLS))
+    if engine == "json":
+        # A plain snapshot, like one written by an older version of the app
+        with open("ielts_data.json", 'w') as f:
+            json.dump({
+                'scores': {skill: synthetic_entries(per_skill, seed) for seed, skill in enumerate(SKILLS)},
+                'target_date': (datetime.now() + timedelta(days=90)).strftime('%Y-%m-%d')
+            }, f)
+        # The first load migrates it to the binary snapshot; time the steady state
+        open_store(engine).load()
+    else:
+        store = SqliteStore("ielts_data.db")
+        for seed, skill in enumerate(SKILLS):
+            store.save_many([{'op': 'add', 'skill': skill, 'entry': entry}
+                             for entry in synthetic_entries(per_skill, seed)])
+        store.conn.close()
+
+# Reading tests given question results: 40 items each, so at most 4M items
+ITEM_TESTS_LIMIT = 100_000
+
+def generate_items(size):
+    """Question results for the reading entries generate_store() wrote, up to ITEM_TESTS_LIMIT tests"""
+    rng = np.random.default_rng(0)
+    per_skill = max(1, size // len(SKILLS))
+    entries = synthetic_entries(min(per_skill, ITEM_TESTS_LIMIT), SKILLS.index('reading'))
+    types = np.array(QUESTION_TYPES['reading'])
+    questions = np.arange(1, QUESTIONS_PER_TEST + 1)
+    sections = np.array([default_section('reading', question) for question in questions])
+    items = ItemStore()
+    tests_per_chunk = ITEM_CHUNK_ROWS // QUESTIONS_PER_TEST
+    for start in range(0, len(entries), tests_per_chunk):
+        batch = entries[start:start + tests_per_chunk]
+        count = len(batch) * QUESTIONS_PER_TEST
+        items.ingest({
+            'entry_id': np.repeat([entry['id'] for entry in batch], QUESTIONS_PER_TEST),
+            'skill': np.full(count, 'reading'),
+            'question': np.tile(questions, len(batch)),
+            'section': np.tile(sections, len(batch)),
+            'type': types[rng.integers(0, len(types), count)],
+            'correct': rng.random(count) < 0.6,
+            'date': np.repeat([entry['date'] for entry in batch], QUESTIONS_PER_TEST),
+        })
+
+def item_record():
+    """One reading test's question results, as add_score_form() stores them"""
+    record = add_record('reading')['entry']
+    questions = list(range(1, QUESTIONS_PER_TEST + 1))
+    return {
+        'entry_id': [record['id']] * QUESTIONS_PER_TEST,
+        'skill': ['reading'] * QUESTIONS_PER_TEST,
+        'question': questions,
+        'section': [default_section('reading', question) for question in questions],
+        'type': [QUESTION_TYPES['reading'][question % 12] for question in questions],
+        'correct': [question % 3 > 0 for question in questions],
+        'date': [record['date']] * QUESTIONS_PER_TEST,
+    }
+
+def question_type_frames(_):
+    # A fresh ItemStore, so the rollup is read from disk like after another session's change
+    weeks = ItemStore().weeks('reading')
+    return item_accuracy_frame(weeks), question_type_table(weeks, datetime.now().date())
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def measure(operation, repeat, setup=None):
+    """Latency percentiles in milliseconds over repeat calls, plus one traced peak"""
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        operation(argument)
+        timings.append((time.perf_counter() - started) * 1000)
+    # Tracing slows every allocation, so the peak comes from a separate call
+    argument = setup() if setup else None
+    tracemalloc.start()
+    operation(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    timings.sort()
+    result = {f"p{pct}": round(percentile(timings, pct), 3) for pct in PERCENTILES}
+    result['mean'] = round(sum(timings) / len(timings), 3)
+    result['runs'] = repeat
+    result['peak_kib'] = round(peak / 1024, 1)
+    return result
+
+def add_record(skill):
+    now = datetime.now()
+    day, time_of_day = now.strftime('%Y-%m-%d'), now.strftime('%H:%M')
+    return {'op': 'add', 'skill': skill, 'entry': {
+        'id': f"{day}_{time_of_day}_{uuid.uuid4().hex[:12]}",
+        'date': day,
+        'time': time_of_day,
+        'score': 6.5,
+        'datetime': f"{day} {time_of_day}"
+    }}
+
+def run_page(runs):
+    """Cold first run of the whole script, then warm reruns of the same session"""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    # Cached chart frames are keyed by file name and version, which every size shares
+    st.cache_resource.clear()
+    app = AppTest.from_file(APP_FILE, default_timeout=600)
+    results = {'page_cold': measure(lambda _: app.run(), 1)}
+    if app.exception:
+        raise RuntimeError(f"App raised: {app.exception[0].message}")
+    if runs > 1:
+        results['page_rerun'] = measure(lambda _: app.run(), runs - 1)
+    return results
+
+# Run in a fresh interpreter each; both print the child's peak RSS in KiB
+STARTUP_LOAD = """
+import resource, sys
+from storage import open_store
+import analytics, cache, metrics, transfer
+open_store().load()
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+STARTUP_PAGE = """
+import resource, sys
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=600)
+app.run()
+if app.exception:
+    sys.exit(f"App raised: {app.exception[0].message}")
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+def measure_process(script, args, engine, repeat):
+    """Wall-clock percentiles of repeat fresh interpreters running script"""
+    timings = []
+    peak = 0
+    env = dict(os.environ, IELTS_STORAGE=engine, PYTHONPATH=os.pathsep.join(filter(None, [
+        os.path.dirname(APP_FILE), os.environ.get('PYTHONPATH')
+    ])))
+    for _ in range(repeat):
+        started = time.perf_counter()
+        done = subprocess.run([sys.executable, '-c', script, *args], env=env,
+                              capture_output=True, text=True)
+        timings.append((time.perf_counter() - started) * 1000)
+        if done.returncode:
+            raise RuntimeError(f"Start-up run failed: {done.stderr.strip()[-2000:]}")
+        peak = max(peak, int(done.stdout.split()[-1]))
+    timings.sort()
+    result = {f"p{pct}": round(percentile(timings, pct), 3) for pct in PERCENTILES}
+    result['mean'] = round(sum(timings) / len(timings), 3)
+    result['runs'] = repeat
+    # ru_maxrss is in bytes on macOS
+    result['peak_kib'] = round(peak / 1024 if sys.platform == 'darwin' else peak, 1)
+    return result
+
+def run_startup(engine, runs, page):
+    results = {'startup_load': measure_process(STARTUP_LOAD, [], engine, runs)}
+    if page:
+        results['startup_first_page'] = measure_process(STARTUP_PAGE, [APP_FILE], engine, runs)
+    return results
+
+def run_size(engine, size, repeat, page_runs, startup_runs):
+    results = {}
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f"ielts-bench-{size}-") as directory:
+        os.chdir(directory)
+        try:
+            generate_store(engine, size)
+
+            def load(_):
+                open_store(engine).load()
+            results['load_data'] = measure(load, max(1, repeat // 10))
+
+            # Written before save() returns, so the save timings include the journal append and fsync
+            store = open_store(engine, write_behind=False)
+            store.load()
+            target = store.target_date.strftime('%Y-%m-%d')
+            results['save_data'] = measure(lambda _: store.save({'op': 'target_date', 'value': target}), repeat)
+            results['add_score'] = measure(lambda record: store.save(record), repeat,
+                                           setup=lambda: add_record('reading'))
+
+            def remove(entry_id):
+                store.save({'op': 'remove', 'skill': 'reading', 'id': entry_id})
+
+            def newest_id():
+                # A fresh add per call, so every removal finds something to delete
+                record = add_record('reading')
+                store.save(record)
+                return record['entry']['id']
+            results['remove_score'] = measure(remove, repeat, setup=newest_id)
+            # The first frame also imports pandas, which the start-up runs time
+            progress_frame(*store.columns('reading'))
+            results['create_progress_chart_data'] = measure(
+                lambda _: progress_frame(*store.columns('reading')), max(1, repeat // 10)
+            )
+            if startup_runs:
+                results.update(run_startup(engine, startup_runs, page_runs > 0))
+            if page_runs:
+                results.update(run_page(page_runs))
+            generate_items(size)
+            items = ItemStore()
+            results['ingest_items'] = measure(lambda record: items.ingest(record), repeat, setup=item_record)
+            results['question_type_rollup'] = measure(question_type_frames, max(1, repeat // 10))
+
+            def newest_items():
+                record = item_record()
+                items.ingest(record)
+                return record['entry_id'][0]
+            results['remove_items'] = measure(lambda entry_id: items.remove_entries([entry_id]), repeat,
+                                              setup=newest_items)
+            if engine == "json":
+                results['recover_snapshot'] = measure(lambda _: open_store(engine).load(), max(1, repeat // 10),
+                                                      setup=lambda: damage_snapshot(store))
+        finally:
+            os.chdir(previous)
+    return results
+
+def damage_snapshot(store):
+    """Compact, then flip the live snapshot's last byte so the next load recovers"""
+    # A record for the compaction to fold in: the last recovery emptied the journal
+    store.save({'op': 'target_date', 'value': store.target_date.strftime('%Y-%m-%d')})
+    store.flush()
+    store.start_compaction()
+    release = None
+    while release is None:
+        time.sleep(0.01)
+        release = try_file_lock(store.compaction_lock_file)
+    release()
+    store.refresh()
+    with open(store.snapshot_file, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+def compare(results, baseline, threshold):
+    """Operations whose median got slower than the baseline by more than threshold"""
+    regressions = []
+    for size, operations in results.items():
+        for name, figures in operations.items():
+            reference = baseline.get('results', {}).get(size, {}).get(name)
+            if reference and figures['p50'] > reference['p50'] * (1 + threshold):
+                regressions.append((size, name, reference['p50'], figures['p50']))
+    return regressions
+
+def print_table(results):
+    print(f"{'entries':>9}  {'operation':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak KiB':>11}")
+    for size, operations in results.items():
+        for name, figures in operations.items():
+            print(f"{size:>9}  {name:<28}{figures['p50']:>10.2f}{figures['p95']:>10.2f}"
+                  f"{figures['p99']:>10.2f}{figures['peak_kib']:>11.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Total entries per store (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=50, help="Timed calls per save operation")
+    parser.add_argument('--page-runs', type=int, default=5,
+                        help="Full-page AppTest runs per size, 0 to skip")
+    parser.add_argument('--startup-runs', type=int, default=5,
+                        help="Fresh-interpreter start-up runs per size, 0 to skip")
+    parser.add_argument('--output', help="Write the results as JSON")
+    parser.add_argument('--save-baseline', metavar='FILE', help="Write the results as a new baseline")
+    parser.add_argument('--compare', metavar='FILE', help="Fail on regressions against a baseline")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Allowed slowdown of a median before it counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        print(f"Benchmarking {size} entries ({args.engine})...", file=sys.stderr)
+        results[str(size)] = run_size(args.engine, size, args.repeat, args.page_runs,
+                                     args.startup_runs)
+    report = {
+        'meta': {
+            'engine': args.engine,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'created': datetime.now().isoformat(timespec='seconds')
+        },
+        'results': results
+    }
+    print_table(results)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for size, name, before, after in regressions:
+            print(f"REGRESSION {name} at {size} entries: p50 {before:.2f} ms -> {after:.2f} ms", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
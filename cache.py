@@ -0,0 +1,49 @@
+"""In-process caches for views derived from the stored scores
+
+Keys carry the data version of whatever the value was built from (see
+data_version() in storage.py), so entries never need invalidating: a change
+simply produces a new key and the stale one ages out of the LRU.
+"""
+import threading
+from collections import OrderedDict
+
+class VersionedLRU:
+    """Least-recently-used cache that counts hits, misses and evictions"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key, build):
+        """Return the cached value for key, building and storing it on a miss
+
+        Hits hand back the stored object itself, so callers must not mutate it.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        # Build outside the lock; two sessions racing on one key both build it
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries)
+            }
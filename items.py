@@ -0,0 +1,462 @@
+"""Question-by-question results of listening and reading tests
+
+A band score says how a test went; the 40 questions behind it say why. Each
+item is one question of one test: its number, section, question type and
+whether it was answered correctly, linked to the test's entry id.
+
+Items are kept per user in compressed column segments (numpy .npz, one per
+ingest) that are never rewritten in place, plus a small JSON rollup of
+correct and total answers per question type per week and per section. Every
+ingest and removal updates the rollup under the same lock, so the skill tabs
+read a few kilobytes however many items there are; only removals and
+`rebuild` touch the segments.
+
+    $ python items.py ingest results.csv
+    $ python items.py --user alice summary --skill reading
+    $ python items.py rebuild
+
+Import files are CSV or NDJSON with entry_id, skill, question, type, correct
+and optionally section (default: from the question number) and date (default:
+from the entry id).
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from storage import (DEFAULT_USER, SKILLS, atomic_write, file_lock, json_loads, open_store, period_starts,
+                     user_data_file)
+
+ITEMS_FILE = "ielts_items.npz"
+ITEM_SKILLS = ['listening', 'reading']
+QUESTIONS_PER_TEST = 40
+QUESTIONS_PER_SECTION = {'listening': 10, 'reading': 14}
+SECTIONS = {'listening': 4, 'reading': 3}
+QUESTION_TYPES = {
+    'listening': [
+        "Form completion", "Note completion", "Table completion", "Sentence completion",
+        "Summary completion", "Multiple choice", "Matching", "Plan/map labelling",
+        "Diagram labelling", "Short answer",
+    ],
+    'reading': [
+        "True/False/Not given", "Yes/No/Not given", "Matching headings", "Matching information",
+        "Matching features", "Matching sentence endings", "Multiple choice", "Sentence completion",
+        "Summary completion", "Note/table completion", "Diagram labelling", "Short answer",
+    ],
+}
+# Past this many segments the smallest are merged, so reads open a bounded number of files
+ITEM_SEGMENT_LIMIT = 32
+ITEM_CHUNK_ROWS = 200_000
+ITEM_IMPORT_COLUMNS = ['entry_id', 'skill', 'question', 'section', 'type', 'correct', 'date']
+SEGMENT_COLUMNS = ['entry', 'skill', 'question', 'section', 'qtype', 'correct', 'week']
+TRUE_WORDS = {'1', 'true', 'yes', 'y', 't', 'correct'}
+FALSE_WORDS = {'0', 'false', 'no', 'n', 'f', 'wrong', 'incorrect', ''}
+
+def default_section(skill, question):
+    """Section a question number belongs to in the usual paper layout"""
+    return min(SECTIONS[skill], (question - 1) // QUESTIONS_PER_SECTION[skill] + 1)
+
+def empty_meta():
+    return {'version': 0, 'next_segment': 1, 'segments': [], 'items': 0, 'types': [],
+            'weeks': {}, 'sections': {}}
+
+def _tally(meta, columns, sign):
+    """Add (sign 1) or take away (sign -1) a set of items from the rollups in meta"""
+    skill = columns['skill'].astype(np.int64)
+    qtype = columns['qtype'].astype(np.int64)
+    week = columns['week'].astype(np.int64)
+    correct = columns['correct']
+
+    keys, slots = np.unique((skill << 48) | (qtype << 32) | (week + 2 ** 31), return_inverse=True)
+    totals = np.bincount(slots, minlength=len(keys))
+    rights = np.bincount(slots, weights=correct, minlength=len(keys)).astype(np.int64)
+    labels = np.datetime_as_string(((keys & 0xFFFFFFFF) - 2 ** 31).astype('datetime64[D]'))
+    for key, label, total, right in zip(keys.tolist(), labels, totals.tolist(), rights.tolist()):
+        types = meta['weeks'].setdefault(SKILLS[key >> 48], {})
+        weeks = types.setdefault(meta['types'][(key >> 32) & 0xFFFF], {})
+        _bump(weeks, str(label), sign * right, sign * total)
+
+    keys, slots = np.unique((skill << 8) | columns['section'].astype(np.int64), return_inverse=True)
+    totals = np.bincount(slots, minlength=len(keys))
+    rights = np.bincount(slots, weights=correct, minlength=len(keys)).astype(np.int64)
+    for key, total, right in zip(keys.tolist(), totals.tolist(), rights.tolist()):
+        _bump(meta['sections'].setdefault(SKILLS[key >> 8], {}), str(key & 0xFF), sign * right, sign * total)
+    if sign < 0:
+        # Types and skills whose last items went
+        for types in meta['weeks'].values():
+            for name in [name for name, weeks in types.items() if not weeks]:
+                del types[name]
+        for rollup in (meta['weeks'], meta['sections']):
+            for skill_name in [skill_name for skill_name, buckets in rollup.items() if not buckets]:
+                del rollup[skill_name]
+
+def _bump(buckets, key, right, total):
+    bucket = buckets.setdefault(key, [0, 0])
+    bucket[0] += right
+    bucket[1] += total
+    if bucket[1] <= 0:
+        del buckets[key]
+
+class ItemStore:
+    """One user's item results: immutable column segments and their rollup
+
+    The rollup file lists the live segments, so a write only becomes visible
+    when it is replaced: segments are written first under new numbers, then
+    the rollup, then the segments it no longer lists are deleted.
+    """
+
+    def __init__(self, user=DEFAULT_USER, base_file=ITEMS_FILE):
+        self.user = user
+        self.base = os.path.splitext(user_data_file(user, base_file))[0]
+        self.rollup_file = f"{self.base}.rollup.json"
+        self.lock_file = f"{self.base}.lock"
+        self._cached = (None, empty_meta())
+
+    def segment_file(self, number):
+        return f"{self.base}.{number:06d}.npz"
+
+    def meta(self):
+        """The rollup, re-read only after a write by any session or process replaced it"""
+        try:
+            stat = os.stat(self.rollup_file)
+        except FileNotFoundError:
+            return empty_meta()
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached_stamp, meta = self._cached
+        if stamp != cached_stamp:
+            with open(self.rollup_file, 'rb') as f:
+                meta = json_loads(f.read())
+            self._cached = (stamp, meta)
+        return meta
+
+    def version(self):
+        """Changes with every ingest or removal; for cache keys"""
+        return self.meta()['version']
+
+    def weeks(self, skill):
+        """{question type: {Monday 'YYYY-MM-DD': [correct, total]}} of a skill"""
+        return self.meta()['weeks'].get(skill, {})
+
+    def sections(self, skill):
+        """{section: [correct, total]} of a skill"""
+        return self.meta()['sections'].get(skill, {})
+
+    def columns(self, skill=None):
+        """Every stored item (of one skill) as arrays, with 'entry' resolved to entry ids
+
+        A full scan for questions the rollup does not answer; reads only
+        decompress, so a few million items take well under a second.
+        """
+        meta = self.meta()
+        parts = {name: [] for name in SEGMENT_COLUMNS}
+        for number, _ in meta['segments']:
+            with np.load(self.segment_file(number)) as segment:
+                columns = {name: segment[name] for name in SEGMENT_COLUMNS}
+                columns['entry'] = segment['entries'][columns['entry']]
+            if skill is not None:
+                keep = columns['skill'] == SKILLS.index(skill)
+                columns = {name: column[keep] for name, column in columns.items()}
+            for name in SEGMENT_COLUMNS:
+                parts[name].append(columns[name])
+        columns = {name: np.concatenate(part) if part else np.array([]) for name, part in parts.items()}
+        qtype = columns.pop('qtype').astype(np.intp)
+        columns['type'] = np.array(meta['types'] or [''], dtype=str)[qtype]
+        return columns
+
+    def ingest(self, items, appending=()):
+        """Store items and update the rollups; returns how many were stored
+
+        items maps column names to equal-length sequences: entry_id, skill,
+        question, section, type, correct and date ('YYYY-MM-DD' of the test).
+        Items of an entry that already has some replace them, unless the
+        entry is in appending (entries an import already stored a part of).
+        """
+        entry_ids = np.asarray(items['entry_id'], dtype=str)
+        if not len(entry_ids):
+            return 0
+        entries, entry = np.unique(entry_ids, return_inverse=True)
+        days = np.asarray(items['date'], dtype='datetime64[D]').astype(np.int64)
+        with file_lock(self.lock_file):
+            meta = json.loads(json.dumps(self.meta()))
+            codes = {name: code for code, name in enumerate(meta['types'])}
+            names, qtype = np.unique(np.asarray(items['type'], dtype=str), return_inverse=True)
+            for name in names.tolist():
+                if name not in codes:
+                    codes[name] = len(meta['types'])
+                    meta['types'].append(name)
+            skills, skill = np.unique(np.asarray(items['skill'], dtype=str), return_inverse=True)
+            columns = {
+                'entry': entry.astype(np.int32),
+                'skill': np.array([SKILLS.index(name) for name in skills.tolist()], dtype=np.uint8)[skill],
+                'question': np.asarray(items['question'], dtype=np.uint8),
+                'section': np.asarray(items['section'], dtype=np.uint8),
+                'qtype': np.array([codes[name] for name in names.tolist()], dtype=np.uint16)[qtype],
+                'correct': np.asarray(items['correct'], dtype=bool),
+                'week': period_starts(days * 1440).astype(np.int32),
+            }
+            written, dropped = self._drop(meta, set(entries.tolist()) - set(appending))
+            written.append(self._write_segment(meta, entries, columns))
+            _tally(meta, columns, 1)
+            meta['items'] += len(entry_ids)
+            if len(meta['segments']) > ITEM_SEGMENT_LIMIT:
+                merged, dropped_more = self._merge(meta)
+                written.append(merged)
+                dropped += dropped_more
+            self._commit(meta, written, dropped)
+        return len(entry_ids)
+
+    def remove_entries(self, entry_ids):
+        """Drop the items of these entries (e.g. deleted tests); returns how many went"""
+        entry_ids = set(entry_ids)
+        if not entry_ids or not self.meta()['segments']:
+            return 0
+        with file_lock(self.lock_file):
+            meta = json.loads(json.dumps(self.meta()))
+            before = meta['items']
+            written, dropped = self._drop(meta, entry_ids)
+            if dropped:
+                self._commit(meta, written, dropped)
+            return before - meta['items']
+
+    def clear(self):
+        with file_lock(self.lock_file):
+            meta = self.meta()
+            # Versions keep counting, so nothing cached for the old items is served again
+            empty = dict(empty_meta(), version=meta['version'], next_segment=meta['next_segment'])
+            self._commit(empty, [], [self.segment_file(number) for number, _ in meta['segments']])
+
+    def rebuild(self):
+        """Recompute the rollups from the segments, e.g. after editing QUESTION_TYPES by hand"""
+        with file_lock(self.lock_file):
+            meta = json.loads(json.dumps(self.meta()))
+            meta.update(weeks={}, sections={}, items=0)
+            for number, _ in meta['segments']:
+                with np.load(self.segment_file(number)) as segment:
+                    columns = {name: segment[name] for name in SEGMENT_COLUMNS}
+                _tally(meta, columns, 1)
+                meta['items'] += len(columns['entry'])
+            self._commit(meta, [], [])
+            return meta['items']
+
+    def _drop(self, meta, entry_ids):
+        """Take the items of entry_ids out of meta's segments
+
+        Segments that hold none are not decompressed past their entry list;
+        the rest are written again without them. Returns (new files, files
+        to delete once the rollup no longer lists them).
+        """
+        written, dropped = [], []
+        if not entry_ids:
+            return written, dropped
+        wanted = np.array(sorted(entry_ids), dtype=str)
+        kept_segments = []
+        for number, count in meta['segments']:
+            path = self.segment_file(number)
+            with np.load(path) as segment:
+                entries = segment['entries']
+                hit = np.isin(entries, wanted)
+                if not hit.any():
+                    kept_segments.append([number, count])
+                    continue
+                columns = {name: segment[name] for name in SEGMENT_COLUMNS}
+            gone = hit[columns['entry']]
+            _tally(meta, {name: column[gone] for name, column in columns.items()}, -1)
+            meta['items'] -= int(gone.sum())
+            dropped.append(path)
+            if gone.all():
+                continue
+            kept = {name: column[~gone] for name, column in columns.items()}
+            # Renumber the surviving entries into a smaller entry list
+            used, kept['entry'] = np.unique(kept['entry'], return_inverse=True)
+            kept['entry'] = kept['entry'].astype(np.int32)
+            written.append(self._write_segment(meta, entries[used], kept, listed=kept_segments))
+        meta['segments'] = kept_segments
+        return written, dropped
+
+    def _merge(self, meta):
+        """Fold the smallest segments into one until half the limit is left"""
+        segments = sorted(meta['segments'], key=lambda segment: segment[1])
+        count = len(segments) - ITEM_SEGMENT_LIMIT // 2 + 1
+        merging, meta['segments'] = segments[:count], segments[count:]
+        entry_parts, column_parts = [], {name: [] for name in SEGMENT_COLUMNS}
+        for number, _ in merging:
+            with np.load(self.segment_file(number)) as segment:
+                entry_parts.append(segment['entries'])
+                for name in SEGMENT_COLUMNS:
+                    column_parts[name].append(segment[name])
+        offsets = np.cumsum([0] + [len(part) for part in entry_parts[:-1]])
+        column_parts['entry'] = [part + offset for part, offset in zip(column_parts['entry'], offsets)]
+        # An entry is only ever in one segment, so the combined list stays unique
+        columns = {name: np.concatenate(part) for name, part in column_parts.items()}
+        columns['entry'] = columns['entry'].astype(np.int32)
+        merged = self._write_segment(meta, np.concatenate(entry_parts), columns)
+        meta['segments'].sort()
+        return merged, [self.segment_file(number) for number, _ in merging]
+
+    def _write_segment(self, meta, entries, columns, listed=None):
+        number = meta['next_segment']
+        meta['next_segment'] += 1
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, entries=entries, **columns)
+        path = self.segment_file(number)
+        atomic_write(path, [buffer.getvalue()])
+        (meta['segments'] if listed is None else listed).append([number, len(columns['entry'])])
+        return path
+
+    def _commit(self, meta, written, dropped):
+        meta['version'] += 1
+        try:
+            atomic_write(self.rollup_file, [json.dumps(meta, separators=(',', ':')).encode()])
+        except Exception:
+            for path in written:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        for path in dropped:
+            if os.path.exists(path):
+                os.remove(path)
+
+def read_item_chunks(fileobj, file_name):
+    """Yield DataFrame chunks of an item file, each with a 'row' label for error reports"""
+    import pandas as pd
+
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == '.csv':
+        for chunk in pd.read_csv(fileobj, dtype=str, keep_default_na=False, chunksize=ITEM_CHUNK_ROWS):
+            chunk.columns = [column.strip().lower() for column in chunk.columns]
+            chunk['row'] = [f"line {i + 2}" for i in chunk.index]
+            yield chunk
+    elif extension in ('.ndjson', '.jsonl'):
+        for chunk in pd.read_json(fileobj, lines=True, dtype=False, chunksize=ITEM_CHUNK_ROWS):
+            chunk['row'] = [f"line {i + 1}" for i in chunk.index]
+            yield chunk
+    else:
+        raise ValueError(f"Unsupported item file type: {extension or file_name}")
+
+def validate_items(chunk):
+    """Split a chunk into clean item rows and (row, message) errors"""
+    import pandas as pd
+
+    chunk = chunk.reset_index(drop=True)
+    for column in ITEM_IMPORT_COLUMNS:
+        if column not in chunk:
+            chunk[column] = ''
+    text = {column: chunk[column].fillna('').astype(str).str.strip() for column in ITEM_IMPORT_COLUMNS}
+
+    skill = text['skill'].str.lower()
+    question = pd.to_numeric(text['question'], errors='coerce')
+    section = pd.to_numeric(text['section'].mask(text['section'] == '', None), errors='coerce')
+    correct = text['correct'].str.lower()
+    # The app's entry ids start with the test's date
+    dates = text['date'].mask(text['date'] == '', text['entry_id'].str[:10])
+    parsed_date = pd.to_datetime(dates, format='%Y-%m-%d', errors='coerce')
+
+    checks = [
+        (text['entry_id'] == '', "entry_id is missing"),
+        (~skill.isin(ITEM_SKILLS), "skill must be listening or reading"),
+        (question.isna() | (question % 1 != 0) | (question < 1) | (question > QUESTIONS_PER_TEST),
+         f"question must be a number from 1 to {QUESTIONS_PER_TEST}"),
+        ((text['section'] != '') & (section.isna() | (section % 1 != 0) | (section < 1)
+                                    | (section > skill.map(SECTIONS))),
+         "section must be a number from 1 to " + ", ".join(f"{count} for {name}" for name, count in SECTIONS.items())),
+        (text['type'] == '', "type is missing"),
+        (~correct.isin(TRUE_WORDS | FALSE_WORDS), "correct must be 1/0, true/false or yes/no"),
+        (parsed_date.isna(), "date must be YYYY-MM-DD, or part of the entry id"),
+    ]
+    bad = np.zeros(len(chunk), dtype=bool)
+    messages = pd.Series('', index=chunk.index)
+    for mask, message in checks:
+        mask = mask.fillna(True)
+        if not mask.any():
+            continue
+        messages = messages.mask(mask, messages + message + '; ')
+        bad |= mask.to_numpy()
+    errors = list(zip(chunk['row'][bad], messages[bad].str.rstrip('; ')))
+
+    good = ~bad
+    questions = question[good].astype(int)
+    skills = skill[good]
+    # default_section() for the whole column
+    fallback = np.minimum(skills.map(SECTIONS), (questions - 1) // skills.map(QUESTIONS_PER_SECTION) + 1)
+    valid = pd.DataFrame({
+        'entry_id': text['entry_id'][good],
+        'skill': skills,
+        'question': questions,
+        'section': section[good].fillna(fallback).astype(int),
+        'type': text['type'][good],
+        'correct': correct[good].isin(TRUE_WORDS),
+        'date': parsed_date[good].dt.strftime('%Y-%m-%d'),
+    })
+    return valid, errors
+
+def import_items(items, store, fileobj, file_name):
+    """Validate an item file and ingest the rows whose entry exists in store
+
+    Returns a report: rows read, items stored, rows for unknown entries and
+    the per-row errors. An entry's items in the file replace any stored
+    before, however the file is split into chunks.
+    """
+    report = {'rows': 0, 'imported': 0, 'unknown_entries': 0, 'errors': []}
+    ingested = set()
+    for chunk in read_item_chunks(fileobj, file_name):
+        report['rows'] += len(chunk)
+        valid, errors = validate_items(chunk)
+        report['errors'].extend(errors)
+        known = np.zeros(len(valid), dtype=bool)
+        for skill, group in valid.groupby('skill'):
+            ids = group['entry_id'].unique()
+            known[valid.index.get_indexer(group.index)] = group['entry_id'].isin(
+                store.existing_ids(skill, ids)).to_numpy()
+        report['unknown_entries'] += int((~known).sum())
+        valid = valid[known]
+        report['imported'] += items.ingest({name: valid[name].to_numpy() for name in valid}, appending=ingested)
+        ingested.update(valid['entry_id'].unique())
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import and summarise IELTS question-level results")
+    parser.add_argument('--engine', choices=['json', 'sqlite'], help="storage engine (default: IELTS_STORAGE)")
+    parser.add_argument('--user', default=DEFAULT_USER, help="user partition")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help="add items from a CSV or NDJSON file")
+    ingest.add_argument('input')
+    summary = commands.add_parser('summary', help="accuracy per question type and section")
+    summary.add_argument('--skill', action='append', choices=ITEM_SKILLS, help="repeat for several; default all")
+    commands.add_parser('rebuild', help="recompute the rollups from the stored items")
+    args = parser.parse_args(argv)
+
+    items = ItemStore(args.user)
+    started = time.perf_counter()
+    if args.command == 'ingest':
+        store = open_store(args.engine, args.user, write_behind=False)
+        store.load()
+        try:
+            with open(args.input, 'rb') as f:
+                report = import_items(items, store, f, args.input)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Stored {report['imported']} of {report['rows']} items ({report['unknown_entries']} for "
+              f"unknown tests, {len(report['errors'])} errors) in {time.perf_counter() - started:.1f} s",
+              file=sys.stderr)
+        for row, problem in report['errors'][:100]:
+            print(f"  {row}: {problem}", file=sys.stderr)
+        return 1 if report['errors'] else 0
+    if args.command == 'rebuild':
+        count = items.rebuild()
+        print(f"Rebuilt the rollups of {count} items in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+        return 0
+    for skill in args.skill or ITEM_SKILLS:
+        print(f"{skill}:")
+        totals = {name: np.sum(list(weeks.values()), axis=0) for name, weeks in items.weeks(skill).items()}
+        for name, (right, total) in sorted(totals.items(), key=lambda pair: pair[1][0] / pair[1][1]):
+            print(f"  {name:<28}{total:>10} questions{100 * right / total:>8.1f}%")
+        for section, (right, total) in sorted(items.sections(skill).items(), key=lambda pair: int(pair[0])):
+            print(f"  {'Section ' + section:<28}{total:>10} questions{100 * right / total:>8.1f}%")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
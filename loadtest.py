@@ -0,0 +1,269 @@
+"""Concurrent-session load test for the storage write path
+
+Simulated sessions add, remove and read scores in parallel, the way browser
+sessions drive the app: threads in one process share a user's JSON store
+through a SessionView each (SQLite sessions open a connection each), and
+several processes stand in for several server processes on the same files.
+
+    $ python loadtest.py --processes 4 --sessions 8 --ops 200
+    $ python loadtest.py --engine sqlite --mix add=6,remove=2,read=2 --output load.json
+
+Every session keeps a ledger of what it added and removed. Once all writes
+have been flushed the data is loaded fresh and compared with the ledgers:
+entries that are missing (lost updates), back after being removed, altered or
+unknown, and journal lines that could not be read, are all failures. The run
+exits non-zero if there are any, so it doubles as an acceptance test for
+changes to storage.py.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import storage
+from analytics import progress_frame
+from benchmark import PERCENTILES, add_record, percentile
+from storage import SKILLS, SessionView, open_store
+
+DEFAULT_MIX = "add=5,remove=2,read=3"
+OPERATIONS = ('add', 'remove', 'read')
+
+def parse_mix(text):
+    """{'add': weight, ...} from 'add=5,remove=2,read=3'"""
+    mix = dict.fromkeys(OPERATIONS, 0.0)
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in mix:
+            raise argparse.ArgumentTypeError(f"Unknown operation in mix: {name}")
+        mix[name.strip()] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("The mix needs at least one operation with weight above 0")
+    return mix
+
+def run_session(view, ops, mix, seed, result):
+    """One session's operations; fills result with its ledger and latencies"""
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    added = {}
+    removed = []
+    timings = {name: [] for name in OPERATIONS}
+    for _ in range(ops):
+        op = rng.choices(names, weights)[0]
+        skill = rng.choice(SKILLS)
+        if op == 'remove' and not added:
+            op = 'add'
+        started = time.perf_counter()
+        if op == 'add':
+            record = add_record(skill)
+            record['entry']['score'] = rng.randint(0, 18) / 2
+            view.save(record)
+            added[record['entry']['id']] = (skill, record['entry'])
+        elif op == 'remove':
+            # Sessions only remove their own entries, so every ledger is exact
+            entry_id = rng.choice(list(added))
+            view.save({'op': 'remove', 'skill': added[entry_id][0], 'id': entry_id})
+            del added[entry_id]
+            removed.append(entry_id)
+        else:
+            # What a rerun reads: other sessions' changes, the cards, a history page and a chart
+            view.refresh()
+            view.summary(skill)
+            view.page(skill, 0, 25)
+            progress_frame(*view.history_columns(skill))
+        timings[op].append((time.perf_counter() - started) * 1000)
+    result.update(added=added, removed=removed, timings=timings)
+
+def run_worker(directory, engine, write_behind, sessions, ops, mix, users, seed, compact_bytes, barrier, results):
+    """One server process: its sessions as threads, sharing a store per user like the app does"""
+    os.chdir(directory)
+    if compact_bytes:
+        storage.JOURNAL_COMPACT_BYTES = compact_bytes
+    stores = {}
+
+    def session_view(user):
+        if engine == "sqlite":
+            store = open_store(engine, user)
+        else:
+            # streamlit_app.shared_store(): one JsonStore per user and process
+            store = stores.get(user) or stores.setdefault(user, open_store(engine, user, write_behind))
+        store.load()
+        return SessionView(store)
+
+    outcomes = [{} for _ in range(sessions)]
+    views = [session_view(f"load{n % users}") for n in range(sessions)]
+    threads = [threading.Thread(target=run_session, args=(view, ops, mix, seed * 1000 + n, outcome))
+               for n, (view, outcome) in enumerate(zip(views, outcomes))]
+    # The first chart frame imports pandas; keep that out of the read latencies
+    progress_frame([0], [0.0])
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    finished = time.perf_counter()
+    for view in views:
+        view.flush()
+    drained = time.perf_counter()
+    results.put({
+        'sessions': [dict(outcome, user=view.user) for view, outcome in zip(views, outcomes)],
+        'seconds': finished - started,
+        'drain_seconds': drained - finished
+    })
+
+class _UnreadableRecords(logging.Handler):
+    """Counts the journal lines load() had to skip"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.count = 0
+
+    def emit(self, record):
+        if record.getMessage().startswith("Skipping unreadable journal record"):
+            self.count += 1
+
+def verify(engine, sessions):
+    """Compare a fresh load of every user's data against the sessions' ledgers"""
+    expected = {}
+    removed = {}
+    for session in sessions:
+        for entry_id, (skill, entry) in session['added'].items():
+            expected.setdefault(session['user'], {})[entry_id] = (skill, entry)
+        removed.setdefault(session['user'], set()).update(session['removed'])
+    report = {'expected': 0, 'found': 0, 'lost': 0, 'resurrected': 0, 'altered': 0, 'unknown': 0,
+              'unreadable_records': 0, 'load_errors': []}
+    counter = _UnreadableRecords()
+    logging.getLogger().addHandler(counter)
+    try:
+        for user in sorted(set(expected) | set(removed)):
+            try:
+                store = open_store(engine, user, write_behind=False)
+                store.load()
+            except Exception as e:
+                report['load_errors'].append(f"{user}: {e}")
+                continue
+            stored = {entry['id']: (skill, entry) for skill in SKILLS for entry in store.entries(skill)}
+            wanted = expected.get(user, {})
+            report['expected'] += len(wanted)
+            report['found'] += len(stored)
+            report['lost'] += sum(1 for entry_id in wanted if entry_id not in stored)
+            report['resurrected'] += sum(1 for entry_id in removed.get(user, ()) if entry_id in stored)
+            report['altered'] += sum(1 for entry_id, (skill, entry) in wanted.items()
+                                     if entry_id in stored and (stored[entry_id][0] != skill
+                                                                or stored[entry_id][1] != entry))
+            report['unknown'] += sum(1 for entry_id in stored
+                                     if entry_id not in wanted and entry_id not in removed.get(user, ()))
+    finally:
+        logging.getLogger().removeHandler(counter)
+    report['unreadable_records'] = counter.count
+    return report
+
+def latency_table(sessions):
+    table = {}
+    for name in OPERATIONS:
+        timings = sorted(ms for session in sessions for ms in session['timings'][name])
+        if timings:
+            table[name] = {f"p{pct}": round(percentile(timings, pct), 3) for pct in PERCENTILES}
+            table[name]['count'] = len(timings)
+    return table
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--processes', type=int, default=2, help="Server processes to simulate")
+    parser.add_argument('--sessions', type=int, default=8, help="Sessions per process")
+    parser.add_argument('--ops', type=int, default=200, help="Operations per session")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help="Relative weights of add, remove and read (default: %(default)s)")
+    parser.add_argument('--users', type=int, default=1,
+                        help="Users the sessions are spread over; 1 puts every session on one file")
+    parser.add_argument('--no-write-behind', dest='write_behind', action='store_false',
+                        help="JSON saves write before returning instead of in the background")
+    parser.add_argument('--compact-bytes', type=int, default=0,
+                        help="Journal size that triggers compaction, to exercise it more often")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--directory', help="Run here instead of in a temporary directory")
+    parser.add_argument('--output', help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(prefix="ielts-load-") as scratch:
+        directory = os.path.abspath(args.directory or scratch)
+        barrier = context.Barrier(args.processes)
+        results = context.Queue()
+        workers = [context.Process(target=run_worker, args=(
+            directory, args.engine, args.write_behind, args.sessions, args.ops, args.mix, args.users,
+            args.seed * 100 + n, args.compact_bytes, barrier, results
+        )) for n in range(args.processes)]
+        print(f"Running {args.processes} x {args.sessions} sessions, {args.ops} operations each "
+              f"({args.engine})...", file=sys.stderr)
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        if any(worker.exitcode for worker in workers):
+            print("A worker process failed", file=sys.stderr)
+            return 2
+        sessions = [session for outcome in outcomes for session in outcome['sessions']]
+        previous = os.getcwd()
+        os.chdir(directory)
+        try:
+            integrity = verify(args.engine, sessions)
+        finally:
+            os.chdir(previous)
+
+    seconds = max(outcome['seconds'] for outcome in outcomes)
+    drain = max(outcome['drain_seconds'] for outcome in outcomes)
+    total = args.processes * args.sessions * args.ops
+    report = {
+        'meta': {
+            'engine': args.engine,
+            'processes': args.processes,
+            'sessions': args.sessions,
+            'ops': args.ops,
+            'mix': args.mix,
+            'users': args.users,
+            'write_behind': args.write_behind,
+            'created': datetime.now().isoformat(timespec='seconds')
+        },
+        'throughput': {
+            'operations': total,
+            'seconds': round(seconds, 3),
+            'ops_per_second': round(total / seconds, 1),
+            # Until the last write-behind batch is on disk
+            'durable_ops_per_second': round(total / (seconds + drain), 1)
+        },
+        'latency_ms': latency_table(sessions),
+        'integrity': integrity
+    }
+
+    print(f"{total} operations in {seconds:.2f} s: {report['throughput']['ops_per_second']} ops/s "
+          f"({report['throughput']['durable_ops_per_second']} ops/s until durable)")
+    print(f"{'operation':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, figures in report['latency_ms'].items():
+        print(f"{name:<10}{figures['count']:>8}{figures['p50']:>10.2f}{figures['p95']:>10.2f}{figures['p99']:>10.2f}")
+    print("integrity: " + ", ".join(f"{name} {value}" for name, value in integrity.items()
+                                    if name != 'load_errors'))
+    for error in integrity['load_errors']:
+        print(f"LOAD ERROR {error}", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failures = (integrity['lost'] + integrity['resurrected'] + integrity['altered'] + integrity['unknown']
+                + integrity['unreadable_records'] + len(integrity['load_errors']))
+    if failures:
+        print(f"FAILED: {failures} lost, resurrected, altered, unknown or unreadable entries", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
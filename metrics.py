@@ -0,0 +1,191 @@
+"""Timing and counting probes for the app, exported for Prometheus
+
+Probes feed one process-wide registry shared by every session. Each script
+run also keeps its own trace for the debug panel, and when IELTS_METRICS_LOG
+names a file each finished run is appended to it as one JSON line.
+"""
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("ielts.metrics")
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Registry:
+    """Counters and latency histograms keyed by metric name and label set"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, metric, value=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, metric, seconds, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket plus the overflow, then the running sum
+                histogram = self._histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            histogram[0][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+
+    def add_collector(self, collect):
+        """Register a callable returning (name, type, value, labels) samples read at scrape time"""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        """Everything in the Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: ([*counts], total) for key, (counts, total) in self._histograms.items()}
+            collectors = list(self._collectors)
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), (counts, total) in sorted(histograms.items()):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        for collect in collectors:
+            for name, kind, value, labels in collect():
+                header(name, kind)
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+        return '\n'.join(lines) + '\n'
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+registry = Registry()
+registry.describe('ielts_section_seconds', "Time spent rendering a page section")
+registry.describe('ielts_persistence_seconds', "Time spent in a storage call")
+registry.describe('ielts_persistence_bytes_written_total', "Bytes appended or rewritten by storage calls")
+registry.describe('ielts_rerun_seconds', "Wall time of a whole script run")
+
+# Probes of the script run in progress on this thread
+_current_run = contextvars.ContextVar('current_run', default=None)
+
+def begin_run():
+    """Start collecting the probes of a new script run"""
+    run = {'started': time.perf_counter(), 'probes': []}
+    _current_run.set(run)
+    return run
+
+def record(kind, name, seconds, **fields):
+    """Count one timed event in the registry and in the current run's trace"""
+    registry.observe(f'ielts_{kind}_seconds', seconds, name=name)
+    run = _current_run.get()
+    if run is not None:
+        run['probes'].append({'kind': kind, 'name': name, 'ms': round(seconds * 1000, 3), **fields})
+
+@contextmanager
+def probe(kind, name, **fields):
+    """Time the block as one event of a kind ('section', 'persistence', ...)"""
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record(kind, name, time.perf_counter() - started, **fields)
+
+def timed(kind, name):
+    """Decorator form of probe(); name may use the call's positional arguments ('tab_{0}')"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with probe(kind, name.format(*args)):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def end_run(**fields):
+    """Close the current run, log it and return its trace"""
+    run = _current_run.get()
+    if run is None:
+        return None
+    seconds = time.perf_counter() - run['started']
+    registry.observe('ielts_rerun_seconds', seconds)
+    trace = {'ms': round(seconds * 1000, 3), 'probes': run['probes'], **fields}
+    logger.info(json.dumps(trace))
+    _current_run.set(None)
+    return trace
+
+def configure_log(path):
+    """Append each run's trace to path as JSON lines"""
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    # Keep the traces out of the console log
+    logger.propagate = False
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port, host='127.0.0.1'):
+    """Serve /metrics on a background thread; returns the server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def setup_from_env():
+    """Start the exporter and the trace log if IELTS_METRICS_PORT / IELTS_METRICS_LOG ask for them"""
+    server = None
+    port = os.environ.get("IELTS_METRICS_PORT")
+    if port:
+        try:
+            server = start_server(int(port))
+        except OSError:
+            # Another process of this deployment already serves the port
+            logging.exception("Could not start the metrics endpoint on port %s", port)
+    log_path = os.environ.get("IELTS_METRICS_LOG")
+    if log_path:
+        configure_log(log_path)
+    return server
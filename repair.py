@@ -0,0 +1,114 @@
+"""Check JSON stores for damage, and rebuild damaged snapshots
+
+    $ python repair.py verify
+    $ python repair.py --user alice repair
+
+verify reads every file of each store without changing anything. It checks the
+live snapshot and the generations kept behind it (SNAPSHOT_KEEP) against their
+checksums, and counts unreadable lines in the journals. It exits non-zero if
+anything is damaged. repair loads each store the way the app does: a damaged
+snapshot is replaced by the newest good generation plus the journals written
+since, then saved as a new live snapshot. The damaged file is kept as
+.snapshot.damaged.
+
+SQLite databases are checked with PRAGMA quick_check; SQLite recovers from
+interrupted writes itself, so there is nothing for repair to do.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from storage import (DEFAULT_USER, SQLITE_FILE, JsonStore, SnapshotError, json_loads, json_users,
+                     user_data_file, verify_snapshot)
+
+def check_journal(path):
+    """(records, unreadable lines, bytes in a torn last line) of a journal"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    records = unreadable = 0
+    for line in data[:end].splitlines():
+        try:
+            json_loads(line)
+            records += 1
+        except ValueError:
+            unreadable += 1
+    return records, unreadable, len(data) - end
+
+def verify_store(store):
+    """[(path, problem or None, detail)] for every file of a JSON store"""
+    report = []
+    snapshots, segments = store.generation_files()
+    for path in [store.snapshot_file, *(snapshots[generation] for generation in sorted(snapshots, reverse=True))]:
+        if not os.path.exists(path):
+            continue
+        try:
+            report.append((path, None, f"generation {verify_snapshot(path)}"))
+        except (SnapshotError, OSError) as e:
+            report.append((path, str(e), None))
+    if os.path.exists(store.data_file):
+        # Pretty-printed JSON snapshot from before the binary format
+        try:
+            with open(store.data_file, 'rb') as f:
+                json_loads(f.read())
+            report.append((store.data_file, None, "JSON snapshot"))
+        except ValueError as e:
+            report.append((store.data_file, f"unreadable JSON: {e}", None))
+    journals = [segments[generation] for generation in sorted(segments)]
+    journals += [path for path in (store.compacting_file, store.journal_file) if os.path.exists(path)]
+    for path in journals:
+        records, unreadable, torn = check_journal(path)
+        detail = f"{records} records" + (f", {torn} bytes of an unfinished write" if torn else "")
+        report.append((path, f"{unreadable} unreadable lines" if unreadable else None, detail))
+    return report
+
+def verify_sqlite(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA quick_check")]
+    finally:
+        conn.close()
+    return [(db_file, None if rows == ['ok'] else "; ".join(rows[:10]), "quick_check ok" if rows == ['ok'] else None)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify or repair the IELTS Progress Tracker's data files")
+    parser.add_argument('--user', action='append', help="repeat for several; default every user found")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('verify', help="report damaged files without changing anything")
+    commands.add_parser('repair', help="rebuild damaged snapshots from earlier generations")
+    args = parser.parse_args(argv)
+
+    users = args.user or sorted(json_users()) or [DEFAULT_USER]
+    failures = 0
+    for user in users:
+        store = JsonStore(user_data_file(user), user)
+        if args.command == 'verify':
+            report = verify_store(store)
+            for path, problem, detail in report:
+                print(f"{'DAMAGED' if problem else 'ok':<8} {path}: {problem or detail}")
+            failures += sum(1 for _, problem, _ in report if problem)
+            continue
+        started = time.perf_counter()
+        try:
+            store.load()
+        except (SnapshotError, OSError, json.JSONDecodeError) as e:
+            print(f"FAILED   {user}: {e}")
+            failures += 1
+            continue
+        ms = (time.perf_counter() - started) * 1000
+        if store.recovered_from is None:
+            print(f"ok       {user}: generation {store.generation}, version {store.version} ({ms:.0f} ms)")
+        else:
+            print(f"REPAIRED {user}: from {store.recovered_from}, now generation {store.generation}, "
+                  f"version {store.version} ({ms:.0f} ms)")
+    if args.command == 'verify' and not args.user and os.path.exists(SQLITE_FILE):
+        for path, problem, detail in verify_sqlite(SQLITE_FILE):
+            print(f"{'DAMAGED' if problem else 'ok':<8} {path}: {problem or detail}")
+            failures += 1 if problem else 0
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2204 @@
+"""Storage engines for the IELTS Progress Tracker
+
+Every engine takes the same change records that used to be journaled by
+streamlit_app.py ({'op': 'add' | 'remove' | 'target_date', ...}) and answers
+the handful of reads the dashboard renders, so the app never needs to hold
+more than it shows.
+"""
+import atexit
+import bisect
+import copy
+import json
+import logging
+import mmap
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+import zlib
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
+
+import numpy as np
+
+from metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+try:
+    # Several times faster on the journal replay every cold start does
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+SKILLS = ['listening', 'reading', 'writing', 'speaking']
+DEFAULT_USER = "default"
+
+DATA_FILE = "ielts_data.json"
+SQLITE_FILE = "ielts_data.db"
+STORAGE_ENGINE = os.environ.get("IELTS_STORAGE", "json")
+# JSON saves return once applied in memory; a background thread writes them
+WRITE_BEHIND = os.environ.get("IELTS_WRITE_BEHIND", "1") != "0"
+# Entries older than this many days are rolled into per-day or per-week
+# aggregates (see ArchivedScores); 0 keeps every entry as it was saved
+RETENTION_DAYS = int(os.environ.get("IELTS_RETENTION_DAYS", "0"))
+RETENTION_PERIOD = os.environ.get("IELTS_RETENTION_PERIOD", "week")
+# The newest entries of a skill always stay raw, however old: the cards show
+# the latest score and the charts a rolling average over recent tests
+RETENTION_KEEP = 20
+# Snapshot generations a JSON store keeps, the live one included. A snapshot
+# that fails its checks is rebuilt from the newest good one on load.
+SNAPSHOT_KEEP = int(os.environ.get("IELTS_SNAPSHOT_KEEP", "3"))
+
+def get_default_data():
+    """Get default data structure"""
+    return {
+        'scores': {skill: [] for skill in SKILLS},
+        'target_date': date(2025, 11, 1)
+    }
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD string into a date"""
+    # fromisoformat skips strptime's regex machinery, which the first call compiles
+    return date.fromisoformat(value)
+
+class SkillStats:
+    """Running count, sum and per-band histogram of one skill's scores
+
+    Bands come in half steps, so the histogram doubles as a multiset: the best
+    score is the highest non-empty bucket and removing a score is a decrement.
+    """
+
+    def __init__(self, count=0, total=0.0, histogram=None):
+        self.count = count
+        self.total = total
+        # Half-band (score * 2) -> number of tests
+        self.histogram = histogram or {}
+
+    @classmethod
+    def from_scores(cls, scores):
+        stats = cls()
+        for score in scores:
+            stats.add(score)
+        return stats
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['count'], data['total'],
+                   {int(band): n for band, n in data['histogram'].items()})
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total,
+                'histogram': {str(band): n for band, n in self.histogram.items()}}
+
+    def copy(self):
+        return SkillStats(self.count, self.total, dict(self.histogram))
+
+    def add(self, score):
+        band = int(round(score * 2))
+        self.histogram[band] = self.histogram.get(band, 0) + 1
+        self.count += 1
+        self.total += score
+
+    def remove(self, score):
+        band = int(round(score * 2))
+        if self.histogram.get(band, 0) <= 1:
+            self.histogram.pop(band, None)
+        else:
+            self.histogram[band] -= 1
+        self.count -= 1
+        self.total -= score
+
+    def summary(self, latest):
+        """Card figures; latest comes from the newest entry"""
+        if not self.count:
+            return empty_summary()
+        return {
+            'count': self.count,
+            'total': self.total,
+            'latest': latest,
+            'average': round(self.total / self.count, 1),
+            'best': max(self.histogram) / 2,
+            'histogram': {band / 2: n for band, n in sorted(self.histogram.items())}
+        }
+
+def empty_summary():
+    return {'count': 0, 'total': 0, 'latest': 0, 'average': 0, 'best': 0, 'histogram': {}}
+
+# Trend day numbers count from here, which keeps the squared sums small
+TREND_EPOCH = date(2000, 1, 1)
+
+def entry_day(value):
+    """Fractional days since TREND_EPOCH of a 'YYYY-MM-DD HH:MM' datetime"""
+    day = date(int(value[:4]), int(value[5:7]), int(value[8:10])).toordinal() - TREND_EPOCH.toordinal()
+    if len(value) >= 16:
+        day += int(value[11:13]) / 24 + int(value[14:16]) / 1440
+    return day
+
+class TrendMoments:
+    """Running sums over (day, score) pairs, enough to refit a least-squares line
+
+    Like SkillStats they move by one add or remove per test, so the trend line
+    of a skill never needs its history re-read.
+    """
+    FIELDS = ('n', 'st', 'sy', 'stt', 'sty', 'syy')
+
+    def __init__(self, n=0, st=0.0, sy=0.0, stt=0.0, sty=0.0, syy=0.0):
+        self.n = n
+        self.st = st
+        self.sy = sy
+        self.stt = stt
+        self.sty = sty
+        self.syy = syy
+
+    @classmethod
+    def from_entries(cls, entries):
+        moments = cls()
+        for entry in entries:
+            moments.add(entry)
+        return moments
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*(data[field] for field in cls.FIELDS))
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def copy(self):
+        return TrendMoments(*(getattr(self, field) for field in self.FIELDS))
+
+    def _update(self, entry, sign):
+        t = entry_day(entry['datetime'])
+        y = entry['score']
+        self.n += sign
+        self.st += sign * t
+        self.sy += sign * y
+        self.stt += sign * t * t
+        self.sty += sign * t * y
+        self.syy += sign * y * y
+
+    def add(self, entry):
+        self._update(entry, 1)
+
+    def remove(self, entry):
+        self._update(entry, -1)
+
+def period_starts(minutes, period='week'):
+    """Days since 1970-01-01 of the day, or the Monday of the week, each minute falls in"""
+    days = np.asarray(minutes, dtype=np.int64) // 1440
+    if period == 'day':
+        return days
+    # 1970-01-01 was a Thursday
+    return days - (days + 3) % 7
+
+def week_start(value):
+    """Monday ('YYYY-MM-DD') of the week a 'YYYY-MM-DD[ HH:MM]' datetime falls in"""
+    day = date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+class WeeklyScores:
+    """Test count and score total per week, for trend lines across students
+
+    Kept by the same adds and removes as SkillStats, so a cohort view reads a
+    few dozen buckets per student instead of their history.
+    """
+
+    def __init__(self, weeks=None):
+        # Monday 'YYYY-MM-DD' -> [count, total]
+        self.weeks = weeks or {}
+
+    @classmethod
+    def from_columns(cls, minutes, scores):
+        """Buckets of a skill's (minutes, scores) columns in one vectorised pass"""
+        mondays, slots = np.unique(period_starts(minutes), return_inverse=True)
+        counts = np.bincount(slots, minlength=len(mondays))
+        totals = np.bincount(slots, weights=scores, minlength=len(mondays))
+        labels = np.datetime_as_string(mondays.astype('datetime64[D]'))
+        return cls({str(week): [int(count), float(total)]
+                    for week, count, total in zip(labels, counts, totals)})
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({week: list(bucket) for week, bucket in data.items()})
+
+    def to_dict(self):
+        return {week: list(bucket) for week, bucket in sorted(self.weeks.items())}
+
+    def copy(self):
+        return WeeklyScores({week: list(bucket) for week, bucket in self.weeks.items()})
+
+    def add(self, entry):
+        bucket = self.weeks.setdefault(week_start(entry['datetime']), [0, 0.0])
+        bucket[0] += 1
+        bucket[1] += entry['score']
+
+    def remove(self, entry):
+        week = week_start(entry['datetime'])
+        bucket = self.weeks.get(week)
+        if bucket is None:
+            return
+        if bucket[0] <= 1:
+            del self.weeks[week]
+        else:
+            bucket[0] -= 1
+            bucket[1] -= entry['score']
+
+class ArchivedScores:
+    """Count, total, lowest and highest score per day or week of rolled-up entries
+
+    The long-term tier of a skill under RETENTION_DAYS: old entries leave the
+    series for a bucket here. SkillStats, TrendMoments and WeeklyScores keep
+    counting them, so cards, forecasts and cohort figures do not move.
+    """
+
+    def __init__(self, periods=None, until=None):
+        # First day 'YYYY-MM-DD' of a day or week -> [count, total, low, high]
+        self.periods = periods or {}
+        # Minute of the newest entry rolled up, or None
+        self.until = until
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({start: list(bucket) for start, bucket in data['periods'].items()}, data['until'])
+
+    def to_dict(self):
+        return {'periods': {start: list(bucket) for start, bucket in sorted(self.periods.items())},
+                'until': self.until}
+
+    def copy(self):
+        return ArchivedScores({start: list(bucket) for start, bucket in self.periods.items()}, self.until)
+
+    def __len__(self):
+        return len(self.periods)
+
+    def add_columns(self, minutes, scores, period):
+        """Fold (minutes, scores) columns, oldest first, into their periods"""
+        minutes = np.asarray(minutes, dtype=np.int64)
+        scores = np.asarray(scores, dtype=float)
+        if not len(minutes):
+            return
+        starts, slots = np.unique(period_starts(minutes, period), return_inverse=True)
+        counts = np.bincount(slots, minlength=len(starts))
+        totals = np.bincount(slots, weights=scores, minlength=len(starts))
+        # Sorted minutes give sorted slots, so each period is one contiguous run
+        firsts = np.searchsorted(slots, np.arange(len(starts)))
+        lows = np.minimum.reduceat(scores, firsts)
+        highs = np.maximum.reduceat(scores, firsts)
+        labels = np.datetime_as_string(starts.astype('datetime64[D]'))
+        for label, count, total, low, high in zip(labels, counts, totals, lows, highs):
+            bucket = self.periods.setdefault(str(label), [0, 0.0, float(low), float(high)])
+            bucket[0] += int(count)
+            bucket[1] += float(total)
+            bucket[2] = min(bucket[2], float(low))
+            bucket[3] = max(bucket[3], float(high))
+        self.until = max(int(minutes[-1]), self.until if self.until is not None else int(minutes[-1]))
+
+    def columns(self):
+        """(minutes, means) with one point at the start of each period, oldest first"""
+        starts = sorted(self.periods)
+        minutes = np.array(starts, dtype='datetime64[D]').astype('datetime64[m]').astype(np.int64)
+        means = np.array([self.periods[start][1] / self.periods[start][0] for start in starts], dtype=float)
+        return minutes, means
+
+def merge_tiers(archived, columns):
+    """(minutes, scores) of a skill across both tiers: archived period means, then raw entries"""
+    if not len(archived):
+        return columns
+    old_minutes, means = archived.columns()
+    minutes = np.concatenate([old_minutes, columns[0]])
+    scores = np.concatenate([means, columns[1]])
+    # A test back-dated into archived time sits between the periods
+    order = np.argsort(minutes, kind='stable')
+    return minutes[order], scores[order]
+
+def retention_cutoff(today=None):
+    """First day ('YYYY-MM-DD') entries stay raw from, on a period boundary; None with retention off"""
+    if RETENTION_DAYS <= 0:
+        return None
+    if RETENTION_PERIOD not in ('day', 'week'):
+        raise ValueError(f"Unknown retention period: {RETENTION_PERIOD}")
+    cutoff = (today or date.today()) - timedelta(days=RETENTION_DAYS)
+    if RETENTION_PERIOD == 'week':
+        cutoff -= timedelta(days=cutoff.weekday())
+    return cutoff.isoformat()
+
+def student_rollup(store):
+    """What the cohort view needs about a store's student, read off its running totals"""
+    skills = {}
+    for skill in SKILLS:
+        summary = store.summary(skill)
+        skills[skill] = {
+            'count': summary['count'],
+            'total': summary['total'],
+            'latest': summary['latest'],
+            'best': summary['best'],
+            'histogram': {str(band): n for band, n in summary['histogram'].items()},
+            'moments': store.trend_moments(skill).to_dict(),
+            'weeks': store.weekly_scores(skill).to_dict()
+        }
+    return {'user': store.user, 'target_date': store.target_date.strftime('%Y-%m-%d'), 'skills': skills}
+
+# Entries are held as three typed columns instead of five-field dicts: the
+# minute (since 1970-01-01, local time), an id key and the band in half steps.
+# Ids in the app's own format, 'YYYY-MM-DD_HH:MM_<12 hex digits>' for the
+# entry's own minute, are stored as that hex number; any other id gets a
+# negative key and a side table.
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+REGULAR_ID = re.compile(r'(\d{4}-\d{2}-\d{2})_(\d{2}:\d{2})_([0-9a-f]{12})$')
+
+def datetime_minute(value):
+    """Minutes since 1970-01-01 of a 'YYYY-MM-DD HH:MM' datetime (or a bare date)"""
+    minute = (date(int(value[:4]), int(value[5:7]), int(value[8:10])).toordinal() - UNIX_EPOCH_ORDINAL) * 1440
+    if len(value) >= 16:
+        minute += int(value[11:13]) * 60 + int(value[14:16])
+    return minute
+
+def minute_parts(minute):
+    """('YYYY-MM-DD', 'HH:MM') of a minute number"""
+    days, rest = divmod(minute, 1440)
+    return date.fromordinal(UNIX_EPOCH_ORDINAL + days).isoformat(), f"{rest // 60:02d}:{rest % 60:02d}"
+
+# Batches bigger than this are merged into a series with one sort
+BULK_INSERT_THRESHOLD = 64
+
+class ScoreSeries:
+    """One skill's entries as sorted columns, oldest first
+
+    Entries go in and come out as the usual dicts but are stored in three
+    arrays, 17 bytes an entry for ids in the app's format. Rows are kept in
+    (minute, id key) order, so lookups by id, date ranges and pages are all
+    binary searches.
+    """
+
+    def __init__(self, entries=()):
+        self._minutes = array('q')
+        self._keys = array('q')
+        self._bands = array('b')
+        # Negative key -> id, and id -> (minute, key), for ids in other formats
+        self._odd_ids = {}
+        self._odd_keys = {}
+        self._last_odd = 0
+        self.extend(entries)
+
+    @classmethod
+    def from_columns(cls, minutes, keys, bands, odd_ids):
+        """Series over raw column bytes, as written by to_columns()"""
+        series = cls()
+        series._minutes.frombytes(minutes)
+        series._keys.frombytes(keys)
+        series._bands.frombytes(bands)
+        series._odd_ids = {int(key): entry_id for key, entry_id in odd_ids.items()}
+        series._last_odd = min(series._odd_ids, default=0)
+        for position in np.flatnonzero(np.frombuffer(series._keys, dtype=np.int64) < 0):
+            key = series._keys[position]
+            series._odd_keys[series._odd_ids[key]] = (series._minutes[position], key)
+        return series
+
+    def copy(self):
+        """Independent series with the same entries; the columns are copied as bytes"""
+        series = ScoreSeries()
+        series._minutes = array('q', self._minutes)
+        series._keys = array('q', self._keys)
+        series._bands = array('b', self._bands)
+        series._odd_ids = dict(self._odd_ids)
+        series._odd_keys = dict(self._odd_keys)
+        series._last_odd = self._last_odd
+        return series
+
+    def to_columns(self):
+        """Copies of the column bytes plus the odd-id table, for a snapshot"""
+        return (self._minutes.tobytes(), self._keys.tobytes(), self._bands.tobytes(),
+                {str(key): entry_id for key, entry_id in self._odd_ids.items()})
+
+    def columns(self):
+        """(minutes, scores) as NumPy arrays the caller may keep"""
+        minutes = np.frombuffer(self._minutes, dtype=np.int64).copy()
+        return minutes, np.frombuffer(self._bands, dtype=np.int8) / 2
+
+    def __len__(self):
+        return len(self._bands)
+
+    def __iter__(self):
+        for position in range(len(self._bands)):
+            yield self._entry(position)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._entry(position) for position in range(*index.indices(len(self._bands)))]
+        if index < 0:
+            index += len(self._bands)
+        if not 0 <= index < len(self._bands):
+            raise IndexError("ScoreSeries index out of range")
+        return self._entry(index)
+
+    def __contains__(self, entry_id):
+        return self._find(entry_id) is not None
+
+    def get(self, entry_id):
+        position = self._find(entry_id)
+        return None if position is None else self._entry(position)
+
+    def _entry(self, position):
+        minute = self._minutes[position]
+        key = self._keys[position]
+        day, time_of_day = minute_parts(minute)
+        return {
+            'id': self._odd_ids[key] if key < 0 else f"{day}_{time_of_day}_{key:012x}",
+            'date': day,
+            'time': time_of_day,
+            'score': self._bands[position] / 2,
+            'datetime': f"{day} {time_of_day}"
+        }
+
+    def _slot(self, minute, key):
+        """Position where (minute, key) is or would go"""
+        lo = bisect.bisect_left(self._minutes, minute)
+        hi = bisect.bisect_right(self._minutes, minute, lo)
+        return bisect.bisect_left(self._keys, key, lo, hi)
+
+    def _find(self, entry_id):
+        """Position of an id, or None"""
+        match = REGULAR_ID.match(entry_id)
+        located = ((datetime_minute(f"{match[1]} {match[2]}"), int(match[3], 16)) if match
+                   else self._odd_keys.get(entry_id))
+        if located is None:
+            return None
+        position = self._slot(*located)
+        if position < len(self._keys) and self._keys[position] == located[1] \
+                and self._minutes[position] == located[0]:
+            return position
+        # An id in the app's format stored as odd: its date did not match the entry's
+        return self._find_odd(entry_id) if match else None
+
+    def _find_odd(self, entry_id):
+        located = self._odd_keys.get(entry_id)
+        return None if located is None else self._slot(*located)
+
+    def _encode(self, entry):
+        """(minute, key, half-band) of a new entry, registering an odd id"""
+        minute = datetime_minute(entry['datetime'])
+        match = REGULAR_ID.match(entry['id'])
+        if match and datetime_minute(f"{match[1]} {match[2]}") == minute:
+            key = int(match[3], 16)
+        else:
+            self._last_odd -= 1
+            key = self._last_odd
+            self._odd_ids[key] = entry['id']
+            self._odd_keys[entry['id']] = (minute, key)
+        return minute, key, int(round(entry['score'] * 2))
+
+    def add(self, entry):
+        """Insert an entry in order; returns False if its id is already present"""
+        if entry['id'] in self:
+            return False
+        minute, key, band = self._encode(entry)
+        position = self._slot(minute, key)
+        self._minutes.insert(position, minute)
+        self._keys.insert(position, key)
+        self._bands.insert(position, band)
+        return True
+
+    def extend(self, entries):
+        """Insert many entries; returns the ones whose ids were new
+
+        Large batches are merged with one sort instead of one insert each,
+        which would be quadratic when backfilling old history.
+        """
+        added = {}
+        # Nothing to look up in an empty series, as when loading a snapshot
+        existing = self if self._bands else ()
+        for entry in entries:
+            if entry['id'] not in added and entry['id'] not in existing:
+                added[entry['id']] = entry
+        added = list(added.values())
+        if len(added) <= BULK_INSERT_THRESHOLD:
+            for entry in added:
+                self.add(entry)
+            return added
+        encoded = np.array([self._encode(entry) for entry in added], dtype=np.int64).reshape(-1, 3)
+        minutes = np.concatenate([np.frombuffer(self._minutes, dtype=np.int64), encoded[:, 0]])
+        keys = np.concatenate([np.frombuffer(self._keys, dtype=np.int64), encoded[:, 1]])
+        bands = np.concatenate([np.frombuffer(self._bands, dtype=np.int8), encoded[:, 2].astype(np.int8)])
+        order = np.lexsort((keys, minutes))
+        self._minutes = array('q', minutes[order].tobytes())
+        self._keys = array('q', keys[order].tobytes())
+        self._bands = array('b', bands[order].tobytes())
+        return added
+
+    def remove(self, entry_id):
+        """Delete an entry by id; returns it, or None if it was not there"""
+        position = self._find(entry_id)
+        if position is None:
+            return None
+        entry = self._entry(position)
+        key = self._keys[position]
+        del self._minutes[position]
+        del self._keys[position]
+        del self._bands[position]
+        if key < 0:
+            del self._odd_ids[key]
+            del self._odd_keys[entry_id]
+        return entry
+
+    def rollable(self, before, keep):
+        """How many of the oldest entries are dated before minute before, sparing the newest keep
+
+        Entries sharing a minute with the oldest spared one are spared too, so
+        the count depends on the data alone, not on how ties were inserted.
+        """
+        if len(self._minutes) <= keep:
+            return 0
+        count = bisect.bisect_left(self._minutes, before)
+        if keep:
+            count = min(count, bisect.bisect_left(self._minutes, self._minutes[len(self._minutes) - keep]))
+        return count
+
+    def drop_oldest(self, count):
+        """Remove the count oldest entries; returns their (minutes, scores) columns"""
+        minutes = np.frombuffer(self._minutes, dtype=np.int64)[:count].copy()
+        scores = np.frombuffer(self._bands, dtype=np.int8)[:count] / 2
+        for key in np.frombuffer(self._keys, dtype=np.int64)[:count]:
+            if key < 0:
+                del self._odd_keys[self._odd_ids.pop(int(key))]
+        del self._minutes[:count]
+        del self._keys[:count]
+        del self._bands[:count]
+        return minutes, scores
+
+    def bounds(self, start_date=None, end_date=None):
+        """Positions [lo, hi) of the entries dated within [start_date, end_date]"""
+        lo = bisect.bisect_left(self._minutes, datetime_minute(start_date)) if start_date else 0
+        hi = (bisect.bisect_left(self._minutes, datetime_minute(end_date) + 1440)
+              if end_date else len(self._minutes))
+        return lo, hi
+
+    def between(self, start_date=None, end_date=None):
+        """Entries whose date falls in [start_date, end_date] (YYYY-MM-DD strings)"""
+        lo, hi = self.bounds(start_date, end_date)
+        return self[lo:hi]
+
+    def page(self, offset, limit, start_date=None, end_date=None, min_score=None, max_score=None):
+        """Newest-first page of the entries matching the filters, and how many match
+
+        Without a score filter the page is read straight off the sorted columns,
+        so it costs O(limit) whatever the offset; a score filter is one
+        vectorised pass over the bands in the date range.
+        """
+        lo, hi = self.bounds(start_date, end_date)
+        if min_score is None and max_score is None:
+            top = hi - 1 - offset
+            return [self._entry(i) for i in range(top, max(lo, top - limit + 1) - 1, -1)], hi - lo
+        bands = np.frombuffer(self._bands, dtype=np.int8)[lo:hi]
+        low = -2 if min_score is None else min_score * 2
+        high = 20 if max_score is None else max_score * 2
+        matches = np.flatnonzero((bands >= low) & (bands <= high))[::-1] + lo
+        return [self._entry(int(i)) for i in matches[offset:offset + limit]], len(matches)
+
+
+# Files a JSON store keeps next to its data file, longest suffix first
+JSON_STORE_SUFFIXES = ('.journal.compacting.jsonl', '.journal.jsonl', '.snapshot', '.rollup', '.json')
+
+def user_data_file(user, base_file=DATA_FILE):
+    """Per-user partition of a data file; the default user keeps the plain name"""
+    if user == DEFAULT_USER:
+        return base_file
+    root, ext = os.path.splitext(base_file)
+    return f"{root}.{user}{ext}"
+
+def clean_user_id(value):
+    """Reduce a user id from a URL to a safe file-name fragment"""
+    cleaned = re.sub(r'[^A-Za-z0-9_-]', '', value or '')[:64]
+    return cleaned or DEFAULT_USER
+
+def open_store(engine=None, user=DEFAULT_USER, write_behind=None):
+    """Create the storage engine selected by IELTS_STORAGE for one user"""
+    engine = engine or STORAGE_ENGINE
+    if engine == "sqlite":
+        return SqliteStore(SQLITE_FILE, user)
+    if engine == "json":
+        return JsonStore(user_data_file(user), user,
+                         WRITE_BEHIND if write_behind is None else write_behind)
+    raise ValueError(f"Unknown storage engine: {engine}")
+
+def json_users(base_file=DATA_FILE):
+    """Users with any JSON store file next to base_file"""
+    root = os.path.splitext(base_file)[0]
+    directory, prefix = os.path.split(root)
+    users = set()
+    for name in os.listdir(directory or '.'):
+        if not name.startswith(prefix):
+            continue
+        rest = name[len(prefix):]
+        for suffix in JSON_STORE_SUFFIXES:
+            if rest.endswith(suffix):
+                middle = rest[:-len(suffix)]
+                if not middle:
+                    users.add(DEFAULT_USER)
+                elif middle[0] == '.' and clean_user_id(middle[1:]) == middle[1:]:
+                    users.add(middle[1:])
+                break
+    return users
+
+def cohort_rollups(engine=None):
+    """Every student's rollup (see student_rollup), without reading their histories
+
+    JSON stores rewrite theirs shortly after a write and at compaction (see
+    ROLLUP_DELAY_SECONDS); a student whose rollup is missing or older than
+    their data files is loaded once to write it.
+    """
+    engine = engine or STORAGE_ENGINE
+    if engine == "sqlite":
+        store = SqliteStore(SQLITE_FILE)
+        try:
+            return [student_rollup(store.for_user(user)) for user in store.users()]
+        finally:
+            store.conn.close()
+    rows = []
+    for user in sorted(json_users()):
+        store = JsonStore(user_data_file(user), user)
+        row = (store.read_rollup() if store.rollup_current() else None) or store.backfill_rollup()
+        if row:
+            rows.append(row)
+    return rows
+
+class SessionView:
+    """One session's handle on a store that other sessions may share
+
+    Reads go to the snapshot taken by the last pin(), so a script run renders
+    one version of the data while other sessions save; this session's own
+    saves re-pin straight away. A session holds no scores of its own, so a
+    shared JSON store costs one copy of the data however many sessions use it,
+    plus the old objects of a changed skill while some session still pins them.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.user = store.user
+        self.pin()
+
+    def pin(self):
+        """Move this session to the store's current state"""
+        # Read before the snapshot: a change in between only makes stale() say so
+        self.changes = self.store.changes
+        self.snapshot = self.store.snapshot()
+
+    def stale(self):
+        """Whether the store changed since the last pin()"""
+        return self.store.changes != self.changes
+
+    def poll(self):
+        """Pick up other processes' changes too; True if the pinned state is out of date"""
+        self.store.refresh()
+        return self.stale()
+
+    def refresh(self):
+        self.store.refresh()
+        self.pin()
+
+    def save(self, record):
+        self.save_many([record])
+
+    def save_many(self, records):
+        self.store.save_many(records)
+        self.pin()
+
+    def clear(self):
+        self.store.clear()
+        self.pin()
+
+    def flush(self, timeout=None):
+        return self.store.flush(timeout)
+
+    def durability(self):
+        return self.store.durability()
+
+    def has_saved_data(self):
+        return self.store.has_saved_data()
+
+    def __getattr__(self, name):
+        # Everything else is a read, answered from the pinned snapshot
+        if name == 'snapshot':
+            raise AttributeError(name)
+        return getattr(self.snapshot, name)
+
+
+# Advisory locks. flock() excludes other processes and other open file
+# descriptions in this process; the thread locks cover platforms without fcntl.
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on path for the duration of the block"""
+    with _thread_lock(path):
+        with open(path, 'a') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+def try_file_lock(path):
+    """Take an exclusive lock without waiting; returns a release function or None"""
+    thread_lock = _thread_lock(path)
+    if not thread_lock.acquire(blocking=False):
+        return None
+    f = open(path, 'a')
+    if fcntl:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            thread_lock.release()
+            return None
+
+    def release():
+        f.close()
+        thread_lock.release()
+    return release
+
+def atomic_write(path, chunks):
+    """Write byte chunks to a temp file, fsync it and rename it over path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def keep_copy(path, copy_path):
+    """Make copy_path hold what path holds now, by hard link where the file system allows"""
+    if os.path.exists(copy_path):
+        os.remove(copy_path)
+    try:
+        os.link(path, copy_path)
+    except OSError:
+        shutil.copyfile(path, copy_path)
+
+
+# Binary snapshot: magic, format number and header length; since format 2 the
+# generation, a CRC-32 of the columns and a CRC-32 of the generation, column
+# CRC and header; a JSON header (version, exam date, running stats and where
+# each skill's columns start), then per skill the minutes, id keys and bands
+# back to back. Every column starts on an 8-byte boundary, so the file can be
+# mapped and read in place.
+SNAPSHOT_MAGIC = b'IELTSCOL'
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_PREFIX = struct.Struct('<8sII')
+SNAPSHOT_CHECKS = struct.Struct('<QII')
+SNAPSHOT_SEAL = struct.Struct('<QI')
+
+class SnapshotError(ValueError):
+    """A snapshot file that is truncated, torn or fails its checksums"""
+
+def _padding(length):
+    return b'\0' * (-length % 8)
+
+def write_snapshot(path, meta, columns, generation=0):
+    """Atomically write meta plus {skill: ScoreSeries.to_columns()} as a snapshot"""
+    skills = {}
+    offset = 0
+    body_crc = 0
+    for skill, (minutes, keys, bands, odd_ids) in columns.items():
+        skills[skill] = {'count': len(bands), 'offset': offset, 'odd_ids': odd_ids}
+        offset += len(minutes) + len(keys) + len(bands) + len(_padding(len(bands)))
+        for part in (minutes, keys, bands, _padding(len(bands))):
+            body_crc = zlib.crc32(part, body_crc)
+    header = json.dumps(dict(meta, skills=skills)).encode()
+    padded_header = header + _padding(len(header))
+    header_crc = zlib.crc32(padded_header, zlib.crc32(SNAPSHOT_SEAL.pack(generation, body_crc)))
+
+    def chunks():
+        yield SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, len(header))
+        yield SNAPSHOT_CHECKS.pack(generation, body_crc, header_crc)
+        yield padded_header
+        for minutes, keys, bands, _ in columns.values():
+            yield minutes
+            yield keys
+            yield bands + _padding(len(bands))
+    atomic_write(path, chunks())
+
+def _check_snapshot(path, mapped):
+    """(meta, offset of the columns) of a mapped snapshot, checked in one pass over the file"""
+    if len(mapped) < SNAPSHOT_PREFIX.size:
+        raise SnapshotError(f"{path} is truncated")
+    magic, version, header_length = SNAPSHOT_PREFIX.unpack_from(mapped)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError(f"{path} is not a score snapshot")
+    if version > SNAPSHOT_FORMAT:
+        # Written by a newer app: not damage, so no older generation may replace it
+        raise ValueError(f"{path} has snapshot format {version}; this version reads up to {SNAPSHOT_FORMAT}")
+    start = SNAPSHOT_PREFIX.size
+    generation = 0
+    if version >= 2:
+        if len(mapped) < start + SNAPSHOT_CHECKS.size:
+            raise SnapshotError(f"{path} is truncated")
+        generation, body_crc, header_crc = SNAPSHOT_CHECKS.unpack_from(mapped, start)
+        start += SNAPSHOT_CHECKS.size
+    base = start + header_length + len(_padding(header_length))
+    if base > len(mapped):
+        raise SnapshotError(f"{path} is truncated")
+    if version >= 2 and zlib.crc32(
+        mapped[start:base], zlib.crc32(SNAPSHOT_SEAL.pack(generation, body_crc))
+    ) != header_crc:
+        raise SnapshotError(f"{path} fails its header checksum")
+    try:
+        meta = json_loads(mapped[start:start + header_length])
+        size = sum(17 * layout['count'] + len(_padding(layout['count'])) for layout in meta['skills'].values())
+    except (ValueError, KeyError, TypeError) as e:
+        raise SnapshotError(f"{path} has an unreadable header: {e}") from None
+    if base + size != len(mapped):
+        raise SnapshotError(f"{path} is {len(mapped)} bytes, expected {base + size}")
+    if version >= 2:
+        with memoryview(mapped) as view:
+            if zlib.crc32(view[base:]) != body_crc:
+                raise SnapshotError(f"{path} fails its column checksum")
+    meta['generation'] = generation
+    return meta, base
+
+def _map_snapshot(path):
+    f = open(path, 'rb')
+    try:
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        f.close()
+        # mmap refuses empty files
+        raise SnapshotError(f"{path} is empty") from None
+
+def verify_snapshot(path):
+    """The snapshot's generation if it passes every check; SnapshotError if not"""
+    f, mapped = _map_snapshot(path)
+    with f, mapped:
+        return _check_snapshot(path, mapped)[0]['generation']
+
+def read_snapshot(path):
+    """(meta, {skill: ScoreSeries}) from a snapshot file; SnapshotError if it is damaged"""
+    f, mapped = _map_snapshot(path)
+    with f, mapped:
+        meta, base = _check_snapshot(path, mapped)
+        series = {}
+        view = memoryview(mapped)
+        try:
+            for skill, layout in meta.pop('skills').items():
+                count, offset = layout['count'], base + layout['offset']
+                series[skill] = ScoreSeries.from_columns(
+                    view[offset:offset + 8 * count],
+                    view[offset + 8 * count:offset + 16 * count],
+                    view[offset + 16 * count:offset + 17 * count],
+                    layout['odd_ids']
+                )
+        finally:
+            view.release()
+    return meta, series
+
+
+# Snapshots are only rewritten by compaction; every change in between is
+# appended as one JSON line to the journal and replayed on load. Each record
+# carries a per-user version number, so a session that finds the journal ahead
+# of what it has seen replays the missing records before appending its own.
+JOURNAL_COMPACT_BYTES = 256 * 1024
+
+# Write-behind: a save is applied in memory and queued; the store's writer
+# thread waits FLUSH_INTERVAL for the rest of a burst, then appends everything
+# queued with one lock and one fsync. Batches are written in the order they
+# were saved. A full queue makes save() wait, and the writer thread exits
+# after WRITER_IDLE_SECONDS without work.
+WRITE_BEHIND_QUEUE = 1000
+WRITE_BEHIND_FLUSH_INTERVAL = 0.05
+WRITE_BEHIND_RETRY_SECONDS = 1.0
+WRITER_IDLE_SECONDS = 30
+
+# The cohort rollup is kept off the write path: a write schedules a rewrite
+# this many seconds later, so a burst of saves costs one, and compaction
+# rewrites it too. cohort_rollups() rebuilds one older than the data files.
+ROLLUP_DELAY_SECONDS = 2.0
+
+# Stores with a writer, flushed when the interpreter exits
+_write_behind_stores = weakref.WeakSet()
+
+@atexit.register
+def _flush_on_exit():
+    for store in list(_write_behind_stores):
+        try:
+            store.flush(timeout=10)
+        except Exception:
+            logging.exception("Could not flush pending scores for %s", store.data_file)
+
+class _ScoreReads:
+    """Read methods over data, stats, trends and skill_versions
+
+    Shared by JsonStore and the frozen snapshots it hands to sessions.
+    """
+
+    @property
+    def target_date(self):
+        return self.data['target_date']
+
+    def data_version(self, skill):
+        """Hashable token that changes whenever the skill's entries change"""
+        return (self.data_file, skill, self.skill_versions[skill])
+
+    def entries(self, skill):
+        """All entries of a skill, oldest first"""
+        return self.data['scores'][skill]
+
+    def existing_ids(self, skill, ids):
+        """The subset of ids already stored for a skill"""
+        series = self.data['scores'][skill]
+        return {entry_id for entry_id in ids if entry_id in series}
+
+    def iter_entries(self, skill, start_date=None, end_date=None):
+        """Iterate a skill's entries dated within [start_date, end_date], oldest first"""
+        return iter(self.data['scores'][skill].between(start_date, end_date))
+
+    def page(self, skill, offset, limit, start_date=None, end_date=None, min_score=None, max_score=None):
+        """Newest-first page of a skill's entries matching the filters, and the match count"""
+        return self.data['scores'][skill].page(offset, limit, start_date, end_date, min_score, max_score)
+
+    def summary(self, skill):
+        """Card figures from the running stats, without touching the entries"""
+        entries = self.data['scores'][skill]
+        return self.stats[skill].summary(entries[-1]['score'] if entries else 0)
+
+    def columns(self, skill):
+        """(minutes, scores) of a skill as NumPy arrays, oldest first"""
+        return self.data['scores'][skill].columns()
+
+    def trend_moments(self, skill):
+        """Running least-squares sums of a skill's (day, score) pairs"""
+        return self.trends[skill]
+
+    def weekly_scores(self, skill):
+        """Per-week count and total of a skill's scores"""
+        return self.weekly[skill]
+
+    def archived(self, skill):
+        """The ArchivedScores entries of a skill were rolled into"""
+        return self.archives[skill]
+
+    def history_columns(self, skill):
+        """(minutes, scores) for charts: archived period means, then every raw entry"""
+        return merge_tiers(self.archives[skill], self.columns(skill))
+
+    def export_data(self):
+        """Scores and exam date in the JSON file format"""
+        # Entries are never mutated in place, so copying the lists is enough
+        return {
+            'scores': {skill: list(entries) for skill, entries in self.data['scores'].items()},
+            'target_date': self.data['target_date'].strftime('%Y-%m-%d')
+        }
+
+
+class StoreSnapshot(_ScoreReads):
+    """Read-only state of a JsonStore at one moment, shared by every session
+
+    The store never changes the series, stats or trends a snapshot holds: it
+    copies a skill's objects before its next change instead (see JsonStore._own).
+    """
+
+    def __init__(self, store):
+        self.data_file = store.data_file
+        self.user = store.user
+        self.data = {'scores': dict(store.data['scores']), 'target_date': store.data['target_date']}
+        self.stats = dict(store.stats)
+        self.trends = dict(store.trends)
+        self.weekly = dict(store.weekly)
+        self.archives = dict(store.archives)
+        self.skill_versions = dict(store.skill_versions)
+
+class JsonStore(_ScoreReads):
+    """Binary snapshot plus append-only JSON journal for one user"""
+
+    def __init__(self, data_file, user=DEFAULT_USER, write_behind=False):
+        # Absolute, as the delayed rollup write may run after a chdir
+        self.data_file = data_file = os.path.abspath(data_file)
+        self.user = user
+        base = os.path.splitext(data_file)[0]
+        self.snapshot_file = f"{base}.snapshot"
+        self.journal_file = f"{base}.journal.jsonl"
+        self.compacting_file = f"{base}.journal.compacting.jsonl"
+        self.lock_file = f"{base}.lock"
+        self.compaction_lock_file = f"{base}.compact.lock"
+        # Cohort figures, rewritten shortly after writes (see cohort_rollups)
+        self.rollup_file = f"{base}.rollup"
+        self._rollup_timer = None
+        # Earlier generations: snapshot.<n> and, as journal.<n>.jsonl, the
+        # records generation n folded in. A live snapshot that failed its
+        # checks is set aside as snapshot.damaged once it has been rebuilt.
+        self._base = base
+        self.damaged_file = f"{base}.snapshot.damaged"
+        self.generation = 0
+        # The file the last load recovered from, if the live snapshot was
+        # damaged, whether that live file is still in place, and kept
+        # generations found damaged on the way
+        self.recovered_from = None
+        self._live_damaged = False
+        self._damaged_kept = []
+        self.data = self._empty_data()
+        self.stats = {skill: SkillStats() for skill in SKILLS}
+        self.trends = {skill: TrendMoments() for skill in SKILLS}
+        self.weekly = {skill: WeeklyScores() for skill in SKILLS}
+        self.archives = {skill: ArchivedScores() for skill in SKILLS}
+        self.version = 0
+        # Journal version of the last change to each skill
+        self.skill_versions = dict.fromkeys(SKILLS, 0)
+        self._journal_id = None
+        self._journal_offset = 0
+        # Identity of the snapshot and compacting journal this state was loaded from
+        self._base_id = (None, None, None)
+        self.write_behind = write_behind
+        # Saved records not in the journal yet, oldest first; re-applied after
+        # every reload so the in-memory view always includes them
+        self._pending = []
+        # Guards the in-memory state between the session and its writer thread.
+        # Taken after file_lock() whenever both are held.
+        self._memory_lock = threading.RLock()
+        self._queue = queue.Queue(maxsize=WRITE_BEHIND_QUEUE)
+        self._writer = None
+        self._writer_guard = threading.Lock()
+        self._drained = threading.Condition(self._writer_guard)
+        self._writing = False
+        self.last_saved = None
+        self.save_error = None
+        # Latest frozen view handed out by snapshot(), the skills whose objects
+        # it shares, and a count of in-memory changes for sessions to compare
+        self._snapshot = None
+        self._shared = set()
+        self.changes = 0
+
+    @staticmethod
+    def _empty_data():
+        data = get_default_data()
+        data['scores'] = {skill: ScoreSeries() for skill in SKILLS}
+        return data
+
+    def load(self):
+        """Load the compacted snapshot and replay the journal on top of it"""
+        with file_lock(self.lock_file), self._memory_lock:
+            self._load()
+
+    def _load_files(self):
+        self._base_id = self._base_files()
+        self._changed()
+        self._shared.clear()
+        self.data = self._empty_data()
+        self.version = 0
+        self.recovered_from = None
+        self._live_damaged = False
+        self._damaged_kept = []
+        snapshot = {}
+        if os.path.exists(self.snapshot_file):
+            snapshot, series = self._read_snapshots()
+            self.data['scores'].update(series)
+        elif os.path.exists(self.data_file):
+            # Pretty-printed JSON snapshot from before the binary format
+            with open(self.data_file, 'r') as f:
+                snapshot = json.load(f)
+            for skill, entries in snapshot.get('scores', {}).items():
+                self.data['scores'][skill] = ScoreSeries(entries)
+        if 'target_date' in snapshot:
+            self.data['target_date'] = parse_date(snapshot['target_date'])
+        self.version = snapshot.get('version', 0)
+        self.generation = snapshot.get('generation', 0)
+        snapshot_stats = snapshot.get('stats')
+        snapshot_trends = snapshot.get('trends')
+        if snapshot_stats:
+            self.stats = {skill: SkillStats.from_dict(snapshot_stats[skill]) for skill in SKILLS}
+        else:
+            self.stats = {
+                skill: SkillStats.from_scores(item['score'] for item in self.data['scores'][skill])
+                for skill in SKILLS
+            }
+        if snapshot_trends:
+            self.trends = {skill: TrendMoments.from_dict(snapshot_trends[skill]) for skill in SKILLS}
+        else:
+            self.trends = {skill: TrendMoments.from_entries(self.data['scores'][skill]) for skill in SKILLS}
+        if snapshot.get('weekly'):
+            self.weekly = {skill: WeeklyScores.from_dict(snapshot['weekly'][skill]) for skill in SKILLS}
+        else:
+            self.weekly = {skill: WeeklyScores.from_columns(*self.data['scores'][skill].columns())
+                           for skill in SKILLS}
+        if snapshot.get('archive'):
+            self.archives = {skill: ArchivedScores.from_dict(snapshot['archive'][skill]) for skill in SKILLS}
+        else:
+            self.archives = {skill: ArchivedScores() for skill in SKILLS}
+        if 'scores' in snapshot:
+            self._migrate_json_snapshot()
+        if self.recovered_from is not None:
+            # What the later generations folded in, oldest first
+            for generation, path in sorted(self.generation_files()[1].items()):
+                if generation > self.generation:
+                    self._replay(self._read_journal(path)[0])
+        # A journal left behind by a running or interrupted compaction is older
+        # than the live one
+        if os.path.exists(self.compacting_file):
+            self._replay(self._read_journal(self.compacting_file)[0])
+        self._journal_id = None
+        self._journal_offset = 0
+        if os.path.exists(self.journal_file):
+            records, self._journal_offset = self._read_journal(self.journal_file)
+            self._journal_id = self._file_id(self.journal_file)
+            self._replay(records)
+        self.skill_versions = dict.fromkeys(SKILLS, self.version)
+        if self.recovered_from is not None:
+            self._repair()
+
+    def _kept_file(self, generation):
+        return f"{self.snapshot_file}.{generation}"
+
+    def _segment_file(self, generation):
+        return f"{self._base}.journal.{generation}.jsonl"
+
+    def generation_files(self):
+        """({generation: kept snapshot}, {generation: folded journal}) on disk"""
+        directory, name = os.path.split(self._base)
+        pattern = re.compile(re.escape(name) + r'\.(?:snapshot\.(\d+)|journal\.(\d+)\.jsonl)$')
+        snapshots, segments = {}, {}
+        for entry in os.listdir(directory or '.'):
+            match = pattern.match(entry)
+            if match and match[1]:
+                snapshots[int(match[1])] = os.path.join(directory, entry)
+            elif match:
+                segments[int(match[2])] = os.path.join(directory, entry)
+        return snapshots, segments
+
+    def _next_generation(self):
+        snapshots, segments = self.generation_files()
+        return max([self.generation, *snapshots, *segments]) + 1
+
+    def _read_snapshots(self):
+        """(meta, series) of the live snapshot, or of the newest good generation if it is damaged
+
+        Sets recovered_from when it falls back; _load_files() then replays the
+        journals of the generations after it, so no record is lost.
+        """
+        try:
+            return read_snapshot(self.snapshot_file)
+        except SnapshotError as e:
+            logging.error("%s; recovering from an earlier generation", e)
+        self._live_damaged = True
+        snapshots, segments = self.generation_files()
+        for generation in sorted(snapshots, reverse=True):
+            try:
+                meta, series = read_snapshot(snapshots[generation])
+            except SnapshotError as e:
+                # No use as a fallback either; the repair removes it
+                logging.error("%s", e)
+                self._damaged_kept.append(snapshots[generation])
+                continue
+            self.recovered_from = snapshots[generation]
+            return meta, series
+        if 1 in segments:
+            # Generation 1 was compacted from an empty store: its journal has everything
+            self.recovered_from = segments[1]
+            return {}, {}
+        raise SnapshotError(f"{self.snapshot_file} is damaged and no earlier generation can replace it")
+
+    def _repair(self):
+        """Write the recovered state as a new live snapshot, like a compaction; lock held
+
+        Left to the compaction if one is running: its snapshot replaces the
+        damaged one anyway.
+        """
+        release = try_file_lock(self.compaction_lock_file)
+        if release is None:
+            return
+        try:
+            generation = self._next_generation()
+            folded = []
+            for path in (self.compacting_file, self.journal_file):
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        chunk = f.read()
+                    folded.append(chunk[:chunk.rfind(b'\n') + 1])
+            atomic_write(self._segment_file(generation), folded)
+            keep_copy(self.snapshot_file, self.damaged_file)
+            write_snapshot(self.snapshot_file, self._snapshot_meta(),
+                           {skill: series.to_columns() for skill, series in self.data['scores'].items()},
+                           generation)
+            for path in (self.compacting_file, self.journal_file, *self._damaged_kept):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.generation = generation
+            self._live_damaged = False
+            self._journal_id = None
+            self._journal_offset = 0
+            self._base_id = self._base_files()
+            self._prune_generations(generation)
+            logging.warning("Rebuilt %s from %s", self.snapshot_file, self.recovered_from)
+        except Exception:
+            # Recovered in memory all the same; the next load tries again
+            logging.exception("Could not rewrite %s after recovering it", self.snapshot_file)
+        finally:
+            release()
+
+    def _prune_generations(self, newest):
+        """Drop snapshots beyond SNAPSHOT_KEEP and the journals no kept snapshot needs"""
+        snapshots, segments = self.generation_files()
+        bases = sorted((generation for generation in snapshots if generation < newest),
+                       reverse=True)[:SNAPSHOT_KEEP - 1]
+        if len(bases) < SNAPSHOT_KEEP - 1 and 1 in segments:
+            bases.append(0)
+        for generation, path in snapshots.items():
+            if generation not in bases:
+                os.remove(path)
+        for generation, path in segments.items():
+            if not bases or generation <= min(bases):
+                os.remove(path)
+
+    def _snapshot_meta(self):
+        return {
+            'version': self.version,
+            'target_date': self.data['target_date'].strftime('%Y-%m-%d'),
+            'stats': {skill: stats.to_dict() for skill, stats in self.stats.items()},
+            'trends': {skill: trend.to_dict() for skill, trend in self.trends.items()},
+            'weekly': {skill: weekly.to_dict() for skill, weekly in self.weekly.items()},
+            'archive': {skill: archived.to_dict() for skill, archived in self.archives.items()}
+        }
+
+    def _migrate_json_snapshot(self):
+        """Rewrite the JSON snapshot just loaded in the binary format; lock held
+
+        The JSON file is kept next to it with a .v0 suffix and no longer read.
+        """
+        self.generation = self._next_generation()
+        write_snapshot(self.snapshot_file, self._snapshot_meta(),
+                       {skill: series.to_columns() for skill, series in self.data['scores'].items()},
+                       self.generation)
+        os.replace(self.data_file, f"{self.data_file}.v0")
+        self._base_id = self._base_files()
+
+    @staticmethod
+    def _file_id(path):
+        """(device, inode) of path, or None if there is no such file"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    def _base_files(self):
+        return (self._file_id(self.snapshot_file), self._file_id(self.data_file),
+                self._file_id(self.compacting_file))
+
+    @staticmethod
+    def _read_journal(path, offset=0):
+        """Complete records of a journal from offset, plus the offset after them"""
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read()
+        # A torn final line from a write that never finished is left unread
+        end = chunk.rfind(b'\n') + 1
+        records = []
+        for line in chunk[:end].splitlines():
+            try:
+                records.append(json_loads(line))
+            except json.JSONDecodeError:
+                logging.warning("Skipping unreadable journal record in %s", path)
+        return records, offset + end
+
+    def _replay(self, records):
+        fresh = []
+        for record in records:
+            version = record.get('version')
+            if version is not None:
+                if version <= self.version:
+                    continue
+                self.version = version
+            fresh.append(record)
+        self._apply_many(fresh)
+
+    def _apply_many(self, records):
+        """Apply change records in order, merging each run of adds per skill"""
+        pending = {}
+        for record in records:
+            if record['op'] == 'add':
+                pending.setdefault(record['skill'], []).append(record['entry'])
+                continue
+            self._flush_adds(pending)
+            self._apply(record)
+        self._flush_adds(pending)
+
+    def _flush_adds(self, pending):
+        for skill, entries in pending.items():
+            if skill in self._shared:
+                # Copy a snapshot's series only for a batch that really changes it
+                entries = [entry for entry in entries if entry['id'] not in self.data['scores'][skill]]
+                if not entries:
+                    continue
+                self._own(skill)
+            added = self.data['scores'][skill].extend(entries)
+            if added:
+                self._changed()
+            for entry in added:
+                self.stats[skill].add(entry['score'])
+                self.trends[skill].add(entry)
+                self.weekly[skill].add(entry)
+            if added:
+                self.skill_versions[skill] = self.version
+        pending.clear()
+
+    def _apply(self, record):
+        """Apply a change record in memory; adds of ids already present are skipped"""
+        op = record['op']
+        scores = self.data['scores']
+        if op == 'add':
+            entry = record['entry']
+            if entry['id'] not in scores[record['skill']]:
+                self._own(record['skill'])
+                scores[record['skill']].add(entry)
+                self.stats[record['skill']].add(entry['score'])
+                self.trends[record['skill']].add(entry)
+                self.weekly[record['skill']].add(entry)
+                self.skill_versions[record['skill']] = self.version
+        elif op == 'remove':
+            if record['id'] in scores[record['skill']]:
+                self._own(record['skill'])
+                removed = scores[record['skill']].remove(record['id'])
+                self.stats[record['skill']].remove(removed['score'])
+                self.trends[record['skill']].remove(removed)
+                self.weekly[record['skill']].remove(removed)
+                self.skill_versions[record['skill']] = self.version
+        elif op == 'target_date':
+            target_date = parse_date(record['value'])
+            if target_date != self.data['target_date']:
+                self._changed()
+                self.data['target_date'] = target_date
+        elif op == 'archive':
+            # Moves entries between tiers only: stats, trends and weeks keep them
+            before = datetime_minute(record['before'])
+            for skill in SKILLS:
+                count = scores[skill].rollable(before, record['keep'])
+                if count:
+                    self._own(skill)
+                    self.archives[skill].add_columns(*scores[skill].drop_oldest(count), record['period'])
+                    self.skill_versions[skill] = self.version
+
+    def _own(self, skill):
+        """Make a skill's objects safe to change in place; memory lock held"""
+        if skill in self._shared:
+            self.data['scores'][skill] = self.data['scores'][skill].copy()
+            self.stats[skill] = self.stats[skill].copy()
+            self.trends[skill] = self.trends[skill].copy()
+            self.weekly[skill] = self.weekly[skill].copy()
+            self.archives[skill] = self.archives[skill].copy()
+            self._shared.discard(skill)
+        self._changed()
+
+    def _changed(self):
+        self._snapshot = None
+        self.changes += 1
+
+    def snapshot(self):
+        """Frozen view of the current state; one is shared until the next change"""
+        with self._memory_lock:
+            if self._snapshot is None:
+                self._snapshot = StoreSnapshot(self)
+                self._shared.update(SKILLS)
+            return self._snapshot
+
+    def _catch_up(self):
+        """Merge records other sessions appended since this one last looked; lock held"""
+        if self._base_files() != self._base_id:
+            # Another session compacted or cleared: the journal alone says too little
+            self._load()
+            return
+        if not os.path.exists(self.journal_file):
+            if self._journal_id is not None:
+                self._load()
+            return
+        if self._file_id(self.journal_file) != self._journal_id:
+            # Rotated by a compaction (or created by another session)
+            self._load()
+            return
+        size = os.path.getsize(self.journal_file)
+        if size < self._journal_offset:
+            self._load()
+        elif size > self._journal_offset:
+            records, self._journal_offset = self._read_journal(self.journal_file, self._journal_offset)
+            self._replay(records)
+
+    def _load(self):
+        self._load_files()
+        self._apply_pending(self._pending)
+
+    def _apply_pending(self, records):
+        """Apply saved-but-unwritten records in memory
+
+        Their skills get a version token of their own: the same journal version
+        plus unwritten changes must never share a cache key with the journal
+        version alone.
+        """
+        if not records:
+            return
+        self._apply_many(records)
+        token = f"{self.version}+{uuid.uuid4().hex}"
+        for record in records:
+            if 'skill' in record:
+                self.skill_versions[record['skill']] = token
+
+    def refresh(self):
+        """Pick up changes made by other sessions, if there are any"""
+        try:
+            unchanged = (self._file_id(self.journal_file) == self._journal_id
+                         and os.path.getsize(self.journal_file) == self._journal_offset)
+        except FileNotFoundError:
+            unchanged = self._journal_id is None
+        unchanged = unchanged and self._base_files() == self._base_id
+        # A running write catches up itself; waiting on its fsync would stall the page
+        if not unchanged and not self._writing:
+            with file_lock(self.lock_file), self._memory_lock:
+                self._catch_up()
+
+    def save(self, record):
+        """Append a change record at the next version, merging newer records first"""
+        self.save_many([record])
+
+    def save_many(self, records):
+        """Save a batch of change records: queued for the writer, or written now"""
+        if not records:
+            return
+        if not self.write_behind:
+            self._write(records)
+            return
+        with self._memory_lock:
+            self._pending.extend(records)
+            self._apply_pending(records)
+        # Blocks only when the writer is WRITE_BEHIND_QUEUE batches behind. Queued
+        # before the check below, so an idle writer never exits past a batch.
+        self._queue.put(records)
+        with self._writer_guard:
+            if self._writer is None:
+                _write_behind_stores.add(self)
+                self._writer = threading.Thread(target=self._run_writer, daemon=True)
+                self._writer.start()
+
+    def _run_writer(self):
+        while True:
+            try:
+                batch = self._queue.get(timeout=WRITER_IDLE_SECONDS)
+            except queue.Empty:
+                with self._writer_guard:
+                    if self._queue.empty():
+                        self._writer = None
+                        return
+                continue
+            # Let the rest of a burst (bulk delete, quick adds) join this write
+            time.sleep(WRITE_BEHIND_FLUSH_INTERVAL)
+            records = list(batch)
+            while True:
+                try:
+                    records.extend(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            while True:
+                try:
+                    self._write(records)
+                    break
+                except Exception as e:
+                    # Keep the records pending and retry; the badge shows the error
+                    self.save_error = e
+                    logging.exception("Saving scores to %s failed", self.journal_file)
+                    time.sleep(WRITE_BEHIND_RETRY_SECONDS)
+            with self._memory_lock:
+                del self._pending[:len(records)]
+            with self._writer_guard:
+                self.save_error = None
+                self.last_saved = datetime.now()
+                if not self._pending:
+                    self._drained.notify_all()
+
+    def _write(self, records):
+        """Append a batch of change records under one lock and one fsync"""
+        started = time.perf_counter()
+        with file_lock(self.lock_file):
+            self._writing = True
+            try:
+                with self._memory_lock:
+                    self._catch_up()
+                    records = [dict(record, version=self.version + n) for n, record in enumerate(records, 1)]
+                payload = ''.join(json.dumps(record) + '\n' for record in records).encode()
+                with open(self.journal_file, 'ab') as f:
+                    # Drop a torn tail so the new records start on their own line
+                    f.truncate(self._journal_offset)
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    journal_offset = f.tell()
+                with self._memory_lock:
+                    self._journal_offset = journal_offset
+                    self._journal_id = self._file_id(self.journal_file)
+                    self.version = records[-1]['version']
+                    self._apply_many(records)
+                    # Saves queued since this batch are in memory already but older
+                    # than it now: apply them again on top, so a queued remove stays done
+                    self._apply_pending(self._pending[len(records):])
+            finally:
+                self._writing = False
+            compaction_due = self._journal_offset >= JOURNAL_COMPACT_BYTES
+        if not self.write_behind:
+            self.last_saved = datetime.now()
+        registry.observe('ielts_persistence_seconds', time.perf_counter() - started, name='write')
+        registry.inc('ielts_persistence_bytes_written_total', len(payload))
+        self._schedule_rollup()
+        if compaction_due and not self._roll_up():
+            self.start_compaction()
+
+    def _roll_up(self):
+        """Journal an archive record when retention has entries to roll; True if it did
+
+        Written just before a compaction, which then snapshots the smaller
+        series. Its own write finds the journal still due and compacts.
+        """
+        cutoff = retention_cutoff()
+        if cutoff is None:
+            return False
+        before = datetime_minute(cutoff)
+        with self._memory_lock:
+            due = any(self.data['scores'][skill].rollable(before, RETENTION_KEEP) for skill in SKILLS)
+        if not due:
+            return False
+        self._write([{'op': 'archive', 'before': cutoff, 'period': RETENTION_PERIOD, 'keep': RETENTION_KEEP}])
+        return True
+
+    def _write_rollup(self):
+        """Rewrite this student's cohort figures; file lock held"""
+        try:
+            with self._memory_lock:
+                row = student_rollup(self)
+            atomic_write(self.rollup_file, [json.dumps(row).encode()])
+        except Exception:
+            # Derived data: the next write or a cohort backfill puts it right
+            logging.exception("Could not write the cohort rollup %s", self.rollup_file)
+            return None
+        return row
+
+    def _schedule_rollup(self):
+        """Rewrite the cohort figures ROLLUP_DELAY_SECONDS from now, unless already due"""
+        with self._writer_guard:
+            if self._rollup_timer is not None:
+                return
+            self._rollup_timer = threading.Timer(ROLLUP_DELAY_SECONDS, self._delayed_rollup)
+            self._rollup_timer.daemon = True
+            self._rollup_timer.start()
+
+    def _delayed_rollup(self):
+        with self._writer_guard:
+            self._rollup_timer = None
+        try:
+            with file_lock(self.lock_file):
+                with self._memory_lock:
+                    self._catch_up()
+                self._write_rollup()
+        except Exception:
+            # A stale rollup is rebuilt by cohort_rollups()
+            logging.exception("Could not write the cohort rollup %s", self.rollup_file)
+
+    def rollup_current(self):
+        """Whether the rollup file is newer than every file it was computed from"""
+        try:
+            written = os.stat(self.rollup_file).st_mtime_ns
+        except OSError:
+            return False
+        for path in (self.snapshot_file, self.journal_file, self.compacting_file, self.data_file):
+            try:
+                if os.stat(path).st_mtime_ns > written:
+                    return False
+            except FileNotFoundError:
+                continue
+        return True
+
+    def read_rollup(self):
+        """The cohort figures last written for this student, or None"""
+        try:
+            with open(self.rollup_file, 'rb') as f:
+                return json_loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def backfill_rollup(self):
+        """Load this student's data and write their cohort figures"""
+        with file_lock(self.lock_file):
+            with self._memory_lock:
+                self._load()
+            return self._write_rollup()
+
+    def flush(self, timeout=None):
+        """Wait until every saved record is in the journal; False if timeout ran out"""
+        with self._writer_guard:
+            return self._drained.wait_for(lambda: not self._pending, timeout)
+
+    def durability(self):
+        """What has reached the disk: unwritten record count, last write, last error"""
+        return {'pending': len(self._pending), 'last_saved': self.last_saved,
+                'error': str(self.save_error) if self.save_error else None}
+
+    def start_compaction(self):
+        """Rotate the journal and fold it into a new snapshot in the background"""
+        release = try_file_lock(self.compaction_lock_file)
+        if release is None:
+            return
+        try:
+            with file_lock(self.lock_file), self._memory_lock:
+                self._catch_up()
+                if os.path.exists(self.compacting_file):
+                    # Leftover from an interrupted compaction: keep its records in front
+                    with open(self.journal_file, 'r') as src, open(self.compacting_file, 'a') as dst:
+                        dst.write(src.read())
+                    os.remove(self.journal_file)
+                else:
+                    os.replace(self.journal_file, self.compacting_file)
+                self._journal_id = None
+                self._journal_offset = 0
+                # This state already holds what is being compacted
+                self._base_id = rotated_base = self._base_files()
+                meta = self._snapshot_meta()
+                columns = {skill: series.to_columns() for skill, series in self.data['scores'].items()}
+                previous = None if self._live_damaged else self.generation
+                generation = self._next_generation()
+        except Exception:
+            release()
+            raise
+
+        def compact():
+            try:
+                write_snapshot(self._kept_file(generation), meta, columns, generation)
+                # Readers hold the lock while reading snapshot then journals
+                with file_lock(self.lock_file), self._memory_lock:
+                    if not os.path.exists(self.compacting_file):
+                        # Cleared in the meantime: this snapshot holds scores that are gone
+                        if os.path.exists(self._kept_file(generation)):
+                            os.remove(self._kept_file(generation))
+                        return
+                    if os.path.exists(self.snapshot_file):
+                        # The generation replaced stays as a fallback; a damaged one
+                        # is set aside instead
+                        keep_copy(self.snapshot_file, self.damaged_file if previous is None
+                                  else self._kept_file(previous))
+                    os.replace(self._kept_file(generation), self.snapshot_file)
+                    os.replace(self.compacting_file, self._segment_file(generation))
+                    # Unless this store reloaded in between, the new snapshot is its state
+                    if self._base_id == rotated_base:
+                        self._base_id = self._base_files()
+                        self.generation = generation
+                        self._live_damaged = False
+                    self._prune_generations(generation)
+                    self._catch_up()
+                    self._write_rollup()
+            except Exception:
+                # The compacting journal is still replayed on load and retried next time
+                logging.exception("Journal compaction failed")
+            finally:
+                release()
+
+        threading.Thread(target=compact, daemon=True).start()
+
+    def clear(self):
+        """Remove every score, keeping the exam date"""
+        # Queued records would otherwise be written after the files are gone
+        self.flush()
+        with file_lock(self.lock_file), self._memory_lock:
+            snapshots, segments = self.generation_files()
+            for path in (self.snapshot_file, self.data_file, self.journal_file, self.compacting_file,
+                         self.damaged_file, *snapshots.values(), *segments.values()):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.generation = 0
+            self.recovered_from = None
+            self._live_damaged = False
+            target_date = self.data['target_date']
+            self._changed()
+            self._shared.clear()
+            self.data = self._empty_data()
+            self.stats = {skill: SkillStats() for skill in SKILLS}
+            self.trends = {skill: TrendMoments() for skill in SKILLS}
+            self.weekly = {skill: WeeklyScores() for skill in SKILLS}
+            self.archives = {skill: ArchivedScores() for skill in SKILLS}
+            # Versions keep counting so cached views of the old data never match;
+            # the exam-date record saved below takes version + 1
+            self.skill_versions = dict.fromkeys(SKILLS, self.version + 1)
+            self._journal_id = None
+            self._journal_offset = 0
+            self._base_id = (None, None, None)
+        self.save({'op': 'target_date', 'value': target_date.strftime('%Y-%m-%d')})
+
+    def has_saved_data(self):
+        return any(os.path.exists(path) for path in (self.snapshot_file, self.data_file, self.journal_file))
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    user TEXT NOT NULL,
+    id TEXT NOT NULL,
+    skill TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (user, id)
+);
+CREATE INDEX IF NOT EXISTS scores_user_skill_datetime ON scores (user, skill, datetime);
+CREATE TABLE IF NOT EXISTS settings (
+    user TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (user, key)
+);
+-- Per-band test counts kept in step with scores, so card figures never scan
+CREATE TABLE IF NOT EXISTS score_bands (
+    user TEXT NOT NULL,
+    skill TEXT NOT NULL,
+    band REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user, skill, band)
+);
+CREATE TRIGGER IF NOT EXISTS scores_insert_band AFTER INSERT ON scores BEGIN
+    INSERT INTO score_bands (user, skill, band, count) VALUES (NEW.user, NEW.skill, NEW.score, 1)
+    ON CONFLICT (user, skill, band) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS scores_delete_band AFTER DELETE ON scores BEGIN
+    UPDATE score_bands SET count = count - 1
+    WHERE user = OLD.user AND skill = OLD.skill AND band = OLD.score;
+END;
+-- Bumped on every change to a skill; keys caches of derived views
+CREATE TABLE IF NOT EXISTS skill_versions (
+    user TEXT NOT NULL,
+    skill TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (user, skill)
+);
+CREATE TRIGGER IF NOT EXISTS scores_insert_version AFTER INSERT ON scores BEGIN
+    INSERT INTO skill_versions (user, skill, version) VALUES (NEW.user, NEW.skill, 1)
+    ON CONFLICT (user, skill) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS scores_delete_version AFTER DELETE ON scores BEGIN
+    UPDATE skill_versions SET version = version + 1 WHERE user = OLD.user AND skill = OLD.skill;
+END;
+-- Least-squares sums over (days since 2000-01-01, score); see TrendMoments
+CREATE TABLE IF NOT EXISTS skill_moments (
+    user TEXT NOT NULL,
+    skill TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    st REAL NOT NULL,
+    sy REAL NOT NULL,
+    stt REAL NOT NULL,
+    sty REAL NOT NULL,
+    syy REAL NOT NULL,
+    PRIMARY KEY (user, skill)
+);
+CREATE TRIGGER IF NOT EXISTS scores_insert_moments AFTER INSERT ON scores BEGIN
+    INSERT INTO skill_moments (user, skill, n, st, sy, stt, sty, syy)
+    SELECT NEW.user, NEW.skill, 1, t, NEW.score, t * t, t * NEW.score, NEW.score * NEW.score
+    FROM (SELECT julianday(NEW.datetime) - julianday('2000-01-01') AS t)
+    WHERE true  -- an upsert after SELECT needs a WHERE to parse
+    ON CONFLICT (user, skill) DO UPDATE SET
+        n = n + excluded.n, st = st + excluded.st, sy = sy + excluded.sy,
+        stt = stt + excluded.stt, sty = sty + excluded.sty, syy = syy + excluded.syy;
+END;
+CREATE TRIGGER IF NOT EXISTS scores_delete_moments AFTER DELETE ON scores BEGIN
+    UPDATE skill_moments SET
+        n = n - 1, st = st - t, sy = sy - OLD.score,
+        stt = stt - t * t, sty = sty - t * OLD.score, syy = syy - OLD.score * OLD.score
+    FROM (SELECT julianday(OLD.datetime) - julianday('2000-01-01') AS t)
+    WHERE user = OLD.user AND skill = OLD.skill;
+END;
+-- Per-week test counts and score totals, for cohort trend lines; see WeeklyScores
+CREATE TABLE IF NOT EXISTS score_weeks (
+    user TEXT NOT NULL,
+    skill TEXT NOT NULL,
+    week TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (user, skill, week)
+);
+CREATE TRIGGER IF NOT EXISTS scores_insert_week AFTER INSERT ON scores BEGIN
+    INSERT INTO score_weeks (user, skill, week, count, total)
+    VALUES (NEW.user, NEW.skill, date(NEW.datetime, '-6 days', 'weekday 1'), 1, NEW.score)
+    ON CONFLICT (user, skill, week) DO UPDATE SET count = count + 1, total = total + excluded.total;
+END;
+CREATE TRIGGER IF NOT EXISTS scores_delete_week AFTER DELETE ON scores BEGIN
+    UPDATE score_weeks SET count = count - 1, total = total - OLD.score
+    WHERE user = OLD.user AND skill = OLD.skill AND week = date(OLD.datetime, '-6 days', 'weekday 1');
+END;
+-- Entries rolled up under RETENTION_DAYS; see ArchivedScores
+CREATE TABLE IF NOT EXISTS score_archive (
+    user TEXT NOT NULL,
+    skill TEXT NOT NULL,
+    period TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    low REAL NOT NULL,
+    high REAL NOT NULL,
+    PRIMARY KEY (user, skill, period)
+);
+CREATE TABLE IF NOT EXISTS archive_bounds (
+    user TEXT NOT NULL,
+    skill TEXT NOT NULL,
+    until INTEGER NOT NULL,
+    PRIMARY KEY (user, skill)
+);
+"""
+
+class SqliteStore:
+    """SQLite database in WAL mode; reads query only what is rendered"""
+
+    def __init__(self, db_file, user=DEFAULT_USER):
+        self.db_file = db_file
+        self.user = user
+        # Streamlit reruns a session on whichever thread is free. Concurrent
+        # sessions only ever insert or delete their own rows, so SQLite's
+        # writer lock is all the coordination they need.
+        self.conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.conn.executescript(SQLITE_SCHEMA)
+        # Databases created before the derived tables existed
+        with self.conn:
+            if 'score_bands' not in tables:
+                self.conn.execute(
+                    "INSERT INTO score_bands (user, skill, band, count) "
+                    "SELECT user, skill, score, COUNT(*) FROM scores GROUP BY user, skill, score"
+                )
+            if 'skill_moments' not in tables:
+                self.conn.execute(
+                    "INSERT INTO skill_moments (user, skill, n, st, sy, stt, sty, syy) "
+                    "SELECT user, skill, COUNT(*), SUM(t), SUM(score), SUM(t * t), SUM(t * score), "
+                    "SUM(score * score) FROM (SELECT user, skill, score, "
+                    "julianday(datetime) - julianday('2000-01-01') AS t FROM scores) GROUP BY user, skill"
+                )
+            if 'score_weeks' not in tables:
+                self.conn.execute(
+                    "INSERT INTO score_weeks (user, skill, week, count, total) "
+                    "SELECT user, skill, date(datetime, '-6 days', 'weekday 1') AS week, COUNT(*), SUM(score) "
+                    "FROM scores GROUP BY user, skill, week"
+                )
+        self._target_date = get_default_data()['target_date']
+        self.last_saved = None
+
+    def load(self):
+        """Read the settings and apply retention; scores stay in the database until queried"""
+        self._read_settings()
+        self.roll_up()
+
+    def _read_settings(self):
+        row = self.conn.execute(
+            "SELECT value FROM settings WHERE user = ? AND key = 'target_date'", (self.user,)
+        ).fetchone()
+        if row:
+            self._target_date = parse_date(row['value'])
+
+    def refresh(self):
+        """Pick up an exam date changed by another session"""
+        self._read_settings()
+
+    def roll_up(self):
+        """Move entries older than RETENTION_DAYS into score_archive, one transaction per skill"""
+        cutoff = retention_cutoff()
+        if cutoff is None:
+            return
+        for skill in SKILLS:
+            with self.conn:
+                # Taken before reading, so two sessions never archive the same rows
+                self.conn.execute("BEGIN IMMEDIATE")
+                spared = self.conn.execute(
+                    "SELECT datetime FROM scores WHERE user = ? AND skill = ? ORDER BY datetime DESC "
+                    "LIMIT 1 OFFSET ?", (self.user, skill, RETENTION_KEEP - 1)
+                ).fetchone()
+                if spared is None:
+                    continue
+                where = "user = ? AND skill = ? AND datetime < ?"
+                params = (self.user, skill, min(cutoff, spared[0]))
+                rows = self.conn.execute(
+                    f"SELECT datetime, score FROM scores WHERE {where} ORDER BY datetime", params
+                ).fetchall()
+                if not rows:
+                    continue
+                archived = ArchivedScores()
+                archived.add_columns(
+                    np.array([row[0] for row in rows], dtype='datetime64[m]').astype(np.int64),
+                    [row[1] for row in rows], RETENTION_PERIOD
+                )
+                self.conn.executemany(
+                    "INSERT INTO score_archive (user, skill, period, count, total, low, high) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (user, skill, period) DO UPDATE SET "
+                    "count = count + excluded.count, total = total + excluded.total, "
+                    "low = min(low, excluded.low), high = max(high, excluded.high)",
+                    [(self.user, skill, period, *bucket) for period, bucket in archived.periods.items()]
+                )
+                self.conn.execute(
+                    "INSERT INTO archive_bounds (user, skill, until) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user, skill) DO UPDATE SET until = max(until, excluded.until)",
+                    (self.user, skill, archived.until)
+                )
+                # The delete triggers take the rows out of the derived tables;
+                # archived entries still count there, so add them back first
+                self.conn.execute(
+                    "INSERT INTO score_bands (user, skill, band, count) "
+                    f"SELECT user, skill, score, COUNT(*) FROM scores WHERE {where} GROUP BY score "
+                    "ON CONFLICT (user, skill, band) DO UPDATE SET count = count + excluded.count", params
+                )
+                self.conn.execute(
+                    "UPDATE skill_moments SET n = n + d.dn, st = st + d.dst, sy = sy + d.dsy, "
+                    "stt = stt + d.dstt, sty = sty + d.dsty, syy = syy + d.dsyy "
+                    "FROM (SELECT COUNT(*) AS dn, SUM(t) AS dst, SUM(score) AS dsy, SUM(t * t) AS dstt, "
+                    "SUM(t * score) AS dsty, SUM(score * score) AS dsyy FROM (SELECT score, "
+                    "julianday(datetime) - julianday('2000-01-01') AS t FROM scores "
+                    f"WHERE {where})) AS d WHERE user = ? AND skill = ?", params + (self.user, skill)
+                )
+                self.conn.execute(
+                    "INSERT INTO score_weeks (user, skill, week, count, total) "
+                    "SELECT user, skill, date(datetime, '-6 days', 'weekday 1') AS week, COUNT(*), "
+                    f"SUM(score) FROM scores WHERE {where} GROUP BY week "
+                    "ON CONFLICT (user, skill, week) DO UPDATE SET count = count + excluded.count, "
+                    "total = total + excluded.total", params
+                )
+                self.conn.execute(f"DELETE FROM scores WHERE {where}", params)
+
+    def save(self, record):
+        """Apply a change record as a single statement"""
+        self.save_many([record])
+
+    def save_many(self, records):
+        """Apply a batch of change records in one transaction"""
+        with self.conn:
+            adds = []
+            for record in records:
+                if record['op'] == 'add':
+                    adds.append(record)
+                    continue
+                self._insert_many(adds)
+                self._execute(record)
+            self._insert_many(adds)
+        self.last_saved = datetime.now()
+
+    def flush(self, timeout=None):
+        """Saves commit before returning, so there is never anything to wait for"""
+        return True
+
+    def snapshot(self):
+        """Reads already query one consistent database state each; nothing to freeze"""
+        return self
+
+    @property
+    def changes(self):
+        """Token that differs after every change to this user's scores or exam date"""
+        row = self.conn.execute(
+            "SELECT (SELECT total(version) FROM skill_versions WHERE user = ?), "
+            "(SELECT value FROM settings WHERE user = ? AND key = 'target_date')",
+            (self.user, self.user)
+        ).fetchone()
+        return (row[0], row[1])
+
+    def durability(self):
+        """What has reached the disk: unwritten record count, last write, last error"""
+        return {'pending': 0, 'last_saved': self.last_saved, 'error': None}
+
+    def _insert_many(self, adds):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO scores (user, id, skill, datetime, date, time, score) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((self.user, record['entry']['id'], record['skill'], record['entry']['datetime'],
+              record['entry']['date'], record['entry']['time'], record['entry']['score'])
+             for record in adds)
+        )
+        adds.clear()
+
+    def _execute(self, record):
+        op = record['op']
+        if op == 'add':
+            self._insert_many([record])
+        elif op == 'remove':
+            self.conn.execute(
+                "DELETE FROM scores WHERE user = ? AND id = ?", (self.user, record['id'])
+            )
+        elif op == 'target_date':
+            self.conn.execute(
+                "INSERT OR REPLACE INTO settings (user, key, value) VALUES (?, 'target_date', ?)",
+                (self.user, record['value'])
+            )
+            self._target_date = parse_date(record['value'])
+
+    def clear(self):
+        """Remove every score, keeping the exam date"""
+        with self.conn:
+            self.conn.execute("DELETE FROM scores WHERE user = ?", (self.user,))
+            # Archived entries are only in the derived tables now; drop them too
+            for table in ('score_archive', 'archive_bounds', 'score_bands', 'skill_moments', 'score_weeks'):
+                self.conn.execute(f"DELETE FROM {table} WHERE user = ?", (self.user,))
+            self.conn.execute("UPDATE skill_versions SET version = version + 1 WHERE user = ?", (self.user,))
+
+    def has_saved_data(self):
+        return self.conn.execute(
+            "SELECT 1 FROM scores WHERE user = ? LIMIT 1", (self.user,)
+        ).fetchone() is not None
+
+    @property
+    def target_date(self):
+        return self._target_date
+
+    def data_version(self, skill):
+        """Hashable token that changes whenever the skill's entries change"""
+        row = self.conn.execute(
+            "SELECT version FROM skill_versions WHERE user = ? AND skill = ?", (self.user, skill)
+        ).fetchone()
+        return (self.db_file, self.user, skill, row['version'] if row else 0)
+
+    def _rows(self, sql, params):
+        return [
+            {'id': row['id'], 'date': row['date'], 'time': row['time'],
+             'score': row['score'], 'datetime': row['datetime']}
+            for row in self.conn.execute(sql, params)
+        ]
+
+    def existing_ids(self, skill, ids):
+        """The subset of ids already stored for a skill"""
+        ids = list(ids)
+        found = set()
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            found.update(row[0] for row in self.conn.execute(
+                f"SELECT id FROM scores WHERE user = ? AND skill = ? AND id IN ({','.join('?' * len(chunk))})",
+                (self.user, skill, *chunk)
+            ))
+        return found
+
+    def entries(self, skill):
+        """All entries of a skill, oldest first"""
+        return self._rows(
+            "SELECT * FROM scores WHERE user = ? AND skill = ? ORDER BY datetime",
+            (self.user, skill)
+        )
+
+    def iter_entries(self, skill, start_date=None, end_date=None):
+        """Iterate a skill's entries dated within [start_date, end_date], oldest first"""
+        # A separate cursor streams rows instead of fetching them all
+        cursor = self.conn.execute(
+            "SELECT * FROM scores WHERE user = ? AND skill = ? AND datetime >= ? AND datetime < ? "
+            "ORDER BY datetime",
+            (self.user, skill, start_date or '', (end_date or '9999-12-31') + '\uffff')
+        )
+        for row in cursor:
+            yield {'id': row['id'], 'date': row['date'], 'time': row['time'],
+                   'score': row['score'], 'datetime': row['datetime']}
+
+    def page(self, skill, offset, limit, start_date=None, end_date=None, min_score=None, max_score=None):
+        """Newest-first page of a skill's entries matching the filters, and the match count"""
+        where = "user = ? AND skill = ? AND datetime >= ? AND datetime < ? AND score >= ? AND score <= ?"
+        params = (self.user, skill, start_date or '', (end_date or '9999-12-31') + '\uffff',
+                  -1 if min_score is None else min_score, 10 if max_score is None else max_score)
+        total = self.conn.execute(f"SELECT COUNT(*) FROM scores WHERE {where}", params).fetchone()[0]
+        rows = self._rows(
+            f"SELECT * FROM scores WHERE {where} ORDER BY datetime DESC LIMIT ? OFFSET ?",
+            params + (limit, offset)
+        )
+        return rows, total
+
+    def summary(self, skill):
+        """Card figures from the band counts plus one index lookup for the latest"""
+        stats = SkillStats()
+        for row in self.conn.execute(
+            "SELECT band, count FROM score_bands WHERE user = ? AND skill = ? AND count > 0",
+            (self.user, skill)
+        ):
+            stats.histogram[int(round(row['band'] * 2))] = row['count']
+            stats.count += row['count']
+            stats.total += row['band'] * row['count']
+        if not stats.count:
+            return empty_summary()
+        latest = self.conn.execute(
+            "SELECT score FROM scores WHERE user = ? AND skill = ? ORDER BY datetime DESC LIMIT 1",
+            (self.user, skill)
+        ).fetchone()['score']
+        return stats.summary(latest)
+
+    def trend_moments(self, skill):
+        """Running least-squares sums of a skill's (day, score) pairs"""
+        row = self.conn.execute(
+            "SELECT n, st, sy, stt, sty, syy FROM skill_moments WHERE user = ? AND skill = ?",
+            (self.user, skill)
+        ).fetchone()
+        return TrendMoments(*row) if row else TrendMoments()
+
+    def weekly_scores(self, skill):
+        """Per-week count and total of a skill's scores"""
+        return WeeklyScores({
+            row['week']: [row['count'], row['total']] for row in self.conn.execute(
+                "SELECT week, count, total FROM score_weeks WHERE user = ? AND skill = ? AND count > 0",
+                (self.user, skill)
+            )
+        })
+
+    def archived(self, skill):
+        """The ArchivedScores entries of a skill were rolled into"""
+        row = self.conn.execute(
+            "SELECT until FROM archive_bounds WHERE user = ? AND skill = ?", (self.user, skill)
+        ).fetchone()
+        return ArchivedScores({
+            row['period']: [row['count'], row['total'], row['low'], row['high']] for row in self.conn.execute(
+                "SELECT period, count, total, low, high FROM score_archive WHERE user = ? AND skill = ?",
+                (self.user, skill)
+            )
+        }, row['until'] if row else None)
+
+    def history_columns(self, skill):
+        """(minutes, scores) for charts: archived period means, then every raw entry"""
+        return merge_tiers(self.archived(skill), self.columns(skill))
+
+    def for_user(self, user):
+        """Store of another user over the same connection"""
+        store = copy.copy(self)
+        store.user = user
+        store._target_date = get_default_data()['target_date']
+        store.load()
+        return store
+
+    def users(self):
+        return [row[0] for row in self.conn.execute(
+            "SELECT user FROM skill_versions UNION SELECT user FROM settings ORDER BY 1"
+        )]
+
+    def columns(self, skill):
+        """(minutes, scores) of a skill as NumPy arrays, oldest first"""
+        rows = self.conn.execute(
+            "SELECT datetime, score FROM scores WHERE user = ? AND skill = ? ORDER BY datetime",
+            (self.user, skill)
+        ).fetchall()
+        minutes = np.array([row[0] for row in rows], dtype='datetime64[m]').astype(np.int64)
+        return minutes, np.array([row[1] for row in rows], dtype=float)
+
+    def export_data(self):
+        """Scores and exam date in the JSON file format"""
+        return {
+            'scores': {skill: self.entries(skill) for skill in SKILLS},
+            'target_date': self._target_date.strftime('%Y-%m-%d')
+        }
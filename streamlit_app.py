@@ -1,9 +1,20 @@
 import streamlit as st
-import pandas as pd
-import json
 import os
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import random
+import time
+import uuid
+
+import api
+from analytics import (RECENT_WEEKS, TARGET_BAND, OverallBands, at_risk, band_distribution, cohort_frame,
+                       cohort_trend, downsample_frame, fit_moments, forecast, huber_fit, item_accuracy_frame,
+                       overall_frame, progress_frame, question_type_table)
+from cache import VersionedLRU
+from items import ITEM_SKILLS, QUESTION_TYPES, QUESTIONS_PER_TEST, SECTIONS, ItemStore, default_section
+from metrics import begin_run, end_run, probe, record, registry, setup_from_env, timed
+from storage import (DEFAULT_USER, RETENTION_PERIOD, SKILLS, STORAGE_ENGINE, TREND_EPOCH, SessionView,
+                     clean_user_id, cohort_rollups, datetime_minute, entry_day, minute_parts, open_store)
+from transfer import EXPORT_MIME, export_formats, export_to_tempfile, import_scores
 
 # Page configuration
 st.set_page_config(
@@ -13,56 +24,100 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Data persistence functions
-DATA_FILE = "ielts_data.json"
+# Probes: every section and storage call below is timed into metrics.py
+@st.cache_resource
+def start_metrics():
+    """Exporter and trace log, once per server process"""
+    return setup_from_env()
 
-def load_data():
-    """Load data from JSON file"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                # Convert date strings back to date objects where needed
-                if 'target_date' in data:
-                    data['target_date'] = datetime.strptime(data['target_date'], '%Y-%m-%d').date()
-                return data
-        except Exception as e:
-            st.error(f"Error loading data: {e}")
-            return get_default_data()
-    return get_default_data()
+start_metrics()
+begin_run()
+
+@st.cache_resource
+def start_api():
+    """index.html and its sync API (IELTS_API_PORT), once per server process
+
+    The API opens stores of its own: sessions see its writes like another
+    process's, within SHARED_DATA_POLL_SECONDS.
+    """
+    return api.setup_from_env()
 
-def save_data():
-    """Save data to JSON file"""
+api_server = start_api()
+
+# Data persistence functions (engines live in storage.py)
+def get_user_id():
+    """User whose data partition this session works on (?user=... in the URL)"""
+    return clean_user_id(st.query_params.get('user', DEFAULT_USER))
+
+@st.cache_resource(show_spinner=False)
+def shared_store(user):
+    """A user's JSON store, loaded once per server process and read by all their sessions"""
+    store = open_store(user=user)
+    store.load()
+    return store
+
+@st.cache_resource(show_spinner=False)
+def shared_item_store(user):
+    """A user's question results; one per process so its rollup is read once per change"""
+    return ItemStore(user)
+
+def load_data(user):
+    """This session's view of a user's data
+
+    JSON stores are shared through shared_store(); SQLite sessions keep a
+    connection each, since their reads never hold the scores in memory.
+    """
     try:
-        data_to_save = {
-            'scores': st.session_state.scores,
-            'target_date': st.session_state.target_date.strftime('%Y-%m-%d')
-        }
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data_to_save, f, indent=2)
+        with probe('persistence', 'load'):
+            if STORAGE_ENGINE == "sqlite":
+                store = open_store(user=user)
+                store.load()
+            else:
+                store = shared_store(user)
     except Exception as e:
-        st.error(f"Error saving data: {e}")
+        # Carrying on with an empty store would let the next save bury the real history
+        st.error(f"Error loading data: {e}")
+        st.caption("`python repair.py verify` shows which files are damaged.")
+        st.stop()
+    return SessionView(store)
 
-def get_default_data():
-    """Get default data structure"""
-    return {
-        'scores': {
-            'listening': [],
-            'reading': [],
-            'writing': [],
-            'speaking': []
-        },
-        'target_date': date(2025, 11, 1)
-    }
+def save_data(record):
+    """Persist one change record through the session's store"""
+    save_data_many([record])
+
+def save_data_many(records):
+    """Persist a batch of change records in one write"""
+    try:
+        # With write-behind this only queues the records; see store.durability()
+        with probe('persistence', 'save', records=len(records)):
+            st.session_state.store.save_many(records)
+        removed = [record['id'] for record in records if record['op'] == 'remove']
+        if removed:
+            with probe('persistence', 'remove_items', records=len(removed)):
+                shared_item_store(st.session_state.store.user).remove_entries(removed)
+    except Exception as e:
+        st.error(f"Error saving data: {e}")
 
 # Initialize session state with persistent data
-if 'initialized' not in st.session_state:
-    saved_data = load_data()
-    st.session_state.scores = saved_data['scores']
-    st.session_state.target_date = saved_data['target_date']
-    st.session_state.initialized = True
+user_id = get_user_id()
+# Tutors open the cohort dashboard with ?view=cohort; it needs no student's store
+cohort_view = st.query_params.get('view') == 'cohort'
+store = None
+if not cohort_view:
+    if 'initialized' not in st.session_state or st.session_state.store.user != user_id:
+        st.session_state.store = load_data(user_id)
+        st.session_state.initialized = True
+    else:
+        # Merge in whatever other sessions of this user wrote since the last rerun
+        try:
+            with probe('persistence', 'refresh'):
+                st.session_state.store.refresh()
+        except Exception as e:
+            st.error(f"Error loading data: {e}")
+    store = st.session_state.store
 
 # Professional Dark Theme CSS (keeping your existing styles)
+css_started = time.perf_counter()
 st.markdown("""
 <style>
     /* Import Google Fonts */
@@ -255,6 +310,9 @@ st.markdown("""
         z-index: 1000;
     }
     
+    .save-status.saving { background: #B45309; }
+    .save-status.failed { background: #B91C1C; }
+    
     /* Responsive adjustments */
     @media (max-width: 768px) {
         .main-title { font-size: 32px; }
@@ -263,6 +321,7 @@ st.markdown("""
     }
 </style>
 """, unsafe_allow_html=True)
+record('section', 'css', time.perf_counter() - css_started)
 
 # Motivational quotes (keeping your existing quotes)
 quotes = [
@@ -278,10 +337,15 @@ quotes = [
     "Wake up with determination. Go to bed with satisfaction."
 ]
 
+# Chart frames kept across reruns (four skills per user/partition)
+CHART_CACHE_SIZE = 256
+# Most points a progress chart sends to the browser; longer histories are downsampled
+CHART_POINT_BUDGET = int(os.environ.get("IELTS_CHART_POINTS", "500"))
+
 # Helper Functions (keeping your existing functions)
 def calculate_days_left():
     today = date.today()
-    days_left = (st.session_state.target_date - today).days
+    days_left = (store.target_date - today).days
     return max(0, days_left)
 
 def get_daily_quote():
@@ -289,54 +353,176 @@ def get_daily_quote():
     return random.choice(quotes)
 
 def add_score(test_type, score, test_date, test_time):
-    test_id = f"{test_date.strftime('%Y-%m-%d')}_{test_time}_{len(st.session_state.scores[test_type])}"
+    # Random suffix: ids stay unique across deletes and concurrent sessions
+    test_id = f"{test_date.strftime('%Y-%m-%d')}_{test_time}_{uuid.uuid4().hex[:12]}"
     
-    st.session_state.scores[test_type].append({
+    save_data({'op': 'add', 'skill': test_type, 'entry': {
         'id': test_id,
         'date': test_date.strftime('%Y-%m-%d'),
         'time': test_time,
         'score': score,
         'datetime': f"{test_date.strftime('%Y-%m-%d')} {test_time}"
-    })
-    
-    st.session_state.scores[test_type].sort(key=lambda x: x['datetime'])
-    save_data()  # Auto-save after adding
+    }})
+    return test_id
+
+def add_question_results(test_type, test_id, test_date, rows):
+    """Store the answered rows of the question editor against a test"""
+    rows = rows[rows['Type'].notna()]
+    if rows.empty:
+        return 0
+    # A cleared Section cell falls back to the usual layout
+    sections = rows['Section'].fillna(rows['Question'].map(lambda question: default_section(test_type, question)))
+    with probe('persistence', 'ingest_items', records=len(rows)):
+        return shared_item_store(store.user).ingest({
+            'entry_id': [test_id] * len(rows),
+            'skill': [test_type] * len(rows),
+            'question': rows['Question'].to_numpy(),
+            'section': sections.to_numpy(),
+            'type': rows['Type'].to_numpy(),
+            'correct': rows['Correct'].fillna(False).to_numpy(),
+            'date': [test_date.strftime('%Y-%m-%d')] * len(rows),
+        })
 
 def remove_score(test_type, test_id):
-    st.session_state.scores[test_type] = [
-        item for item in st.session_state.scores[test_type] 
-        if item['id'] != test_id
-    ]
-    save_data()  # Auto-save after removing
+    save_data({'op': 'remove', 'skill': test_type, 'id': test_id})
+
+@st.cache_resource
+def get_chart_cache():
+    """Chart frames shared by all sessions, keyed by each skill's data version"""
+    cache = VersionedLRU(max_entries=CHART_CACHE_SIZE)
+
+    def collect():
+        stats = cache.stats()
+        return [(f'ielts_chart_cache_{name}_total', 'counter', stats[name], {})
+                for name in ('hits', 'misses', 'evictions')] + \
+               [('ielts_chart_cache_entries', 'gauge', stats['size'], {})]
+    registry.add_collector(collect)
+    return cache
 
 def create_progress_chart_data(test_type):
-    if not st.session_state.scores[test_type]:
-        return None
-    
-    data = st.session_state.scores[test_type]
-    df = pd.DataFrame({
-        'Test': [f"Test {i+1}" for i in range(len(data))],
-        'Date': [item['date'] for item in data],
-        'Score': [item['score'] for item in data],
-    })
-    return df
+    """Chart frame for a skill; only rebuilt after that skill's scores change"""
+    return get_chart_cache().get_or_build(
+        ('progress_chart', store.data_version(test_type)),
+        lambda: progress_frame(*store.history_columns(test_type), len(store.archived(test_type)), RETENTION_PERIOD)
+    )
+
+def create_chart_points(test_type, chart_data, date_range=None):
+    """Points to plot: the zoomed slice at full resolution, LTTB-downsampled to the budget"""
+    def build():
+        frame = chart_data
+        if date_range:
+            # Dates are sorted, so the slice is two binary searches
+            start = frame['Date'].searchsorted(date_range[0].strftime('%Y-%m-%d'), side='left')
+            end = frame['Date'].searchsorted(date_range[1].strftime('%Y-%m-%d'), side='right')
+            frame = frame.iloc[start:end]
+        return downsample_frame(frame, CHART_POINT_BUDGET)
+
+    return get_chart_cache().get_or_build(
+        ('chart_points', store.data_version(test_type), date_range, CHART_POINT_BUDGET),
+        build
+    )
+
+def raw_tests(chart_data):
+    """(days, scores) of the chart rows that are single tests, not archived period means"""
+    tests = chart_data[~chart_data['Archived']]
+    return tests['Day'].to_numpy(), tests['Score'].to_numpy()
+
+def create_robust_fit(test_type, chart_data):
+    """Outlier-resistant trend line of a skill, refitted only when its scores change"""
+    return get_chart_cache().get_or_build(
+        ('robust_fit', store.data_version(test_type)),
+        # Archived period means are not tests: fitted, each would weigh as one
+        lambda: huber_fit(*raw_tests(chart_data))
+    )
+
+def create_overall_bands():
+    """Time-aligned overall band of this session's store
+
+    The last result the session showed is extended with whatever was added
+    since, so a new score only joins its own minute into the series.
+    """
+    versions = tuple(store.data_version(skill) for skill in SKILLS)
+
+    def build():
+        columns = [store.history_columns(skill) for skill in SKILLS]
+        previous = st.session_state.get('overall_bands')
+        if previous and previous[0] == store.user:
+            return previous[1].update(columns)
+        return OverallBands.build(columns)
+
+    overall = get_chart_cache().get_or_build(('overall_bands', versions), build)
+    st.session_state.overall_bands = (store.user, overall)
+    return overall
+
+def create_overall_chart_points(overall):
+    """Overall chart frame, LTTB-downsampled on the overall band"""
+    versions = tuple(store.data_version(skill) for skill in SKILLS)
+    return get_chart_cache().get_or_build(
+        ('overall_points', versions, CHART_POINT_BUDGET),
+        lambda: downsample_frame(overall_frame(overall), CHART_POINT_BUDGET, column='Overall')
+    )
+
+def create_question_type_frames(test_type):
+    """Accuracy chart frame and weakest-first table of a skill, rebuilt only after its items change"""
+    items = shared_item_store(store.user)
+    today = date.today()
+    return get_chart_cache().get_or_build(
+        ('question_types', items.rollup_file, test_type, items.version(), today),
+        lambda: (item_accuracy_frame(items.weeks(test_type)), question_type_table(items.weeks(test_type), today))
+    )
+
+# Forecasts further out than this are reported as out of reach
+FORECAST_HORIZON_DAYS = 3650
+
+def day_to_date(day):
+    return TREND_EPOCH + timedelta(days=int(day))
+
+def display_forecast(test_type, chart_data):
+    """Trend slope and the date the skill is projected to reach the target band"""
+    robust = st.toggle("Ignore outliers", key=f"robust_{test_type}",
+                       help="Fit the trend with Huber weights so one unusual test cannot swing it")
+    if robust:
+        fit = create_robust_fit(test_type, chart_data)
+    else:
+        # Least squares straight from the stored running sums
+        fit = fit_moments(**store.trend_moments(test_type).to_dict())
+    if fit is None:
+        st.caption("A trend needs at least three tests on different days.")
+        return
+
+    slope_error = fit['sigma'] / fit['sxx'] ** 0.5
+    st.markdown(f"📐 **{fit['slope'] * 30:+.2f}** bands per month (±{1.96 * slope_error * 30:.2f})")
+    st.markdown(f"〰️ Recent average: **{chart_data['Rolling avg'].iloc[-1]:.1f}**")
+
+    today = entry_day(datetime.now().strftime('%Y-%m-%d %H:%M'))
+    outlook = forecast(fit, today)
+    if outlook['status'] == 'reached':
+        st.success(f"🎯 Your trend is at Band {TARGET_BAND} already")
+    elif outlook['status'] == 'flat' or outlook['day'] - today > FORECAST_HORIZON_DAYS:
+        st.warning(f"📉 Band {TARGET_BAND} is out of reach at the current pace")
+    else:
+        reach_date = day_to_date(outlook['day'])
+        margin = (store.target_date - reach_date).days
+        if margin >= 0:
+            st.success(f"🎯 On pace for Band {TARGET_BAND} by {reach_date.strftime('%d %b %Y')}, "
+                       f"{margin} days before your exam")
+        else:
+            st.warning(f"⏳ On pace for Band {TARGET_BAND} by {reach_date.strftime('%d %b %Y')}, "
+                       f"{-margin} days after your exam")
+        if outlook['earliest'] is not None and outlook['latest'] - today <= FORECAST_HORIZON_DAYS:
+            st.caption(f"95% range: {day_to_date(outlook['earliest']).strftime('%d %b %Y')} – "
+                       f"{day_to_date(outlook['latest']).strftime('%d %b %Y')}")
+        else:
+            st.caption("Too few or too scattered tests to put a range on it yet")
 
 def get_latest_score(test_type):
-    if st.session_state.scores[test_type]:
-        return st.session_state.scores[test_type][-1]['score']
-    return 0
+    return store.summary(test_type)['latest']
 
 def get_average_score(test_type):
-    if st.session_state.scores[test_type]:
-        scores = [item['score'] for item in st.session_state.scores[test_type]]
-        return round(sum(scores) / len(scores), 1)
-    return 0
+    return store.summary(test_type)['average']
 
 def get_best_score(test_type):
-    if st.session_state.scores[test_type]:
-        scores = [item['score'] for item in st.session_state.scores[test_type]]
-        return max(scores)
-    return 0
+    return store.summary(test_type)['best']
 
 def get_score_status(score):
     if score >= 7.5:
@@ -350,280 +536,639 @@ def get_score_status(score):
     else:
         return "status-needs-work", "📚 Start Testing"
 
+# Test history browser
+HISTORY_PAGE_SIZES = [25, 50, 100, 500]
+BAND_OPTIONS = [i / 2 for i in range(0, 19)]  # 0.0, 0.5, ..., 9.0
+
 def display_test_entries(test_type):
-    if st.session_state.scores[test_type]:
-        recent_tests = list(reversed(st.session_state.scores[test_type][-5:]))
-        
-        for entry in recent_tests:
-            col1, col2 = st.columns([4, 1])
-            with col1:
-                st.markdown(f"""
-                <div class="test-entry">
-                    <div>
-                        <div class="test-info">Score: {entry['score']} • {entry['date']}</div>
-                        <div class="test-meta">Time: {entry['time']}</div>
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-            with col2:
-                if st.button("🗑️", key=f"remove_{entry['id']}", help="Delete this entry", type="secondary"):
-                    remove_score(test_type, entry['id'])
-                    st.rerun()
+    """Paginated, filterable history of a skill with bulk delete"""
+    filter_col1, filter_col2, filter_col3 = st.columns([2, 2, 1])
+    with filter_col1:
+        date_filter = st.date_input(
+            "Date range",
+            value=(),
+            key=f"history_dates_{test_type}",
+            help="Leave empty to show every date"
+        )
+    with filter_col2:
+        min_score, max_score = st.select_slider(
+            "Score range",
+            options=BAND_OPTIONS,
+            value=(BAND_OPTIONS[0], BAND_OPTIONS[-1]),
+            key=f"history_scores_{test_type}"
+        )
+    with filter_col3:
+        page_size = st.selectbox("Rows", HISTORY_PAGE_SIZES, index=1, key=f"history_size_{test_type}")
+
+    start_date = date_filter[0].strftime('%Y-%m-%d') if len(date_filter) > 0 else None
+    end_date = date_filter[1].strftime('%Y-%m-%d') if len(date_filter) > 1 else None
+    score_filter = (min_score, max_score) != (BAND_OPTIONS[0], BAND_OPTIONS[-1])
+    filters = (start_date, end_date,
+               min_score if score_filter else None, max_score if score_filter else None)
+
+    page_key = f"history_page_{test_type}"
+    page = st.session_state.get(page_key, 1)
+    rows, total = store.page(test_type, (page - 1) * page_size, page_size, *filters)
+    page_count = max(1, -(-total // page_size))
+    if page > page_count:
+        # Filters shrank the result; jump to the last page that exists
+        page = st.session_state[page_key] = page_count
+        rows, total = store.page(test_type, (page - 1) * page_size, page_size, *filters)
+
+    if not rows:
+        st.info("No tests match these filters.")
+        return
+
+    # pandas waits for the first table; see analytics.py
+    import pandas as pd
+
+    page_df = pd.DataFrame({
+        'Delete': False,
+        'Date': [item['date'] for item in rows],
+        'Time': [item['time'] for item in rows],
+        'Score': [item['score'] for item in rows],
+    }, index=[item['id'] for item in rows])
+    edited = st.data_editor(
+        page_df,
+        hide_index=True,
+        disabled=['Date', 'Time', 'Score'],
+        use_container_width=True,
+        # A new page or filter starts with nothing selected
+        key=f"history_editor_{test_type}_{page}_{page_size}_{filters}"
+    )
+    selected = edited.index[edited['Delete']].tolist()
+
+    pager_col, delete_col = st.columns([3, 2])
+    with pager_col:
+        st.number_input(
+            f"Page (of {page_count}, {total} tests)",
+            min_value=1,
+            max_value=page_count,
+            key=page_key
+        )
+    with delete_col:
+        if st.button(f"🗑️ Delete {len(selected)} selected", disabled=not selected,
+                     key=f"history_delete_{test_type}", use_container_width=True):
+            save_data_many([{'op': 'remove', 'skill': test_type, 'id': test_id} for test_id in selected])
+            st.rerun()
 
 # Main Application
 st.markdown('<h1 class="main-title">🎯 IELTS Progress Tracker</h1>', unsafe_allow_html=True)
 
+# Cohort dashboard for tutors
+@timed('section', 'cohort')
+def cohort_dashboard():
+    with probe('persistence', 'cohort_rollups'):
+        rollups = cohort_rollups()
+    if not rollups:
+        st.info("No students yet. Each student tracks their scores at ?user=<their id>.")
+        return
+    frame = cohort_frame(rollups, date.today())
+    risky = at_risk(frame)
+    ready = int((frame['Ready'] == len(SKILLS)).sum())
+    tested = frame['Average'].dropna()
+
+    for col, title, value, subtitle in zip(st.columns(4), [
+        "👥 Students", "🚀 Exam Ready", "⚠️ At Risk", "🎯 Cohort Average"
+    ], [
+        len(frame), ready, len(risky), f"{tested.mean():.1f}" if len(tested) else "—"
+    ], [
+        f"{int(frame['Tests'].sum())} tests recorded",
+        f"All four skills at {TARGET_BAND}+",
+        "Exam ahead, a skill below target",
+        f"Across {len(tested)} students with tests"
+    ]):
+        with col:
+            st.markdown(f'''
+<div class="metric-card">
+    <div class="metric-title">{title}</div>
+    <div class="metric-value">{value}</div>
+    <div class="metric-subtitle">{subtitle}</div>
+</div>
+''', unsafe_allow_html=True)
+
+    student_link = st.column_config.LinkColumn("Student", display_text=r"\?user=(.*)")
+    links = lambda df: df.assign(Student="?user=" + df['Student'])
+
+    st.markdown('<div class="section-header">⚠️ At-Risk Students</div>', unsafe_allow_html=True)
+    if len(risky):
+        st.caption("Not yet at the target band in every skill, nearest exam first")
+        st.dataframe(links(risky), hide_index=True, use_container_width=True,
+                     column_config={'Student': student_link})
+    else:
+        st.success("Every student with an exam ahead is at target in all four skills")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**Latest band per skill**")
+        st.bar_chart(band_distribution(frame), height=320, stack=False, use_container_width=True)
+    with col2:
+        st.markdown("**Weekly average band across the cohort**")
+        st.line_chart(cohort_trend(rollups), height=320, use_container_width=True)
+
+    st.markdown('<div class="section-header">👥 All Students</div>', unsafe_allow_html=True)
+    st.dataframe(links(frame.sort_values('Student')), hide_index=True, use_container_width=True,
+                 column_config={'Student': student_link})
+
+if cohort_view:
+    cohort_dashboard()
+    end_run(view='cohort', engine=STORAGE_ENGINE)
+    st.stop()
+
 # Show save status
-if os.path.exists(DATA_FILE):
-    st.markdown('<div class="save-status">💾 Data Auto-Saved</div>', unsafe_allow_html=True)
+def save_status_badge():
+    """Badge saying whether every change has reached the disk"""
+    durability = store.durability()
+    if durability['error']:
+        badge = ('save-status failed', "⚠️ Save failed, retrying…")
+    elif durability['pending']:
+        badge = ('save-status saving', f"⏳ Saving {durability['pending']} change{'s' if durability['pending'] != 1 else ''}…")
+    elif durability['last_saved']:
+        badge = ('save-status', f"💾 Saved at {durability['last_saved'].strftime('%H:%M:%S')}")
+    elif store.has_saved_data():
+        badge = ('save-status', "💾 All changes saved")
+    else:
+        return
+    st.markdown(f'<div class="{badge[0]}">{badge[1]}</div>', unsafe_allow_html=True)
+
+@st.fragment(run_every=1)
+def live_save_status():
+    """Re-checks every second until the next full run, so 'Saving…' turns into 'Saved'"""
+    save_status_badge()
+
+if store.durability()['pending']:
+    live_save_status()
+else:
+    save_status_badge()
+
+# Other sessions' saves show up within this many seconds, without a click
+SHARED_DATA_POLL_SECONDS = 5
+
+@st.fragment(run_every=SHARED_DATA_POLL_SECONDS)
+def watch_shared_data():
+    """Rerun the page once another session of this user has changed the data"""
+    try:
+        changed = store.poll()
+    except Exception:
+        # The next full run reports the error
+        return
+    if changed:
+        st.rerun()
+
+watch_shared_data()
 
 # Countdown Timer
-days_left = calculate_days_left()
-st.markdown(f'''
+with probe('section', 'countdown'):
+    days_left = calculate_days_left()
+    st.markdown(f'''
 <div class="countdown-container">
     <div class="countdown-days">{days_left}</div>
     <div class="countdown-label">Days Until IELTS</div>
-    <div class="countdown-date">{st.session_state.target_date.strftime("%B %d, %Y")}</div>
+    <div class="countdown-date">{store.target_date.strftime("%B %d, %Y")}</div>
 </div>
 ''', unsafe_allow_html=True)
 
 # Daily Quote
-daily_quote = get_daily_quote()
-st.markdown(f'''
+with probe('section', 'quote'):
+    daily_quote = get_daily_quote()
+    st.markdown(f'''
 <div class="quote-container">
     <div class="quote-text">{daily_quote}</div>
 </div>
 ''', unsafe_allow_html=True)
 
+# Each section below is a fragment: interacting with a widget inside one
+# (picking a test type, zooming a chart) re-runs only that section. Changes to
+# the data re-run the whole app, which is cheap because the cards read running
+# stats, charts come from the version-keyed cache and only the open tab renders.
+
+def blank_question_rows(test_type):
+    import pandas as pd
+
+    questions = list(range(1, QUESTIONS_PER_TEST + 1))
+    return pd.DataFrame({
+        'Question': questions,
+        'Section': [default_section(test_type, question) for question in questions],
+        'Type': pd.Series([None] * len(questions), dtype=object),
+        'Correct': False,
+    })
+
 # Sidebar for adding scores
-st.sidebar.markdown("### 📝 Add New Test Score")
-
-test_type = st.sidebar.selectbox(
-    "Test Type",
-    ['listening', 'reading', 'writing', 'speaking'],
-    format_func=lambda x: f"🎧 {x.title()}" if x == 'listening' 
-    else f"📖 {x.title()}" if x == 'reading'
-    else f"✍️ {x.title()}" if x == 'writing'
-    else f"🗣️ {x.title()}"
-)
+@st.fragment
+def add_score_form():
+    st.markdown("### 📝 Add New Test Score")
 
-# Score options from 5.0 to 9.0 in 0.5 increments
-score_options = [i/2 for i in range(10, 19)]  # 5.0, 5.5, 6.0, ..., 9.0
-score_labels = [str(float(score)) for score in score_options]
+    test_type = st.selectbox(
+        "Test Type",
+        ['listening', 'reading', 'writing', 'speaking'],
+        format_func=lambda x: f"🎧 {x.title()}" if x == 'listening' 
+        else f"📖 {x.title()}" if x == 'reading'
+        else f"✍️ {x.title()}" if x == 'writing'
+        else f"🗣️ {x.title()}"
+    )
 
-score = st.sidebar.selectbox(
-    "Score",
-    options=score_options,
-    format_func=lambda x: f"{x} ⭐",
-    index=2  # Default to 6.0
-)
+    # Score options from 5.0 to 9.0 in 0.5 increments
+    score_options = [i/2 for i in range(10, 19)]  # 5.0, 5.5, 6.0, ..., 9.0
 
-test_date = st.sidebar.date_input(
-    "Test Date",
-    value=date.today(),
-    help="When did you take this test?"
-)
+    score = st.selectbox(
+        "Score",
+        options=score_options,
+        format_func=lambda x: f"{x} ⭐",
+        index=2  # Default to 6.0
+    )
 
-test_time = st.sidebar.time_input(
-    "Test Time",
-    value=datetime.now().time(),
-    help="What time did you take the test?"
-).strftime("%H:%M")
+    test_date = st.date_input(
+        "Test Date",
+        value=date.today(),
+        help="When did you take this test?"
+    )
 
-if st.sidebar.button("➕ Add Score", type="primary", use_container_width=True):
-    add_score(test_type, score, test_date, test_time)
-    st.sidebar.success(f"Added {test_type} score: {score}")
-    st.rerun()
+    test_time = st.time_input(
+        "Test Time",
+        value=datetime.now().time(),
+        help="What time did you take the test?"
+    ).strftime("%H:%M")
 
-st.sidebar.markdown("---")
+    question_rows = None
+    if test_type in ITEM_SKILLS:
+        with st.expander("🧩 Question results (optional)"):
+            st.caption("Give each question you want analysed a type and tick the ones you got right.")
+            question_rows = st.data_editor(
+                blank_question_rows(test_type),
+                column_config={
+                    'Question': st.column_config.NumberColumn(disabled=True),
+                    'Section': st.column_config.NumberColumn(min_value=1, max_value=SECTIONS[test_type], step=1),
+                    'Type': st.column_config.SelectboxColumn(options=QUESTION_TYPES[test_type]),
+                    'Correct': st.column_config.CheckboxColumn(),
+                },
+                hide_index=True,
+                use_container_width=True,
+                # A new key after each add starts the next test from blank rows
+                key=f"questions_{test_type}_{st.session_state.get('question_form', 0)}"
+            )
+
+    if st.button("➕ Add Score", type="primary", use_container_width=True):
+        # Tests this old are already counted in the archive tier, as in the API and imports
+        until = store.archived(test_type).until
+        if until is not None and datetime_minute(f"{test_date.strftime('%Y-%m-%d')} {test_time}") <= until:
+            st.error(f"{test_type.title()} tests up to {minute_parts(until)[0]} are already rolled into "
+                     f"the archived history; choose a later date")
+            return
+        test_id = add_score(test_type, score, test_date, test_time)
+        if question_rows is not None:
+            try:
+                add_question_results(test_type, test_id, test_date, question_rows)
+            except Exception as e:
+                st.error(f"Error saving question results: {e}")
+            st.session_state.question_form = st.session_state.get('question_form', 0) + 1
+        st.success(f"Added {test_type} score: {score}")
+        st.rerun()
 
 # Target date settings
-st.sidebar.markdown("### 🎯 Exam Settings")
-new_target = st.sidebar.date_input(
-    "IELTS Exam Date",
-    value=st.session_state.target_date,
-    help="When is your actual IELTS exam?"
-)
+@st.fragment
+def exam_settings():
+    st.markdown("### 🎯 Exam Settings")
+    new_target = st.date_input(
+        "IELTS Exam Date",
+        value=store.target_date,
+        help="When is your actual IELTS exam?"
+    )
 
-if st.sidebar.button("Update Exam Date", use_container_width=True):
-    st.session_state.target_date = new_target
-    save_data()  # Save after updating target date
-    st.sidebar.success("Exam date updated!")
-    st.rerun()
+    if st.button("Update Exam Date", use_container_width=True):
+        save_data({'op': 'target_date', 'value': new_target.strftime('%Y-%m-%d')})
+        st.success("Exam date updated!")
+        st.rerun()
 
 # Data management section
-st.sidebar.markdown("---")
-st.sidebar.markdown("### 💾 Data Management")
-
-# Export data
-if st.sidebar.button("📤 Export Data", use_container_width=True):
-    data_to_export = {
-        'scores': st.session_state.scores,
-        'target_date': st.session_state.target_date.strftime('%Y-%m-%d'),
-        'exported_at': datetime.now().isoformat()
-    }
-    st.sidebar.download_button(
-        label="💾 Download JSON File",
-        data=json.dumps(data_to_export, indent=2),
-        file_name=f"ielts_progress_{date.today().strftime('%Y%m%d')}.json",
-        mime="application/json",
-        use_container_width=True
+@st.fragment
+def data_management():
+    st.markdown("### 💾 Data Management")
+
+    # Export data
+    with st.expander("📤 Export Data"):
+        export_format = st.selectbox("Format", export_formats(), format_func=str.upper)
+        export_skills = st.multiselect("Skills", SKILLS, default=SKILLS, format_func=str.title)
+        export_dates = st.date_input("Dates", value=(), help="Leave empty to export every date")
+        export_start = export_dates[0].strftime('%Y-%m-%d') if len(export_dates) > 0 else None
+        export_end = export_dates[1].strftime('%Y-%m-%d') if len(export_dates) > 1 else None
+        # Generated in chunks into a temp file only when the button is clicked
+        st.download_button(
+            label="💾 Download",
+            data=lambda: export_to_tempfile(store, export_format, export_skills, export_start, export_end),
+            file_name=f"ielts_progress_{date.today().strftime('%Y%m%d')}.{export_format}",
+            mime=EXPORT_MIME[export_format],
+            disabled=not export_skills,
+            use_container_width=True
+        )
+
+    # Import data
+    if 'import_report' in st.session_state:
+        report = st.session_state.pop('import_report')
+        st.success(f"Imported {report['imported']} of {report['rows']} rows "
+                   f"({report['duplicates']} duplicates, {len(report['errors'])} errors)")
+        if report['errors']:
+            import pandas as pd
+
+            with st.expander("Rows that were skipped"):
+                st.dataframe(
+                    pd.DataFrame(report['errors'][:1000], columns=['Row', 'Problem']),
+                    hide_index=True,
+                    use_container_width=True
+                )
+    upload = st.file_uploader(
+        "📥 Import Data",
+        type=['csv', 'json', 'ndjson', 'jsonl'],
+        help="CSV (skill, date, time, score), an exported JSON file, or NDJSON"
     )
+    if upload is not None and st.button("Import File", use_container_width=True):
+        try:
+            st.session_state.import_report = import_scores(store, upload, upload.name)
+        except Exception as e:
+            st.error(f"Error importing data: {e}")
+        else:
+            st.rerun()
 
-# Clear all data (with confirmation)
-if st.sidebar.button("🗑️ Clear All Data", type="secondary", use_container_width=True):
-    if 'confirm_clear' not in st.session_state:
-        st.session_state.confirm_clear = False
-    
-    if not st.session_state.confirm_clear:
-        st.session_state.confirm_clear = True
-        st.sidebar.error("⚠️ Click again to confirm deletion!")
-    else:
-        # Clear data
-        st.session_state.scores = get_default_data()['scores']
-        if os.path.exists(DATA_FILE):
-            os.remove(DATA_FILE)
-        st.session_state.confirm_clear = False
-        st.sidebar.success("All data cleared!")
-        st.rerun()
+    # Clear all data (with confirmation)
+    if st.button("🗑️ Clear All Data", type="secondary", use_container_width=True):
+        if 'confirm_clear' not in st.session_state:
+            st.session_state.confirm_clear = False
+        
+        if not st.session_state.confirm_clear:
+            st.session_state.confirm_clear = True
+            st.error("⚠️ Click again to confirm deletion!")
+        else:
+            # Clear data
+            try:
+                store.clear()
+                shared_item_store(store.user).clear()
+            except Exception as e:
+                st.error(f"Error clearing data: {e}")
+            st.session_state.confirm_clear = False
+            st.success("All data cleared!")
+            st.rerun()
 
-# Main Dashboard - Score Cards (keeping all your existing dashboard code)
-st.markdown('<div class="section-header">📊 Current Performance</div>', unsafe_allow_html=True)
+    if api_server is not None:
+        st.caption(f"📡 index.html syncs with this data at "
+                   f"http://127.0.0.1:{api_server.server_address[1]}/?user={store.user}")
+
+with st.sidebar, probe('section', 'sidebar'):
+    add_score_form()
+    st.markdown("---")
+    exam_settings()
+    st.markdown("---")
+    data_management()
 
-col1, col2, col3, col4 = st.columns(4)
+# Main Dashboard - Score Cards (keeping all your existing dashboard code)
 test_types = ['listening', 'reading', 'writing', 'speaking']
 test_icons = ['🎧', '📖', '✍️', '🗣️']
 
-for i, (test, icon) in enumerate(zip(test_types, test_icons)):
-    with [col1, col2, col3, col4][i]:
-        latest = get_latest_score(test)
-        average = get_average_score(test)
-        best = get_best_score(test)
-        total_tests = len(st.session_state.scores[test])
+@st.fragment
+@timed('section', 'metric_cards')
+def metric_cards(summaries):
+    st.markdown('<div class="section-header">📊 Current Performance</div>', unsafe_allow_html=True)
+
+    col1, col2, col3, col4 = st.columns(4)
+
+    for i, (test, icon) in enumerate(zip(test_types, test_icons)):
+        with [col1, col2, col3, col4][i]:
+            summary = summaries[test]
+            latest = summary['latest']
+            average = summary['average']
+            best = summary['best']
+            total_tests = summary['count']
+            
+            status_class, status_text = get_score_status(latest)
+            
+            st.markdown(f'''
+            <div class="metric-card">
+                <div class="metric-title">{icon} {test.title()}</div>
+                <div class="metric-value">{latest if latest > 0 else "—"}</div>
+                <div class="metric-subtitle">
+                    Best: {best if best > 0 else "—"} • Avg: {average if average > 0 else "—"}<br>
+                    <span class="{status_class}">{status_text}</span> • {total_tests} tests
+                </div>
+            </div>
+            ''', unsafe_allow_html=True)
+
+def question_type_analysis(test):
+    """Accuracy per question type from the item rollups, weakest types first"""
+    st.markdown("**Question Types**")
+    accuracy, table = create_question_type_frames(test)
+    if table.empty:
+        st.caption("Fill in the question results when you add a score to see which question types cost you marks.")
+        return
+
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        shown = st.multiselect(
+            "Question types",
+            list(accuracy.columns),
+            default=list(table['Question type'][:3]),
+            key=f"question_types_{test}"
+        )
+        st.line_chart(accuracy[shown or list(accuracy.columns)], height=300, use_container_width=True)
+        st.caption(f"% correct over the trailing {RECENT_WEEKS} weeks")
+    with col2:
+        weakest = table.iloc[0]
+        st.warning(f"🔍 Weakest: **{weakest['Question type']}** ({weakest['Accuracy %']}% correct)")
+        st.dataframe(table, hide_index=True, use_container_width=True)
+        sections = shared_item_store(store.user).sections(test)
+        st.caption(" • ".join(f"Section {section}: {100 * right / total:.0f}%"
+                              for section, (right, total) in sorted(sections.items(), key=lambda pair: int(pair[0]))))
+
+# Progress Charts Section
+@st.fragment
+@timed('section', 'tab_{0}')
+def skill_tab(test):
+    chart_data = create_progress_chart_data(test)
+    
+    if chart_data is not None and not chart_data.empty:
+        col1, col2 = st.columns([2, 1])
         
-        status_class, status_text = get_score_status(latest)
+        with col1:
+            st.markdown(f"**Progress Chart**")
+            
+            date_range = None
+            if len(chart_data) > CHART_POINT_BUDGET:
+                first_date = datetime.strptime(chart_data['Date'].iloc[0], '%Y-%m-%d').date()
+                last_date = datetime.strptime(chart_data['Date'].iloc[-1], '%Y-%m-%d').date()
+                zoom = st.date_input(
+                    "Zoom to dates",
+                    value=(first_date, last_date),
+                    min_value=first_date,
+                    max_value=last_date,
+                    key=f"zoom_{test}",
+                    help="Narrow the range to see every test in it"
+                )
+                # Ignore the half-picked range while the second date is being chosen
+                if len(zoom) == 2 and zoom != (first_date, last_date):
+                    date_range = tuple(zoom)
+            chart_points = create_chart_points(test, chart_data, date_range)
+            
+            # Create chart with better styling
+            st.line_chart(
+                chart_points[['Score', 'Rolling avg', 'Trend']], 
+                height=400,
+                use_container_width=True
+            )
+            if date_range:
+                st.caption(f"Zoomed to {date_range[0]} – {date_range[1]}: {len(chart_points)} points")
+            elif len(chart_points) < len(chart_data):
+                st.caption(f"Showing {len(chart_points)} of {len(chart_data)} tests, downsampled to keep the trend shape")
+            archived = store.archived(test)
+            if len(archived):
+                rolled = sum(bucket[0] for bucket in archived.periods.values())
+                st.caption(f"{rolled} tests up to {minute_parts(archived.until)[0]} are kept as "
+                           f"{'daily' if RETENTION_PERIOD == 'day' else 'weekly'} averages")
+            
+            # Progress insights
+            _, scores = raw_tests(chart_data)
+            if len(scores) > 1:
+                # From the first test still kept as it was taken, not an archived mean
+                improvement = scores[-1] - scores[0]
+                if improvement > 0:
+                    st.success(f"📈 **{improvement:+.1f}** points improvement!")
+                elif improvement < 0:
+                    st.warning(f"📉 **{improvement:+.1f}** points since first test")
+                else:
+                    st.info("📊 **Stable** performance")
+        
+        with col2:
+            st.markdown("**Trend & Forecast**")
+            display_forecast(test, chart_data)
+            
+            st.markdown("**Target Reference**")
+            st.markdown("🎯 **Band 7.0** - Target Score")
+            st.markdown("🔥 **Band 7.5+** - Excellent")
+            st.markdown("📈 **Band 6.5** - Good Progress")
+            st.markdown("💪 **Band 6.0** - Keep Going")
         
+        if test in ITEM_SKILLS:
+            question_type_analysis(test)
+
+        st.markdown("**Test History**")
+        display_test_entries(test)
+    else:
+        st.info(f"No {test} scores yet. Add your first test score using the sidebar! 👈")
+
+@st.fragment
+@timed('section', 'tab_overall')
+def overall_tab():
+    overall = create_overall_bands()
+    if not len(overall):
+        st.info("The overall band needs at least one test in each of the four skills.")
+        return
+
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        st.markdown("**Overall Band**")
+        chart_points = create_overall_chart_points(overall)
+        show_skills = st.toggle("Show the four skills", key="overall_skills")
+        columns = list(chart_points.columns) if show_skills else ['Overall']
+        st.line_chart(chart_points[columns], height=400, use_container_width=True)
+        if len(chart_points) < len(overall):
+            st.caption(f"Showing {len(chart_points)} of {len(overall)} points, downsampled to keep the trend shape")
+        st.caption("At every test, the latest score of each skill averaged and rounded like an exam result")
+
+    with col2:
+        latest = overall.overall[-1]
+        status_class, status_text = get_score_status(latest)
         st.markdown(f'''
         <div class="metric-card">
-            <div class="metric-title">{icon} {test.title()}</div>
-            <div class="metric-value">{latest if latest > 0 else "—"}</div>
+            <div class="metric-title">🏆 Overall Band Now</div>
+            <div class="metric-value">{latest}</div>
             <div class="metric-subtitle">
-                Best: {best if best > 0 else "—"} • Avg: {average if average > 0 else "—"}<br>
-                <span class="{status_class}">{status_text}</span> • {total_tests} tests
+                <span class="{status_class}">{status_text}</span><br>
+                Best: {overall.overall.max()} • First: {overall.overall[0]}
             </div>
         </div>
         ''', unsafe_allow_html=True)
+        for test, icon, band in zip(test_types, test_icons, overall.bands[-1]):
+            st.markdown(f"{icon} {test.title()}: **{band}**")
 
-# Progress Charts Section
-st.markdown('<div class="section-header">📈 Progress Analysis</div>', unsafe_allow_html=True)
+# Overall Summary (keeping your existing summary code)
+@st.fragment
+@timed('section', 'overall_summary')
+def overall_summary(summaries):
+    st.markdown('<div class="section-header">🏆 Overall Summary</div>', unsafe_allow_html=True)
 
-tab1, tab2, tab3, tab4 = st.tabs(['🎧 Listening', '📖 Reading', '✍️ Writing', '🗣️ Speaking'])
-tabs = [tab1, tab2, tab3, tab4]
+    col1, col2, col3 = st.columns(3)
 
-for i, (tab, test) in enumerate(zip(tabs, test_types)):
-    with tab:
-        chart_data = create_progress_chart_data(test)
+    with col1:
+        total_tests = sum(summary['count'] for summary in summaries.values())
+        overall_avg = round(sum(summary['total'] for summary in summaries.values()) / total_tests, 1) if total_tests else 0
         
-        if chart_data is not None and not chart_data.empty:
-            col1, col2 = st.columns([2, 1])
-            
-            with col1:
-                st.markdown(f"**Progress Chart**")
-                
-                # Create chart with better styling
-                chart_df = chart_data.set_index('Test')
-                st.line_chart(
-                    chart_df['Score'], 
-                    height=400,
-                    use_container_width=True
-                )
-                
-                # Progress insights
-                if len(chart_data) > 1:
-                    improvement = chart_data['Score'].iloc[-1] - chart_data['Score'].iloc[0]
-                    if improvement > 0:
-                        st.success(f"📈 **+{improvement}** points improvement!")
-                    elif improvement < 0:
-                        st.warning(f"📉 **{improvement}** points since first test")
-                    else:
-                        st.info("📊 **Stable** performance")
-            
-            with col2:
-                st.markdown("**Target Reference**")
-                st.markdown("🎯 **Band 7.0** - Target Score")
-                st.markdown("🔥 **Band 7.5+** - Excellent")
-                st.markdown("📈 **Band 6.5** - Good Progress")
-                st.markdown("💪 **Band 6.0** - Keep Going")
-                
-                st.markdown("**Recent Tests**")
-                display_test_entries(test)
+        status_class, status_text = get_score_status(overall_avg)
+        
+        st.markdown(f'''
+        <div class="metric-card">
+            <div class="metric-title">🎯 Overall Average</div>
+            <div class="metric-value">{overall_avg if overall_avg > 0 else "—"}</div>
+            <div class="metric-subtitle">
+                <span class="{status_class}">{status_text}</span><br>
+                {total_tests} total tests completed
+            </div>
+        </div>
+        ''', unsafe_allow_html=True)
+
+    with col2:
+        # Calculate readiness
+        ready_count = sum(1 for test in test_types if summaries[test]['latest'] >= 7.0)
+        readiness_pct = (ready_count / 4) * 100 if ready_count > 0 else 0
+        
+        st.markdown(f'''
+        <div class="metric-card">
+            <div class="metric-title">🚀 Exam Readiness</div>
+            <div class="metric-value">{ready_count}/4</div>
+            <div class="metric-subtitle">
+                Skills at target level<br>
+                {int(readiness_pct)}% ready for IELTS
+            </div>
+        </div>
+        ''', unsafe_allow_html=True)
+
+    with col3:
+        # Next steps recommendation
+        weakest_skill = min(test_types, key=lambda x: summaries[x]['latest']) if any(summaries[test]['latest'] > 0 for test in test_types) else "listening"
+        weakest_score = summaries[weakest_skill]['latest']
+        
+        if weakest_score >= 7.0:
+            recommendation = "🔥 All skills strong!"
         else:
-            st.info(f"No {test} scores yet. Add your first test score using the sidebar! 👈")
+            recommendation = f"💪 Focus on {weakest_skill}"
+        
+        st.markdown(f'''
+        <div class="metric-card">
+            <div class="metric-title">📚 Next Focus</div>
+            <div class="metric-value" style="font-size: 20px;">{recommendation}</div>
+            <div class="metric-subtitle">
+                {"Maintain current level" if weakest_score >= 7.0 else f"Current: {weakest_score if weakest_score > 0 else 'Not tested'}"}<br>
+                {"Keep practicing all skills" if weakest_score >= 7.0 else "Target: 7.0+"}
+            </div>
+        </div>
+        ''', unsafe_allow_html=True)
 
-# Overall Summary (keeping your existing summary code)
-st.markdown('<div class="section-header">🏆 Overall Summary</div>', unsafe_allow_html=True)
+# One stats lookup per skill serves every card on the page
+with probe('persistence', 'summary'):
+    summaries = {test: store.summary(test) for test in test_types}
 
-col1, col2, col3 = st.columns(3)
+metric_cards(summaries)
 
-with col1:
-    all_scores = []
-    for test in test_types:
-        if st.session_state.scores[test]:
-            scores = [item['score'] for item in st.session_state.scores[test]]
-            all_scores.extend(scores)
-    
-    overall_avg = round(sum(all_scores) / len(all_scores), 1) if all_scores else 0
-    total_tests = sum(len(st.session_state.scores[test]) for test in test_types)
-    
-    status_class, status_text = get_score_status(overall_avg)
-    
-    st.markdown(f'''
-    <div class="metric-card">
-        <div class="metric-title">🎯 Overall Average</div>
-        <div class="metric-value">{overall_avg if overall_avg > 0 else "—"}</div>
-        <div class="metric-subtitle">
-            <span class="{status_class}">{status_text}</span><br>
-            {total_tests} total tests completed
-        </div>
-    </div>
-    ''', unsafe_allow_html=True)
+st.markdown('<div class="section-header">📈 Progress Analysis</div>', unsafe_allow_html=True)
 
-with col2:
-    # Calculate readiness
-    ready_count = sum(1 for test in test_types if get_latest_score(test) >= 7.0)
-    readiness_pct = (ready_count / 4) * 100 if ready_count > 0 else 0
-    
-    st.markdown(f'''
-    <div class="metric-card">
-        <div class="metric-title">🚀 Exam Readiness</div>
-        <div class="metric-value">{ready_count}/4</div>
-        <div class="metric-subtitle">
-            Skills at target level<br>
-            {int(readiness_pct)}% ready for IELTS
-        </div>
-    </div>
-    ''', unsafe_allow_html=True)
+# Switching tabs reruns the app, so only the open tab's chart is ever built
+tabs = st.tabs(['🎧 Listening', '📖 Reading', '✍️ Writing', '🗣️ Speaking', '🏆 Overall'],
+               key="skill_tabs", on_change="rerun")
 
-with col3:
-    # Next steps recommendation
-    weakest_skill = min(test_types, key=lambda x: get_latest_score(x)) if any(get_latest_score(test) > 0 for test in test_types) else "listening"
-    weakest_score = get_latest_score(weakest_skill)
-    
-    if weakest_score >= 7.0:
-        recommendation = "🔥 All skills strong!"
-    else:
-        recommendation = f"💪 Focus on {weakest_skill}"
-    
-    st.markdown(f'''
-    <div class="metric-card">
-        <div class="metric-title">📚 Next Focus</div>
-        <div class="metric-value" style="font-size: 20px;">{recommendation}</div>
-        <div class="metric-subtitle">
-            {"Maintain current level" if weakest_score >= 7.0 else f"Current: {weakest_score if weakest_score > 0 else 'Not tested'}"}<br>
-            {"Keep practicing all skills" if weakest_score >= 7.0 else "Target: 7.0+"}
-        </div>
-    </div>
-    ''', unsafe_allow_html=True)
+for tab, test in zip(tabs, test_types):
+    if tab.open:
+        with tab:
+            skill_tab(test)
+if tabs[-1].open:
+    with tabs[-1]:
+        overall_tab()
+
+overall_summary(summaries)
 
 # Footer
 st.markdown("---")
@@ -631,4 +1176,26 @@ st.markdown("""
 <div style="text-align: center; color: #6B7280; padding: 20px; font-size: 14px;">
     💪 Built for IELTS Success • Track your progress, achieve your goals • 💾 Data automatically saved
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+# Opt-in performance panel (?debug=1); the run's trace is logged either way
+trace = end_run(user=user_id, engine=type(store.store).__name__)
+if st.query_params.get('debug') == '1':
+    import pandas as pd
+
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("### 🛠️ Performance")
+        st.caption(f"Last full run: {trace['ms']:.0f} ms")
+        st.dataframe(
+            pd.DataFrame(trace['probes'], columns=['kind', 'name', 'ms', 'records', 'bytes']),
+            hide_index=True,
+            use_container_width=True
+        )
+        cache_stats = get_chart_cache().stats()
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        hit_rate = f" ({cache_stats['hits'] / lookups:.0%})" if lookups else ""
+        st.caption(
+            f"Chart cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses{hit_rate}, "
+            f"{cache_stats['size']} entries, {cache_stats['evictions']} evicted"
+        )
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+from datetime import date
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import try_file_lock  # noqa: E402
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Every test works on data files of its own"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def make_entry(n, score=6.5, tag=0, entry_id=None):
+    """The n-th test of a synthetic history, one an hour, with an id in the app's format"""
+    moment = date(2025, 1, 1).toordinal() * 24 + n
+    day = date.fromordinal(moment // 24).isoformat()
+    time_of_day = f"{moment % 24:02d}:00"
+    return {
+        'id': entry_id or f"{day}_{time_of_day}_{tag:04x}{n:08x}",
+        'date': day,
+        'time': time_of_day,
+        'score': score,
+        'datetime': f"{day} {time_of_day}"
+    }
+
+def add(skill, entry):
+    return {'op': 'add', 'skill': skill, 'entry': entry}
+
+def wait_for_compaction(store, timeout=10):
+    """Block until no compaction of store's files is running"""
+    deadline = time.monotonic() + timeout
+    while (release := try_file_lock(store.compaction_lock_file)) is None:
+        assert time.monotonic() < deadline, "compaction did not finish"
+        time.sleep(0.01)
+    release()
+
+def stored(store, skill):
+    """{id: entry} of a skill"""
+    return {entry['id']: entry for entry in store.entries(skill)}
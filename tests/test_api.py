@@ -0,0 +1,89 @@
+import http.client
+import json
+
+import pytest
+
+from api import open_loaded, start_server
+
+@pytest.fixture
+def server():
+    server = start_server(0, open_loaded('json', write_behind=False))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def request(server, method, path, body=None, host=None, **headers):
+    port = server.server_address[1]
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.putrequest(method, path, skip_host=True)
+    conn.putheader('Host', host or f"127.0.0.1:{port}")
+    payload = b'' if body is None else json.dumps(body).encode()
+    headers = dict({'Content-Type': 'application/json'}, **{name.replace('_', '-'): value
+                                                             for name, value in headers.items()})
+    for name, value in headers.items():
+        if value is not None:
+            conn.putheader(name, value)
+    conn.putheader('Content-Length', str(len(payload)))
+    conn.endheaders(payload)
+    response = conn.getresponse()
+    status, data = response.status, json.loads(response.read() or b'null')
+    conn.close()
+    return status, data
+
+ENTRY = {'date': '2025-03-01', 'time': '09:30', 'score': 7.0}
+
+def entries(server):
+    return request(server, 'GET', '/api/scores/reading')[1]['entries']
+
+def test_json_from_the_server_origin_is_accepted(server):
+    port = server.server_address[1]
+    for origin in (f"http://127.0.0.1:{port}", f"http://localhost:{port}", None):
+        status, data = request(server, 'POST', '/api/scores/reading', dict(ENTRY, id=f"test-{origin}"),
+                               Origin=origin)
+        assert status == 201, data
+    status, _ = request(server, 'POST', '/api/scores/reading', dict(ENTRY, id='by-name'),
+                        host=f"localhost:{port}")
+    assert status == 201
+    assert len(entries(server)) == 4
+
+def test_other_content_types_are_refused(server):
+    for content_type in ('text/plain', 'application/x-www-form-urlencoded', None):
+        status, _ = request(server, 'POST', '/api/scores/reading', ENTRY, Content_Type=content_type)
+        assert status == 415
+    status, _ = request(server, 'PUT', '/api/target-date', {'value': '2025-06-01'}, Content_Type='text/plain')
+    assert status == 415
+    assert entries(server) == []
+
+@pytest.mark.parametrize('origin', [
+    'https://evil.example', 'null', 'http://127.0.0.1:1', 'http://localhost', 'http://127.0.0.1.evil.example',
+])
+def test_changes_from_other_origins_are_forbidden(server, origin):
+    request(server, 'POST', '/api/scores/reading', dict(ENTRY, id='kept'))
+    status, _ = request(server, 'POST', '/api/scores/reading', ENTRY, Origin=origin, Content_Type='text/plain')
+    assert status == 403
+    assert request(server, 'PUT', '/api/target-date', {'value': '2025-06-01'}, Origin=origin)[0] == 403
+    assert request(server, 'DELETE', '/api/scores/reading/kept', Origin=origin)[0] == 403
+    assert request(server, 'DELETE', '/api/scores', Origin=origin)[0] == 403
+    assert [entry['id'] for entry in entries(server)] == ['kept']
+    # Reads stay open to other local pages
+    assert request(server, 'GET', '/api/state', Origin=origin)[0] == 200
+
+@pytest.mark.parametrize('host', ['evil.example', 'evil.example:{port}', '127.0.0.1:1', '[::1]:{port}'])
+def test_changes_addressed_to_other_hosts_are_forbidden(server, host):
+    host = host.format(port=server.server_address[1])
+    status, _ = request(server, 'POST', '/api/scores/reading', ENTRY, host=host)
+    assert status == 403
+    assert entries(server) == []
+
+@pytest.mark.parametrize('length', ['-1', 'many'])
+def test_bad_content_length_is_refused_without_reading(server, length):
+    port = server.server_address[1]
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.putrequest('POST', '/api/scores/reading')
+    conn.putheader('Content-Type', 'application/json')
+    conn.putheader('Content-Length', length)
+    conn.endheaders()
+    response = conn.getresponse()
+    assert response.status == 400
+    conn.close()
+    assert entries(server) == []
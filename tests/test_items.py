@@ -0,0 +1,19 @@
+import pandas as pd
+
+from items import SECTIONS, validate_items
+
+def test_section_is_checked_against_the_skill():
+    rows = [('reading', 3), ('reading', 4), ('listening', 4), ('listening', 5), ('reading', '')]
+    chunk = pd.DataFrame({
+        'row': range(1, len(rows) + 1),
+        'entry_id': '2025-01-01_10:00_0001',
+        'skill': [skill for skill, _ in rows],
+        'question': range(1, len(rows) + 1),
+        'section': [str(section) for _, section in rows],
+        'type': "Matching headings",
+        'correct': 'yes',
+    })
+    valid, errors = validate_items(chunk)
+    assert [row for row, _ in errors] == [2, 4]
+    assert all(f"{SECTIONS['reading']} for reading" in message for _, message in errors)
+    assert list(valid['section']) == [3, 4, 1]
@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+
+import storage
+from conftest import ROOT, add, make_entry, stored, wait_for_compaction
+from storage import JsonStore
+
+WRITES = 150
+
+# Another server process: its own JsonStore on the same files, compacting often
+CHILD = textwrap.dedent("""
+    import json, sys
+    sys.path.insert(0, {root!r})
+    import storage
+    from conftest import add, make_entry, wait_for_compaction
+    storage.JOURNAL_COMPACT_BYTES = 2048
+    store = storage.JsonStore(storage.DATA_FILE)
+    store.load()
+    added, removed = [], []
+    print('ready', flush=True)
+    for n in range({writes}):
+        entry = make_entry(n, tag=3)
+        store.save(add('reading', entry))
+        added.append(entry['id'])
+        if n % 3 == 2:
+            store.save({{'op': 'remove', 'skill': 'reading', 'id': added[-2]}})
+            removed.append(added[-2])
+    wait_for_compaction(store)
+    print(json.dumps({{'added': added, 'removed': removed}}))
+""")
+
+def run_writer(store, tag, ledger):
+    for n in range(WRITES):
+        entry = make_entry(n, tag=tag)
+        store.save(add('reading', entry))
+        ledger['added'].append(entry['id'])
+        if n % 3 == 2:
+            store.save({'op': 'remove', 'skill': 'reading', 'id': ledger['added'][-2]})
+            ledger['removed'].append(ledger['added'][-2])
+        if n == WRITES // 2:
+            # One compaction started by hand mid-run, besides those the journal size triggers
+            store.start_compaction()
+
+def test_interleaved_writers_and_compaction_lose_nothing(monkeypatch):
+    monkeypatch.setattr(storage, 'JOURNAL_COMPACT_BYTES', 2048)
+    first, second = JsonStore(storage.DATA_FILE), JsonStore(storage.DATA_FILE)
+    first.load()
+    second.load()
+    child = subprocess.Popen(
+        [sys.executable, '-c', CHILD.format(root=ROOT, writes=WRITES)],
+        stdout=subprocess.PIPE, text=True, env=dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'tests'))
+    )
+    # Start the threads once the child has imported everything and is about to write
+    assert child.stdout.readline().strip() == 'ready'
+    ledgers = [{'added': [], 'removed': []} for _ in range(2)]
+    threads = [threading.Thread(target=run_writer, args=(store, tag, ledger))
+               for store, tag, ledger in zip((first, second), (1, 2), ledgers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    output, _ = child.communicate(timeout=60)
+    assert child.returncode == 0
+    ledgers.append(json.loads(output))
+    wait_for_compaction(first)
+
+    fresh = JsonStore(storage.DATA_FILE)
+    fresh.load()
+    found = stored(fresh, 'reading')
+    removed = {entry_id for ledger in ledgers for entry_id in ledger['removed']}
+    expected = {entry_id for ledger in ledgers for entry_id in ledger['added']} - removed
+    assert expected - set(found) == set(), "lost"
+    assert removed & set(found) == set(), "resurrected"
+    assert set(found) == expected
+    # Every write went through a compaction at least once
+    assert fresh.generation > 0
+    # The writers' own views caught up with each other too
+    for store in (first, second):
+        store.refresh()
+        assert set(stored(store, 'reading')) == expected
+
+def test_write_merges_records_another_store_appended():
+    first, second = JsonStore(storage.DATA_FILE), JsonStore(storage.DATA_FILE)
+    first.load()
+    second.load()
+    first.save(add('listening', make_entry(1)))
+    second.save(add('listening', make_entry(2)))
+    first.save({'op': 'remove', 'skill': 'listening', 'id': make_entry(2)['id']})
+    second.save(add('listening', make_entry(3)))
+    assert set(stored(second, 'listening')) == {make_entry(1)['id'], make_entry(3)['id']}
+    versions = [json.loads(line)['version'] for line in open(first.journal_file)]
+    assert versions == [1, 2, 3, 4]
@@ -0,0 +1,12 @@
+import numpy as np
+
+from analytics import progress_frame
+
+def test_archived_means_are_labelled_as_periods():
+    minutes = np.array([0, 7, 14, 15, 16]) * 1440
+    frame = progress_frame(minutes, np.array([6.375, 6.5, 6.0, 7.0, 7.5]), archived=2)
+    assert list(frame.index) == ['Week of 1970-01-01', 'Week of 1970-01-08', 'Test 1', 'Test 2', 'Test 3']
+    assert list(frame['Archived']) == [True, True, False, False, False]
+    tests = frame[~frame['Archived']]
+    assert list(tests['Score']) == [6.0, 7.0, 7.5]
+    assert list(progress_frame(minutes[:2], np.array([6.0, 6.5]), 1, 'day').index) == ['Day 1970-01-01', 'Test 1']
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+import storage
+from conftest import add, make_entry, wait_for_compaction
+from storage import JsonStore, cohort_rollups
+
+@pytest.fixture
+def store():
+    store = JsonStore(storage.DATA_FILE)
+    store.load()
+    return store
+
+def wait_for_rollup(store, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not store.rollup_current():
+        assert time.monotonic() < deadline, "rollup never written"
+        time.sleep(0.01)
+
+def test_saves_leave_the_rollup_to_a_later_write(store, monkeypatch):
+    monkeypatch.setattr(storage, 'ROLLUP_DELAY_SECONDS', 0.2)
+    writes = []
+    write_rollup = store._write_rollup
+    monkeypatch.setattr(store, '_write_rollup', lambda: writes.append(1) or write_rollup())
+    for n in range(20):
+        store.save(add('reading', make_entry(n)))
+    assert writes == []
+    wait_for_rollup(store)
+    assert len(writes) == 1
+    assert store.read_rollup() == storage.student_rollup(store)
+
+def test_compaction_writes_the_rollup(store, monkeypatch):
+    monkeypatch.setattr(storage, 'ROLLUP_DELAY_SECONDS', 60)
+    store.save(add('writing', make_entry(1)))
+    assert not store.rollup_current()
+    store.start_compaction()
+    wait_for_compaction(store)
+    assert store.rollup_current()
+    assert store.read_rollup() == storage.student_rollup(store)
+
+def test_cohort_rebuilds_a_stale_rollup(store, monkeypatch):
+    monkeypatch.setattr(storage, 'ROLLUP_DELAY_SECONDS', 60)
+    monkeypatch.setattr(storage, 'STORAGE_ENGINE', 'json')
+    store.save(add('listening', make_entry(1, score=6.0)))
+    [row] = cohort_rollups()
+    assert row == storage.student_rollup(store)
+    assert store.rollup_current()
+    # Newer than the rollup on disk, whose rewrite has not run yet
+    time.sleep(0.01)
+    store.save(add('listening', make_entry(2, score=8.0)))
+    assert not store.rollup_current()
+    [row] = cohort_rollups()
+    assert row == storage.student_rollup(store)
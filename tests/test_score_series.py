@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+import storage
+from conftest import add, make_entry, stored, wait_for_compaction
+from storage import BULK_INSERT_THRESHOLD, JsonStore, ScoreSeries, read_snapshot, write_snapshot
+
+def standard(n):
+    return make_entry(n, score=(n % 19) / 2)
+
+def odd(n):
+    # Not the app's id format at all
+    return make_entry(n, score=(n % 19) / 2, entry_id=f"imported-{n}")
+
+def misdated(n):
+    # The app's format, but naming another day than the entry's own
+    entry = make_entry(n, score=(n % 19) / 2)
+    entry['id'] = make_entry(n + 24 * 400)['id']
+    return entry
+
+KINDS = {'standard': standard, 'odd': odd, 'misdated': misdated}
+
+def mixed(count):
+    return [KINDS[kind](n) for n in range(count) for kind in KINDS if n % 3 == list(KINDS).index(kind)]
+
+def reload_snapshot(series, path='series.snapshot'):
+    """The series after a round trip through a snapshot file read back over mmap"""
+    write_snapshot(path, {}, {'reading': series.to_columns()})
+    return read_snapshot(path)[1]['reading']
+
+def as_dicts(series):
+    return {entry['id']: entry for entry in series}
+
+@pytest.mark.parametrize('kind', list(KINDS) + ['mixed'])
+@pytest.mark.parametrize('count', [10, BULK_INSERT_THRESHOLD * 3])
+def test_add_remove_and_snapshot_round_trip(kind, count):
+    entries = mixed(count) if kind == 'mixed' else [KINDS[kind](n) for n in range(count)]
+    # Small batches are inserted one by one, large ones merged with one sort
+    series = ScoreSeries(entries)
+    assert as_dicts(series) == {entry['id']: entry for entry in entries}
+    assert [entry['datetime'] for entry in series] == sorted(entry['datetime'] for entry in entries)
+    # Only ids in the app's format for the entry's own minute avoid the side table
+    side_table = [entry for entry in entries if not entry['id'].startswith(f"{entry['date']}_{entry['time']}_")]
+    assert len(series.to_columns()[3]) == len(side_table)
+    assert (kind == 'standard') == (not side_table)
+
+    removed = entries[::4]
+    for entry in removed:
+        assert series.remove(entry['id']) == entry
+        assert entry['id'] not in series
+    assert series.remove(removed[0]['id']) is None
+    kept = {entry['id']: entry for entry in entries if entry not in removed}
+    assert as_dicts(series) == kept
+
+    reloaded = reload_snapshot(series)
+    assert as_dicts(reloaded) == kept
+    assert all(reloaded.get(entry_id) == entry for entry_id, entry in kept.items())
+    # The reloaded series keeps working: odd ids get fresh keys, removals find them
+    fresh = [odd(10_000), misdated(10_001), standard(10_002)]
+    assert reloaded.extend(fresh + fresh[:1]) == fresh
+    for entry in removed[:2]:
+        reloaded.add(entry)
+    reloaded.remove(fresh[0]['id'])
+    expected = dict(kept, **{entry['id']: entry for entry in fresh[1:] + removed[:2]})
+    assert as_dicts(reloaded) == expected
+    assert as_dicts(reload_snapshot(reloaded, 'again.snapshot')) == expected
+
+def test_extend_skips_ids_already_present_and_repeated():
+    entries = mixed(BULK_INSERT_THRESHOLD * 2)
+    series = ScoreSeries(entries[:10])
+    added = series.extend(entries + entries[:BULK_INSERT_THRESHOLD])
+    assert added == entries[10:]
+    assert len(series) == len(entries)
+    assert as_dicts(series) == {entry['id']: entry for entry in entries}
+
+def test_store_round_trip_through_journal_and_compaction():
+    entries = mixed(BULK_INSERT_THRESHOLD * 2)
+    store = JsonStore(storage.DATA_FILE)
+    store.load()
+    store.save_many([add('reading', entry) for entry in entries])
+    removed = entries[1::5]
+    store.save_many([{'op': 'remove', 'skill': 'reading', 'id': entry['id']} for entry in removed])
+    kept = {entry['id']: entry for entry in entries if entry not in removed}
+
+    journal_only = JsonStore(storage.DATA_FILE)
+    journal_only.load()
+    assert stored(journal_only, 'reading') == kept
+
+    store.start_compaction()
+    wait_for_compaction(store)
+    assert not os.path.exists(store.journal_file)
+    from_snapshot = JsonStore(storage.DATA_FILE)
+    from_snapshot.load()
+    assert stored(from_snapshot, 'reading') == kept
+    assert from_snapshot.summary('reading')['count'] == len(kept)
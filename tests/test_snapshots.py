@@ -0,0 +1,184 @@
+import os
+
+import pytest
+
+import repair
+import storage
+from conftest import add, make_entry, stored, wait_for_compaction
+from storage import SNAPSHOT_CHECKS, SNAPSHOT_MAGIC, SNAPSHOT_PREFIX, JsonStore, verify_snapshot, write_snapshot
+
+PER_GENERATION = 6
+
+@pytest.fixture(autouse=True)
+def no_rollup_writes(monkeypatch):
+    # Keep the delayed rollup write from loading the store while a test damages it
+    monkeypatch.setattr(storage, 'ROLLUP_DELAY_SECONDS', 60)
+
+def build(generations):
+    """A store compacted generations times with a journal tail, and {skill: {id: entry}} written"""
+    store = JsonStore(storage.DATA_FILE)
+    store.load()
+    n = 0
+    for generation in range(generations + 1):
+        for _ in range(PER_GENERATION):
+            store.save(add('reading', make_entry(n, score=(n % 19) / 2)))
+            store.save(add('writing', make_entry(n, tag=1)))
+            n += 1
+        # Removals in every segment, of an entry from this one and one from the first
+        store.save({'op': 'remove', 'skill': 'reading', 'id': make_entry(n - 2)['id']})
+        store.save({'op': 'remove', 'skill': 'writing', 'id': make_entry(generation, tag=1)['id']})
+        if generation < generations:
+            store.start_compaction()
+            wait_for_compaction(store)
+    assert store.generation == generations
+    return {skill: stored(store, skill) for skill in ('reading', 'writing')}
+
+def reloaded():
+    store = JsonStore(storage.DATA_FILE)
+    store.load()
+    return store
+
+def assert_entries(store, written):
+    assert {skill: stored(store, skill) for skill in written} == written
+    assert store.summary('reading')['count'] == len(written['reading'])
+
+def columns_start(path):
+    with open(path, 'rb') as f:
+        _, _, header_length = SNAPSHOT_PREFIX.unpack(f.read(SNAPSHOT_PREFIX.size))
+    start = SNAPSHOT_PREFIX.size + SNAPSHOT_CHECKS.size + header_length
+    return start + -start % 8
+
+def flip(path, offset):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)[0]
+        f.seek(offset)
+        f.write(bytes([byte ^ 0x01]))
+
+def flip_header(path):
+    # Inside the JSON header, past '{"'
+    flip(path, SNAPSHOT_PREFIX.size + SNAPSHOT_CHECKS.size + 3)
+
+def flip_columns(path):
+    flip(path, columns_start(path) + 5)
+
+def truncate(path):
+    os.truncate(path, os.path.getsize(path) - 7)
+
+@pytest.mark.parametrize('damage, problem', [
+    (flip_header, "fails its header checksum"),
+    (flip_columns, "fails its column checksum"),
+    (truncate, "bytes, expected"),
+])
+def test_damaged_live_snapshot_is_rebuilt_from_the_newest_generation(damage, problem, capsys):
+    written = build(3)
+    store = reloaded()
+    damage(store.snapshot_file)
+
+    assert repair.main(['verify']) == 1
+    [line] = [line for line in capsys.readouterr().out.splitlines() if line.startswith('DAMAGED')]
+    assert line.startswith(f"DAMAGED  {store.snapshot_file}: ") and problem in line
+    recovered = reloaded()
+    assert recovered.recovered_from == recovered._kept_file(2)
+    assert_entries(recovered, written)
+    # Rewritten as the next generation, the damaged file set aside
+    assert verify_snapshot(recovered.snapshot_file) == 4 == recovered.generation
+    assert os.path.exists(recovered.damaged_file)
+    assert not os.path.exists(recovered.journal_file)
+    again = reloaded()
+    assert again.recovered_from is None
+    assert_entries(again, written)
+    assert repair.main(['verify']) == 0
+
+def test_repair_command_rebuilds_the_snapshot(capsys):
+    written = build(2)
+    flip_columns(reloaded().snapshot_file)
+    assert repair.main(['repair']) == 0
+    assert "REPAIRED default: from" in capsys.readouterr().out
+    assert repair.main(['repair']) == 0
+    assert "ok       default: generation 3" in capsys.readouterr().out
+    assert_entries(reloaded(), written)
+
+def test_damaged_newest_generation_falls_back_to_the_one_before():
+    written = build(5)
+    store = reloaded()
+    # SNAPSHOT_KEEP snapshots kept in all, and the journals the oldest one needs
+    snapshots, segments = store.generation_files()
+    assert sorted(snapshots) == [3, 4] and sorted(segments) == [4, 5]
+    flip_columns(store.snapshot_file)
+    flip_header(snapshots[4])
+
+    recovered = reloaded()
+    assert recovered.recovered_from == snapshots[3]
+    assert_entries(recovered, written)
+    # The damaged kept generation goes with the repair; snapshot.3 still needs every later journal
+    assert not os.path.exists(snapshots[4])
+    assert recovered.generation == 6
+    recovered.save(add('reading', make_entry(1000)))
+    written['reading'][make_entry(1000)['id']] = make_entry(1000)
+    recovered.start_compaction()
+    wait_for_compaction(recovered)
+    snapshots, segments = recovered.generation_files()
+    assert sorted(snapshots) == [3, 6] and sorted(segments) == [4, 5, 6, 7]
+    assert_entries(reloaded(), written)
+
+def test_fewer_kept_generations(monkeypatch):
+    monkeypatch.setattr(storage, 'SNAPSHOT_KEEP', 2)
+    written = build(4)
+    snapshots, segments = reloaded().generation_files()
+    assert sorted(snapshots) == [3] and sorted(segments) == [4]
+    assert_entries(reloaded(), written)
+
+def test_recovery_from_the_first_journal_alone():
+    written = build(1)
+    store = reloaded()
+    snapshots, segments = store.generation_files()
+    assert snapshots == {} and sorted(segments) == [1]
+    truncate(store.snapshot_file)
+
+    recovered = reloaded()
+    assert recovered.recovered_from == segments[1]
+    assert_entries(recovered, written)
+    assert verify_snapshot(recovered.snapshot_file) == 2
+
+def test_every_generation_damaged_is_an_error():
+    build(2)
+    store = reloaded()
+    flip_header(store.snapshot_file)
+    flip_header(store._kept_file(1))
+    os.remove(store._segment_file(1))
+    with pytest.raises(storage.SnapshotError):
+        reloaded()
+    assert repair.main(['repair']) == 1
+
+def test_legacy_format_1_snapshot_loads():
+    source = JsonStore('source.json')
+    source.load()
+    entries = [make_entry(n, score=(n % 19) / 2) for n in range(20)]
+    source.save_many([add('listening', entry) for entry in entries])
+    # Format 1: the format 2 file without its checks block
+    write_snapshot('source.snapshot', source._snapshot_meta(),
+                   {skill: series.to_columns() for skill, series in source.data['scores'].items()})
+    with open('source.snapshot', 'rb') as f:
+        data = f.read()
+    magic, _, header_length = SNAPSHOT_PREFIX.unpack_from(data)
+    assert magic == SNAPSHOT_MAGIC
+    store = JsonStore(storage.DATA_FILE)
+    with open(store.snapshot_file, 'wb') as f:
+        f.write(SNAPSHOT_PREFIX.pack(magic, 1, header_length))
+        f.write(data[SNAPSHOT_PREFIX.size + SNAPSHOT_CHECKS.size:])
+
+    assert verify_snapshot(store.snapshot_file) == 0
+    store.load()
+    assert store.recovered_from is None and store.generation == 0
+    expected = {'listening': {entry['id']: entry for entry in entries}}
+    assert_entries(store, dict(expected, reading={}))
+    # The next compaction writes format 2
+    store.save(add('listening', make_entry(99)))
+    expected['listening'][make_entry(99)['id']] = make_entry(99)
+    store.start_compaction()
+    wait_for_compaction(store)
+    assert verify_snapshot(store.snapshot_file) == 1
+    # The format 1 file stays behind as generation 0
+    assert verify_snapshot(store._kept_file(0)) == 0
+    assert_entries(reloaded(), dict(expected, reading={}))
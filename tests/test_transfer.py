@@ -0,0 +1,24 @@
+import io
+
+import storage
+from conftest import add, make_entry, stored
+from storage import JsonStore
+from transfer import import_scores
+
+def test_rows_inside_the_archived_history_are_errors():
+    store = JsonStore(storage.DATA_FILE)
+    store.load()
+    store.save_many([add('reading', make_entry(n * 24)) for n in range(20)])
+    store.save({'op': 'archive', 'before': '2025-01-10', 'period': 'week', 'keep': 0})
+    cutoff = storage.minute_parts(store.archived('reading').until)[0]
+
+    # Inside the archive, new, and already stored
+    kept = make_entry(24 * 14)
+    rows = ("skill,id,date,time,score\nreading,,2025-01-05,10:00,6.5\nreading,,2025-03-01,10:00,7\n"
+            f"reading,{kept['id']},{kept['date']},{kept['time']},{kept['score']}\n")
+    report = import_scores(store, io.BytesIO(rows.encode()), 'scores.csv')
+    assert report == {
+        'rows': 3, 'imported': 1, 'duplicates': 1,
+        'errors': [('line 2', f"dated on or before {cutoff}, already rolled into the archived history")],
+    }
+    assert '2025-03-01' in {entry['date'] for entry in stored(store, 'reading').values()}
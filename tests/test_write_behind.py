@@ -0,0 +1,142 @@
+import json
+import threading
+
+import pytest
+
+import storage
+from conftest import add, make_entry, stored
+from storage import JsonStore
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(storage, 'WRITE_BEHIND_FLUSH_INTERVAL', 0.01)
+    monkeypatch.setattr(storage, 'WRITE_BEHIND_RETRY_SECONDS', 0.01)
+    store = JsonStore(storage.DATA_FILE, write_behind=True)
+    store.load()
+    yield store
+    store.flush(timeout=10)
+
+def journal(store):
+    with open(store.journal_file) as f:
+        return [json.loads(line) for line in f]
+
+def reloaded():
+    store = JsonStore(storage.DATA_FILE)
+    store.load()
+    return store
+
+def test_batches_are_written_in_save_order(store):
+    entries = [make_entry(n) for n in range(40)]
+    for n, entry in enumerate(entries):
+        store.save(add('reading', entry))
+        if n % 4 == 3:
+            store.save({'op': 'remove', 'skill': 'reading', 'id': entries[n - 1]['id']})
+    store.save_many([add('writing', entry) for entry in entries[:5]])
+    assert store.flush(timeout=10)
+
+    records = journal(store)
+    assert [record['version'] for record in records] == list(range(1, len(records) + 1))
+    expected = []
+    for n, entry in enumerate(entries):
+        expected.append(('add', entry['id']))
+        if n % 4 == 3:
+            expected.append(('remove', entries[n - 1]['id']))
+    expected += [('add', entry['id']) for entry in entries[:5]]
+    assert [(record['op'], record.get('id') or record['entry']['id']) for record in records] == expected
+    assert stored(reloaded(), 'reading') == stored(store, 'reading')
+
+def test_failed_write_is_retried_and_reported(store, monkeypatch):
+    write = store._write
+    failures = []
+
+    def failing_write(records):
+        if len(failures) < 3:
+            failures.append(records)
+            raise OSError("disk full")
+        write(records)
+    monkeypatch.setattr(store, '_write', failing_write)
+
+    entry = make_entry(1)
+    store.save(add('listening', entry))
+    # Applied in memory straight away, and still pending while the writes fail
+    assert entry['id'] in stored(store, 'listening')
+    assert store.flush(timeout=10)
+    assert len(failures) == 3
+    assert store.durability() == {'pending': 0, 'last_saved': store.last_saved, 'error': None}
+    assert stored(reloaded(), 'listening') == {entry['id']: entry}
+
+def test_error_shows_while_the_write_keeps_failing(store, monkeypatch):
+    failing = threading.Event()
+    disk_full = True
+    write = store._write
+
+    def failing_write(records):
+        if disk_full:
+            failing.set()
+            raise OSError("disk full")
+        write(records)
+    monkeypatch.setattr(store, '_write', failing_write)
+    store.save(add('listening', make_entry(1)))
+    assert failing.wait(10)
+    assert store.flush(timeout=0.1) is False
+    durability = store.durability()
+    assert durability['pending'] == 1 and durability['error'] == "disk full"
+    disk_full = False
+    assert store.flush(timeout=10)
+    assert store.durability()['error'] is None
+
+def test_flush_waits_until_the_records_are_on_disk(store, monkeypatch):
+    release = threading.Event()
+    write = store._write
+
+    def slow_write(records):
+        assert release.wait(10)
+        write(records)
+    monkeypatch.setattr(store, '_write', slow_write)
+
+    entries = [make_entry(n) for n in range(3)]
+    store.save_many([add('speaking', entry) for entry in entries])
+    assert store.flush(timeout=0.1) is False
+    assert store.durability()['pending'] == 3
+    assert stored(reloaded(), 'speaking') == {}
+
+    flushed = []
+    waiter = threading.Thread(target=lambda: flushed.append(store.flush(timeout=10)))
+    waiter.start()
+    release.set()
+    waiter.join()
+    assert flushed == [True]
+    assert store.durability()['pending'] == 0
+    assert stored(reloaded(), 'speaking') == {entry['id']: entry for entry in entries}
+
+def test_remove_queued_behind_its_add_stays_removed(store, monkeypatch):
+    started = [threading.Event(), threading.Event()]
+    release = [threading.Event(), threading.Event()]
+    landed = [threading.Event(), threading.Event()]
+    write = store._write
+    calls = []
+
+    def gated_write(records):
+        n = len(calls)
+        calls.append(records)
+        started[n].set()
+        assert release[n].wait(10)
+        write(records)
+        landed[n].set()
+    monkeypatch.setattr(store, '_write', gated_write)
+
+    entry = make_entry(1)
+    store.save(add('reading', entry))
+    assert started[0].wait(10)
+    store.save({'op': 'remove', 'skill': 'reading', 'id': entry['id']})
+    assert stored(store, 'reading') == {}
+    release[0].set()
+    assert landed[0].wait(10)
+    # The add is on disk, the remove still queued: memory keeps the remove
+    assert store.durability()['pending'] == 1
+    assert stored(store, 'reading') == {}
+    assert entry['id'] not in {item['id'] for item in store.snapshot().entries('reading')}
+    release[1].set()
+    assert store.flush(timeout=10)
+    assert stored(store, 'reading') == {}
+    assert stored(reloaded(), 'reading') == {}
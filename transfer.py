@@ -0,0 +1,329 @@
+"""Bulk import and streaming export of score histories
+
+Accepted import inputs:
+- CSV with a header row: skill, date (YYYY-MM-DD), score and optionally time
+  (HH:MM) and id
+- the JSON written by the app's Export Data button or by index.html
+- NDJSON with one {"skill", "date", "time", "score", "id"} object per line
+
+Rows are read in chunks and validated column-wise with pandas; everything that
+passes is merged into the store with a single save_many() call. pandas is only
+imported once an import starts, so loading this module for the export buttons
+stays cheap.
+
+Exports (JSON, CSV, NDJSON and, with pyarrow installed, Parquet) are produced
+chunk by chunk, so no format ever holds the whole dataset as one string.
+
+Also usable headless, e.g. for nightly backups:
+
+    $ python transfer.py export backup.parquet --skill reading --start 2025-01-01
+    $ python transfer.py --engine sqlite --user alice import backup.csv
+"""
+import argparse
+import csv
+import importlib.util
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+from storage import DEFAULT_USER, SKILLS, minute_parts, open_store
+
+IMPORT_CHUNK_ROWS = 50_000
+IMPORT_COLUMNS = ['skill', 'date', 'time', 'score', 'id']
+ENTRY_COLUMNS = ['id', 'date', 'time', 'score', 'datetime']
+TIME_PATTERN = r'^(?:[01]\d|2[0-3]):[0-5]\d$'
+
+def read_import_chunks(fileobj, file_name):
+    """Yield DataFrame chunks of an import file, each with a 'row' label for error reports"""
+    import pandas as pd
+
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == '.csv':
+        reader = pd.read_csv(fileobj, dtype=str, keep_default_na=False, chunksize=IMPORT_CHUNK_ROWS)
+        for chunk in reader:
+            chunk.columns = [column.strip().lower() for column in chunk.columns]
+            # Line 1 is the header
+            chunk['row'] = [f"line {i + 2}" for i in chunk.index]
+            yield chunk
+    elif extension in ('.ndjson', '.jsonl'):
+        reader = pd.read_json(fileobj, lines=True, dtype=False, chunksize=IMPORT_CHUNK_ROWS)
+        for chunk in reader:
+            chunk['row'] = [f"line {i + 1}" for i in chunk.index]
+            yield chunk
+    elif extension == '.json':
+        # Exports are one document, so this is the only format read whole
+        document = json.load(fileobj)
+        for skill, entries in document.get('scores', {}).items():
+            for start in range(0, len(entries), IMPORT_CHUNK_ROWS):
+                chunk = pd.DataFrame(entries[start:start + IMPORT_CHUNK_ROWS])
+                chunk['skill'] = skill
+                chunk['row'] = [f"{skill}[{i}]" for i in range(start, start + len(chunk))]
+                yield chunk
+    else:
+        raise ValueError(f"Unsupported import file type: {extension or file_name}")
+
+def validate_chunk(chunk):
+    """Split a chunk into clean entry rows and (row, message) errors"""
+    import pandas as pd
+
+    chunk = chunk.reset_index(drop=True)
+    for column in IMPORT_COLUMNS:
+        if column not in chunk:
+            chunk[column] = ''
+    text = {column: chunk[column].fillna('').astype(str).str.strip() for column in IMPORT_COLUMNS}
+
+    skill = text['skill'].str.lower()
+    score = pd.to_numeric(chunk['score'], errors='coerce')
+    parsed_date = pd.to_datetime(text['date'], format='%Y-%m-%d', errors='coerce')
+    # Accept "9:30" and bare hours as index.html stores them; no time means midnight
+    time = text['time'].str.replace(r'^(\d):', r'0\1:', regex=True)
+    time = time.where(~time.str.fullmatch(r'\d{1,2}'), time.str.zfill(2) + ':00')
+    time = time.mask(time == '', '00:00')
+
+    checks = [
+        (~skill.isin(SKILLS), "unknown skill"),
+        (score.isna(), "score is not a number"),
+        (score.notna() & ((score < 0) | (score > 9) | (score * 2 % 1 != 0)),
+         "score must be a band from 0 to 9 in 0.5 steps"),
+        (parsed_date.isna(), "date must be YYYY-MM-DD"),
+        (~time.str.fullmatch(TIME_PATTERN), "time must be HH:MM"),
+    ]
+    bad = np.zeros(len(chunk), dtype=bool)
+    messages = pd.Series('', index=chunk.index)
+    for mask, message in checks:
+        messages = messages.mask(mask, messages + message + '; ')
+        bad |= mask.to_numpy()
+    errors = list(zip(chunk['row'][bad], messages[bad].str.rstrip('; ')))
+
+    good = ~bad
+    dates = parsed_date[good].dt.strftime('%Y-%m-%d')
+    times = time[good]
+    ids = text['id'][good]
+    missing = ids == ''
+    ids = ids.mask(missing, dates + '_' + times + '_' + pd.Series(
+        [uuid.uuid4().hex[:12] for _ in range(int(missing.sum()))], index=ids[missing].index, dtype=str
+    ))
+    valid = pd.DataFrame({
+        'row': chunk['row'][good],
+        'skill': skill[good],
+        'id': ids,
+        'date': dates,
+        'time': times,
+        'score': score[good].astype(float),
+        'datetime': dates + ' ' + times,
+    })
+    return valid, errors
+
+def import_scores(store, fileobj, file_name):
+    """Validate an import file and merge its new entries into store in one save
+
+    Returns a report: rows read, entries imported, duplicates skipped (ids
+    already stored or repeated in the file) and the per-row errors, which
+    include tests dated inside the archived history.
+    """
+    report = {'rows': 0, 'imported': 0, 'duplicates': 0, 'errors': []}
+    seen = {skill: set() for skill in SKILLS}
+    records = []
+    for chunk in read_import_chunks(fileobj, file_name):
+        report['rows'] += len(chunk)
+        valid, errors = validate_chunk(chunk)
+        report['errors'].extend(errors)
+        for skill, group in valid.groupby('skill'):
+            # Tests this old are already counted in the archive tier (storage.RETENTION_DAYS)
+            until = store.archived(skill).until
+            if until is not None:
+                archived = group['datetime'].to_numpy(dtype='datetime64[m]').astype(np.int64) <= until
+                report['errors'].extend(
+                    (row, f"dated on or before {minute_parts(until)[0]}, already rolled into the archived history")
+                    for row in group['row'][archived]
+                )
+                group = group[~archived]
+            ids = group['id']
+            fresh = ~ids.duplicated() & ~ids.isin(seen[skill])
+            fresh &= ~ids.isin(store.existing_ids(skill, ids[fresh]))
+            report['duplicates'] += int((~fresh).sum())
+            seen[skill].update(ids[fresh])
+            records.extend(
+                {'op': 'add', 'skill': skill, 'entry': entry}
+                for entry in group.loc[fresh, ENTRY_COLUMNS].to_dict('records')
+            )
+    store.save_many(records)
+    report['imported'] = len(records)
+    return report
+
+
+EXPORT_CHUNK_ROWS = 10_000
+EXPORT_FIELDS = ['skill', 'id', 'date', 'time', 'score']
+EXPORT_MIME = {
+    'json': "application/json",
+    'csv': "text/csv",
+    'ndjson': "application/x-ndjson",
+    'parquet': "application/vnd.apache.parquet",
+}
+
+def export_formats():
+    """Formats that can be written here; Parquet needs pyarrow"""
+    formats = ['json', 'csv', 'ndjson']
+    if importlib.util.find_spec('pyarrow') is not None:
+        formats.append('parquet')
+    return formats
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+def iter_export_rows(store, skills=None, start_date=None, end_date=None):
+    """(skill, entry) pairs for the selected skills and dates, oldest first per skill"""
+    for skill in skills or SKILLS:
+        for entry in store.iter_entries(skill, start_date, end_date):
+            yield skill, entry
+
+def export_chunks(store, fmt, skills=None, start_date=None, end_date=None):
+    """Yield an export file as a sequence of bytes chunks"""
+    rows = iter_export_rows(store, skills, start_date, end_date)
+    if fmt == 'json':
+        yield from _json_chunks(store, skills, start_date, end_date)
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for batch in _batches(rows, EXPORT_CHUNK_ROWS):
+            writer.writerows(
+                (skill, entry['id'], entry['date'], entry['time'], entry['score'])
+                for skill, entry in batch
+            )
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    elif fmt == 'ndjson':
+        for batch in _batches(rows, EXPORT_CHUNK_ROWS):
+            yield ''.join(
+                json.dumps({'skill': skill, 'id': entry['id'], 'date': entry['date'],
+                            'time': entry['time'], 'score': entry['score']}) + '\n'
+                for skill, entry in batch
+            ).encode()
+    elif fmt == 'parquet':
+        yield from _parquet_chunks(rows)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+def _json_chunks(store, skills, start_date, end_date):
+    """The Export Data JSON layout, written skill by skill"""
+    yield b'{"scores": {'
+    for n, skill in enumerate(SKILLS):
+        yield (', ' if n else '').encode() + json.dumps(skill).encode() + b': ['
+        if skills is None or skill in skills:
+            entries = store.iter_entries(skill, start_date, end_date)
+            for m, batch in enumerate(_batches(entries, EXPORT_CHUNK_ROWS)):
+                yield (', ' if m else '').encode() + ', '.join(json.dumps(entry) for entry in batch).encode()
+        yield b']'
+    yield ('}, "target_date": ' + json.dumps(store.target_date.strftime('%Y-%m-%d'))
+           + ', "exported_at": ' + json.dumps(datetime.now().isoformat()) + '}').encode()
+
+class _ChunkSink(io.RawIOBase):
+    """Write target that hands back whatever has been written since the last drain"""
+
+    def __init__(self):
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+def _parquet_chunks(rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([('skill', pa.string()), ('id', pa.string()), ('date', pa.string()),
+                        ('time', pa.string()), ('score', pa.float64())])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        # One row group per chunk
+        for batch in _batches(rows, EXPORT_CHUNK_ROWS):
+            columns = list(zip(*((skill, entry['id'], entry['date'], entry['time'], float(entry['score']))
+                                 for skill, entry in batch)))
+            writer.write_table(pa.Table.from_arrays([pa.array(column) for column in columns], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+def write_export(store, fileobj, fmt, skills=None, start_date=None, end_date=None):
+    """Stream an export into a binary file object; returns the bytes written"""
+    written = 0
+    for chunk in export_chunks(store, fmt, skills, start_date, end_date):
+        fileobj.write(chunk)
+        written += len(chunk)
+    return written
+
+def export_to_tempfile(store, fmt, skills=None, start_date=None, end_date=None):
+    """Export into an unnamed temp file, rewound for reading"""
+    fileobj = tempfile.TemporaryFile()
+    write_export(store, fileobj, fmt, skills, start_date, end_date)
+    fileobj.seek(0)
+    return fileobj
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export IELTS Progress Tracker scores")
+    parser.add_argument('--engine', choices=['json', 'sqlite'], help="storage engine (default: IELTS_STORAGE)")
+    parser.add_argument('--user', default=DEFAULT_USER, help="user partition")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help="write scores to a file ('-' for stdout)")
+    export.add_argument('output')
+    export.add_argument('--format', choices=list(EXPORT_MIME), help="default: from the file extension")
+    export.add_argument('--skill', action='append', choices=SKILLS, help="repeat for several; default all")
+    export.add_argument('--start', help="first date, YYYY-MM-DD")
+    export.add_argument('--end', help="last date, YYYY-MM-DD")
+
+    restore = commands.add_parser('import', help="merge a CSV, JSON or NDJSON file into the store")
+    restore.add_argument('input')
+
+    args = parser.parse_args(argv)
+    # Written straight through: the process exits as soon as the command is done
+    store = open_store(args.engine, args.user, write_behind=False)
+    store.load()
+
+    if args.command == 'export':
+        fmt = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+        if fmt not in export_formats():
+            parser.error(f"cannot write format {fmt!r} (available: {', '.join(export_formats())})")
+        if args.output == '-':
+            written = write_export(store, sys.stdout.buffer, fmt, args.skill, args.start, args.end)
+        else:
+            with open(args.output, 'wb') as f:
+                written = write_export(store, f, fmt, args.skill, args.start, args.end)
+        print(f"Wrote {written} bytes of {fmt}", file=sys.stderr)
+    else:
+        try:
+            with open(args.input, 'rb') as f:
+                report = import_scores(store, f, args.input)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Imported {report['imported']} of {report['rows']} rows "
+              f"({report['duplicates']} duplicates, {len(report['errors'])} errors)", file=sys.stderr)
+        for row, problem in report['errors']:
+            print(f"  {row}: {problem}", file=sys.stderr)
+        return 1 if report['errors'] else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())